@@ -1,6 +1,7 @@
 from pathlib import Path
 import dj_database_url
 import os
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -31,6 +32,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'django_extensions',
     'django.contrib.sites',
 
@@ -49,10 +51,13 @@ SITE_ID = 1
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.PerformanceMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.middleware.RoleMiddleware',
+    'core.profiling.ProfilingMiddleware',
     'allauth.account.middleware.AccountMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -94,7 +99,7 @@ MIDDLEWARE.insert(1, "whitenoise.middleware.WhiteNoiseMiddleware")
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.template_backends.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -102,6 +107,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'users.context_processors.viewer',
             ],
         },
     },
@@ -124,6 +130,122 @@ DATABASES = {
     }
 }
 
+# Async read path
+# ASYNC_VIEWS serves the category list, thread lists, thread pages and search
+# from forum/async_views.py; run it under the ASGI worker (see gunicorn.conf.py).
+# ASYNC_PARALLEL_QUERIES lets a page's independent queries run at the same time
+# on separate connections, which only pays off on PostgreSQL.
+
+ASYNC_VIEWS = bool(int(os.environ.get("ASYNC_VIEWS", 0)))
+ASYNC_PARALLEL_QUERIES = bool(int(os.environ.get("ASYNC_PARALLEL_QUERIES", 0)))
+
+# Connections
+# SQL_CONN_MODE picks how each worker gets its database connection:
+#   close       open and close one per request (Django's default, and the
+#               default under ASYNC_VIEWS)
+#   persistent  keep it for SQL_CONN_MAX_AGE seconds, health-checked before reuse;
+#               not allowed with ASYNC_VIEWS, where ORM calls run on whichever
+#               thread is free and a kept connection may never be reused or closed
+#   pool        psycopg 3 pool per process, SQL_POOL_MIN_SIZE..SQL_POOL_MAX_SIZE
+#               connections, waiting up to SQL_POOL_TIMEOUT seconds for one
+#               (PostgreSQL only; needs psycopg[pool] in place of psycopg2)
+# See "Database connections" in the README for sizing against gunicorn workers.
+
+SQL_CONN_MODE = os.environ.get("SQL_CONN_MODE", "close" if ASYNC_VIEWS else "persistent")
+
+if ASYNC_VIEWS and SQL_CONN_MODE == "persistent":
+    raise ImproperlyConfigured("SQL_CONN_MODE=persistent can't be used with ASYNC_VIEWS; use pool or close")
+
+if SQL_CONN_MODE == "persistent":
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.environ.get("SQL_CONN_MAX_AGE", 60))
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+elif SQL_CONN_MODE == "pool":
+    # The pool owns connection lifetime, so CONN_MAX_AGE must stay 0
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.environ.get("SQL_POOL_MIN_SIZE", 2)),
+            "max_size": int(os.environ.get("SQL_POOL_MAX_SIZE", 4)),
+            "timeout": float(os.environ.get("SQL_POOL_TIMEOUT", 10)),
+        }
+    }
+elif SQL_CONN_MODE != "close":
+    raise ImproperlyConfigured(f"Unknown SQL_CONN_MODE {SQL_CONN_MODE!r}")
+
+# Cache
+# LocMemCache is per process, so generation bumps only reach the worker that
+# made the write. Run more than one worker only with a shared CACHE_BACKEND
+# (e.g. django.core.cache.backends.redis.RedisCache or the database cache).
+
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("CACHE_LOCATION", "sdforum"),
+    }
+}
+
+PAGE_CACHE_SECONDS = int(os.environ.get("PAGE_CACHE_SECONDS", 600))
+
+# Performance instrumentation (core.middleware)
+# Every request logs one JSON line (view, SQL count/time, duplicate queries,
+# markdown, mention and template time) to the core.middleware logger, at
+# WARNING when it goes over a budget. PERF_VIEW_BUDGETS overrides the budgets
+# per URL name, e.g. {"forum:thread_detail": {"queries": 15, "ms": 200}}.
+
+PERF_SERVER_TIMING = bool(int(os.environ.get("PERF_SERVER_TIMING", 1)))
+PERF_QUERY_BUDGET = int(os.environ.get("PERF_QUERY_BUDGET", 30))
+PERF_LATENCY_BUDGET_MS = float(os.environ.get("PERF_LATENCY_BUDGET_MS", 500))
+PERF_VIEW_BUDGETS = {}
+
+# Prometheus metrics (core.metrics), served at /metrics/ to staff or to a
+# scraper sending "Authorization: Bearer $METRICS_TOKEN". Each worker process
+# writes its counts to METRICS_DIR every METRICS_FLUSH_SECONDS; all workers
+# must share the directory. Files not rewritten for METRICS_RETIRE_SECONDS
+# belong to dead processes and are folded into a retired total.
+
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", 5))
+METRICS_RETIRE_SECONDS = float(os.environ.get("METRICS_RETIRE_SECONDS", 600))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# Request profiling (core.profiling). Staff send "X-Profile: 1" for a cProfile
+# dump or "X-Profile: collapsed" for flamegraph stacks; PROFILE_SAMPLE_RATE=N
+# also profiles one request in N (0 turns sampling off). Profiles are listed
+# at /admin/profiles/ and the oldest are deleted past either limit.
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+PROFILE_SAMPLE_RATE = int(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0.002))
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", 50))
+PROFILE_MAX_BYTES = int(os.environ.get("PROFILE_MAX_BYTES", 50 * 1024 * 1024))
+
+# Thread view counts (forum.view_counts). Workers count views in memory, skip
+# a viewer seen on the same thread in the last VIEW_DEDUPE_SECONDS and spool
+# totals to VIEW_COUNT_DIR every VIEW_COUNT_SPOOL_SECONDS; flush_view_counts
+# --loop writes them to the database. Workers and the flusher must share the
+# directory. VIEW_DEDUPE_BITS sizes each worker's Bloom filters (two of them).
+
+VIEW_COUNT_DIR = os.environ.get("VIEW_COUNT_DIR")
+VIEW_COUNT_SPOOL_SECONDS = float(os.environ.get("VIEW_COUNT_SPOOL_SECONDS", 5))
+VIEW_DEDUPE_SECONDS = float(os.environ.get("VIEW_DEDUPE_SECONDS", 1800))
+VIEW_DEDUPE_BITS = int(os.environ.get("VIEW_DEDUPE_BITS", 2 ** 20))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "message": {"format": "%(message)s"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "message"},
+    },
+    "loggers": {
+        "core.middleware": {
+            "handlers": ["console"],
+            "level": os.environ.get("PERF_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
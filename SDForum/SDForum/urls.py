@@ -6,4 +6,5 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('allauth.urls')),
     path('forum/', include("forum.urls")),
+    path('users/', include("users.urls")),
 ]
@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+
+#Stats for the request being handled; None outside PerformanceMiddleware.
+#sync_to_async copies the context, so ORM calls in worker threads still count.
+current_stats = ContextVar("current_stats", default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        self.statements = Counter()
+        #Milliseconds per subsystem, e.g. "markdown" or "template"
+        self.timings = {}
+        self.active = set()
+
+    @property
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    #Statements run more than once with the same parameters, i.e. N+1 suspects
+    @property
+    def duplicates(self):
+        return {sql: n for (sql, _), n in self.statements.items() if n > 1}
+
+    @property
+    def duplicate_count(self):
+        return sum(n - 1 for n in self.statements.values() if n > 1)
+
+    def add(self, name, ms):
+        self.timings[name] = self.timings.get(name, 0.0) + ms
+
+
+#Time a block under name for the current request. A nested block with the same
+#name (a template rendered from inside a template) isn't counted twice.
+@contextmanager
+def timed(name):
+    stats = current_stats.get()
+    if stats is None or name in stats.active:
+        yield
+        return
+    stats.active.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.active.discard(name)
+        stats.add(name, (time.perf_counter() - start) * 1000)
+
+
+#Installed on every connection (see core.signals); a no-op outside a request
+def record_query(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.sql_ms += (time.perf_counter() - start) * 1000
+        stats.sql_count += 1
+        stats.statements[(sql, repr(params))] += 1
+
+
+#Where the running query came from: the template line being rendered, if
+#any, and the innermost line of project code, e.g.
+#"forum/thread_list.html line 65 (via forum/models.py:40 in __str__)"
+def query_origin():
+    project = str(settings.BASE_DIR) + os.sep
+    frame = sys._getframe(1)
+    code_path = None
+    while frame is not None:
+        node = frame.f_locals.get("self") if frame.f_code.co_name == "render_annotated" else None
+        if getattr(node, "token", None) is not None and getattr(node, "origin", None) is not None:
+            line = f"{node.origin.template_name} line {node.token.lineno}"
+            return f"{line} (via {code_path})" if code_path else line
+        filename = frame.f_code.co_filename
+        if code_path is None and filename.startswith(project) and filename != __file__:
+            code_path = f"{filename[len(project):]}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return code_path or "unknown"
+
+
+#Every query run on connection inside the block, as (sql, origin) pairs
+@contextmanager
+def trace_queries(connection):
+    queries = []
+
+    def trace(execute, sql, params, many, context):
+        queries.append((sql, query_origin()))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(trace):
+        yield queries
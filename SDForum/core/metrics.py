@@ -0,0 +1,282 @@
+import atexit
+import glob
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from django.conf import settings
+
+#Each process keeps its own counts in memory and a background thread writes
+#them to METRICS_DIR/<host>-<pid>-<start>.json every METRICS_FLUSH_SECONDS; the
+#endpoint adds the files up. The host keeps containers sharing the directory
+#(web and mailer) apart, since their pids overlap, and the start time keeps a
+#restarted container that reuses a pid from overwriting the old file. Files that
+#stop being rewritten belong to dead processes: the endpoint folds them into
+#retired.json and deletes them, so totals never go backwards and the directory
+#doesn't grow with every restart. Recording is a dict update under a lock, never
+#I/O.
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 100, 200)
+RETIRED = "retired.json"
+
+HISTOGRAMS = {
+    "sdforum_request_duration_seconds": (SECONDS_BUCKETS, "Request latency by URL name"),
+    "sdforum_request_queries": (QUERY_BUCKETS, "SQL queries per request by URL name"),
+    "sdforum_search_duration_seconds": (SECONDS_BUCKETS, "Search backend latency"),
+}
+COUNTERS = {
+    "sdforum_cache_requests_total": "Cache lookups by cache and result (hit/miss)",
+    "sdforum_emails_queued_total": "Notification emails queued in the outbox",
+    "sdforum_emails_total": "Outbox delivery attempts by result (sent/retry/failed)",
+}
+
+
+def metrics_dir():
+    return getattr(settings, "METRICS_DIR", None) or os.path.join(
+        tempfile.gettempdir(), "sdforum-metrics"
+    )
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.pid = None
+        self.started = None
+
+    def inc(self, name, labels=(), value=1):
+        self.start()
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        self.start()
+        key = (name, labels)
+        buckets = HISTOGRAMS[name][0]
+        with self.lock:
+            row = self.histograms.get(key)
+            if row is None:
+                #One slot per bucket plus +Inf, then sum and count
+                row = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0, 0]
+            row[bisect_left(buckets, value)] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    #Forked workers inherit the parent's registry, so counts restart per pid
+    def start(self):
+        pid = os.getpid()
+        if self.pid == pid:
+            return
+        with self.lock:
+            if self.pid == pid:
+                return
+            self.pid = pid
+            self.started = time.time_ns()
+            self.counters.clear()
+            self.histograms.clear()
+        threading.Thread(target=self.flush_forever, daemon=True).start()
+        atexit.register(self.flush)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": [[name, labels, value] for (name, labels), value in self.counters.items()],
+                "histograms": [[name, labels, list(row)] for (name, labels), row in self.histograms.items()],
+            }
+
+    def flush(self):
+        if self.pid != os.getpid():
+            return
+        directory = metrics_dir()
+        os.makedirs(directory, exist_ok=True)
+        name = f"{socket.gethostname()}-{self.pid}-{self.started}.json"
+        write(os.path.join(directory, name), self.snapshot())
+
+    def flush_forever(self):
+        while True:
+            time.sleep(getattr(settings, "METRICS_FLUSH_SECONDS", 5))
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+
+#Write then rename, so a reader never sees half a file
+def write(path, data):
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+registry = Registry()
+
+
+def labels(**values):
+    return tuple(sorted(values.items()))
+
+
+def observe_request(view_name, seconds, queries):
+    view = labels(view=view_name or "unmatched")
+    registry.observe("sdforum_request_duration_seconds", seconds, view)
+    registry.observe("sdforum_request_queries", queries, view)
+
+
+def cache_lookup(cache_name, hits, misses=0):
+    if hits:
+        registry.inc("sdforum_cache_requests_total", labels(cache=cache_name, result="hit"), hits)
+    if misses:
+        registry.inc("sdforum_cache_requests_total", labels(cache=cache_name, result="miss"), misses)
+
+
+#Adds one file's counts to the totals; False if it couldn't be read right now.
+#A file that isn't valid JSON counts as empty.
+def read(path, counters, histograms):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except ValueError:
+        return True
+    except OSError:
+        return False
+    for name, pairs, value in data["counters"]:
+        key = (name, tuple(map(tuple, pairs)))
+        counters[key] = counters.get(key, 0) + value
+    for name, pairs, row in data["histograms"]:
+        key = (name, tuple(map(tuple, pairs)))
+        total = histograms.setdefault(key, [0] * len(row))
+        for i, value in enumerate(row):
+            total[i] += value
+    return True
+
+
+#Only one exporter folds and reads at a time, otherwise a scrape landing between
+#the new retired.json and the deletes would count the dead files twice. A lock
+#left by a crashed exporter is broken after a while; if the lock can't be had
+#the caller reads without folding.
+@contextmanager
+def exporter_lock(directory, timeout=2):
+    path = os.path.join(directory, ".lock")
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            pass
+        try:
+            if os.path.getmtime(path) < time.time() - 30:
+                os.remove(path)
+                continue
+        except FileNotFoundError:
+            continue
+        if time.monotonic() > deadline:
+            yield False
+            return
+        time.sleep(0.05)
+    try:
+        yield True
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+#Folds the files of processes that stopped writing into retired.json. A live
+#process rewrites its file every METRICS_FLUSH_SECONDS, idle or not.
+def retire(directory):
+    cutoff = time.time() - getattr(settings, "METRICS_RETIRE_SECONDS", 600)
+    stale = []
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        try:
+            if os.path.basename(path) != RETIRED and os.path.getmtime(path) < cutoff:
+                stale.append(path)
+        except OSError:
+            continue
+    if not stale:
+        return
+    counters, histograms = {}, {}
+    retired = os.path.join(directory, RETIRED)
+    #Never replace a total that couldn't be read
+    if os.path.exists(retired) and not read(retired, counters, histograms):
+        return
+    folded = [path for path in stale if read(path, counters, histograms)]
+    write(retired, {
+        "counters": [[name, pairs, value] for (name, pairs), value in counters.items()],
+        "histograms": [[name, pairs, row] for (name, pairs), row in histograms.items()],
+    })
+    for path in folded:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+#Counters and histograms from every process that has written to METRICS_DIR
+def collect():
+    registry.flush()
+    directory = metrics_dir()
+    os.makedirs(directory, exist_ok=True)
+    counters, histograms = {}, {}
+    with exporter_lock(directory) as locked:
+        if locked:
+            retire(directory)
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            read(path, counters, histograms)
+    return counters, histograms
+
+
+def format_labels(pairs, **extra):
+    items = list(pairs) + list(extra.items())
+    if not items:
+        return ""
+    escaped = [
+        '%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in items
+    ]
+    return "{" + ",".join(escaped) + "}"
+
+
+#Prometheus text exposition format, version 0.0.4
+def render_prometheus():
+    counters, histograms = collect()
+    lines = []
+
+    for name, help_text in COUNTERS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for (metric, pairs), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{format_labels(pairs)} {value}")
+
+    for name, (buckets, help_text) in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for (metric, pairs), row in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip([*buckets, "+Inf"], row):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(pairs, le=bound)} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(pairs)} {row[-2]}")
+            lines.append(f"{name}_count{format_labels(pairs)} {row[-1]}")
+
+    #Hit ratio per cache, so dashboards don't have to derive it
+    name = "sdforum_cache_hit_ratio"
+    lines += [f"# HELP {name} Share of cache lookups that hit", f"# TYPE {name} gauge"]
+    by_cache = {}
+    for (metric, pairs), value in counters.items():
+        if metric == "sdforum_cache_requests_total":
+            values = dict(pairs)
+            hits, total = by_cache.get(values["cache"], (0, 0))
+            by_cache[values["cache"]] = (hits + value * (values["result"] == "hit"), total + value)
+    for cache_name, (hits, total) in sorted(by_cache.items()):
+        lines.append(f'{name}{{cache="{cache_name}"}} {hits / total:.4f}')
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,105 @@
+import json
+import logging
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from . import metrics
+from .instrumentation import RequestStats, current_stats
+
+logger = logging.getLogger(__name__)
+
+#RequestStats timings reported in Server-Timing and the log, besides SQL
+SUBSYSTEMS = ("markdown", "mentions", "template")
+
+
+def budgets_for(view_name):
+    budgets = {
+        "queries": settings.PERF_QUERY_BUDGET,
+        "ms": settings.PERF_LATENCY_BUDGET_MS,
+    }
+    budgets.update(settings.PERF_VIEW_BUDGETS.get(view_name, {}))
+    return budgets
+
+
+def server_timing(stats, total_ms):
+    entries = [
+        f'sql;dur={stats.sql_ms:.1f};desc="{stats.sql_count} queries, '
+        f'{stats.duplicate_count} duplicate"'
+    ]
+    entries += [
+        f"{name};dur={stats.timings[name]:.1f}"
+        for name in SUBSYSTEMS if name in stats.timings
+    ]
+    entries.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(entries)
+
+
+#Times each request's SQL, markdown, mention lookups and templates, then
+#reports them in a Server-Timing header and one JSON log line per request
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.finish(request, response, stats)
+
+    def finish(self, request, response, stats):
+        total_ms = stats.elapsed_ms
+        match = getattr(request, "resolver_match", None)
+        view_name = match.view_name if match else None
+
+        metrics.observe_request(view_name, total_ms / 1000, stats.sql_count)
+
+        budgets = budgets_for(view_name)
+        over_budget = []
+        if stats.sql_count > budgets["queries"]:
+            over_budget.append("queries")
+        if total_ms > budgets["ms"]:
+            over_budget.append("latency")
+
+        if settings.PERF_SERVER_TIMING:
+            response["Server-Timing"] = server_timing(stats, total_ms)
+
+        entry = {
+            "view": view_name,
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "ms": round(total_ms, 1),
+            "sql": stats.sql_count,
+            "sql_ms": round(stats.sql_ms, 1),
+            "duplicates": stats.duplicate_count,
+            **{f"{name}_ms": round(stats.timings.get(name, 0.0), 1) for name in SUBSYSTEMS},
+            "over_budget": over_budget,
+        }
+        if stats.duplicate_count:
+            #The worst offenders, enough to find the loop that issues them
+            worst = sorted(stats.duplicates.items(), key=lambda item: -item[1])[:3]
+            entry["duplicate_sql"] = [{"sql": sql[:200], "times": n} for sql, n in worst]
+        logger.log(
+            logging.WARNING if over_budget else logging.INFO,
+            json.dumps(entry, separators=(",", ":"))
+        )
+        return response
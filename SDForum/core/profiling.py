@@ -0,0 +1,230 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .instrumentation import current_stats
+
+#A staff user sends "X-Profile: 1" (pstats) or "X-Profile: collapsed" (stacks
+#for flamegraph.pl / speedscope); PROFILE_SAMPLE_RATE = N also profiles one
+#request in N from anyone. Results go to PROFILE_DIR, named after the view,
+#query count and latency, and the oldest are deleted past the size limits.
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {"pstats": "prof", "collapsed": "txt"}
+NAME_RE = re.compile(
+    r"^(?P<stamp>\d{8}T\d{6})-(?P<pid>\d+)-(?P<serial>\d+)_(?P<view>[\w.-]+)_(?P<queries>\d+)q_(?P<ms>\d+)ms\.(?P<ext>prof|txt)$"
+)
+
+
+def profile_dir():
+    return getattr(settings, "PROFILE_DIR", None) or os.path.join(
+        tempfile.gettempdir(), "sdforum-profiles"
+    )
+
+
+#Samples the stack of one thread every interval seconds, like py-spy but
+#in-process, and counts identical stacks in the collapsed flamegraph format
+class StackSampler:
+    def __init__(self, interval):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def enable(self):
+        self.thread.start()
+
+    def disable(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def requested_format(request):
+    value = request.headers.get("X-Profile", "").strip().lower()
+    if not value or not request.user.is_staff:
+        return None
+    return "collapsed" if value == "collapsed" else "pstats"
+
+
+def sampled():
+    rate = settings.PROFILE_SAMPLE_RATE
+    return rate > 0 and random.randrange(rate) == 0
+
+
+serial = 0
+serial_lock = threading.Lock()
+#Profilers hook the whole interpreter, so one profiled request at a time
+profile_lock = threading.Lock()
+
+
+def save(profiler, fmt, view_name, queries, ms):
+    global serial
+    with serial_lock:
+        serial += 1
+        number = serial
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    view = re.sub(r"[^\w.-]", ".", view_name or "unmatched")
+    name = (
+        f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{os.getpid()}-{number}"
+        f"_{view}_{queries}q_{round(ms)}ms.{FORMATS[fmt]}"
+    )
+    path = os.path.join(directory, name)
+    #Write then rename, so the admin page never lists half a file
+    if fmt == "pstats":
+        profiler.dump_stats(path + ".tmp")
+    else:
+        profiler.dump(path + ".tmp")
+    os.replace(path + ".tmp", path)
+    rotate()
+    return name
+
+
+def stored_profiles():
+    directory = profile_dir()
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        match = NAME_RE.match(name)
+        if not match:
+            continue
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except FileNotFoundError:
+            continue
+        profiles.append({
+            "name": name,
+            "view": match["view"].replace(".", ":", 1),
+            "queries": int(match["queries"]),
+            "ms": int(match["ms"]),
+            "format": "pstats" if match["ext"] == "prof" else "collapsed",
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+        })
+    profiles.sort(key=lambda profile: (profile["mtime"], profile["name"]), reverse=True)
+    return profiles
+
+
+#Newest first; drop whatever is past PROFILE_MAX_FILES or PROFILE_MAX_BYTES
+def rotate():
+    total = 0
+    for i, profile in enumerate(stored_profiles()):
+        total += profile["size"]
+        if i >= settings.PROFILE_MAX_FILES or total > settings.PROFILE_MAX_BYTES:
+            try:
+                os.remove(os.path.join(profile_dir(), profile["name"]))
+            except FileNotFoundError:
+                pass
+
+
+def profile_path(name):
+    if not NAME_RE.match(name):
+        return None
+    path = os.path.join(profile_dir(), name)
+    return path if os.path.isfile(path) else None
+
+
+#Goes after RoleMiddleware, which resolves request.user in async mode too.
+#Under ASGI the profilers see the event loop thread, so a busy server mixes
+#in other requests' coroutines; profile a quiet worker where that matters.
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        fmt = self.format_for(request)
+        if fmt is None:
+            return self.get_response(request)
+        try:
+            profiler, stats, before = self.start(fmt)
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            return self.finish(request, response, profiler, fmt, stats, before)
+        finally:
+            profile_lock.release()
+
+    async def __acall__(self, request):
+        fmt = self.format_for(request)
+        if fmt is None:
+            return await self.get_response(request)
+        try:
+            profiler, stats, before = self.start(fmt)
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.disable()
+            return self.finish(request, response, profiler, fmt, stats, before)
+        finally:
+            profile_lock.release()
+
+    #None, or the format to profile in with profile_lock held
+    def format_for(self, request):
+        fmt = requested_format(request)
+        if fmt is None and sampled():
+            fmt = "pstats"
+        if fmt is None or not profile_lock.acquire(blocking=False):
+            return None
+        return fmt
+
+    def start(self, fmt):
+        if fmt == "pstats":
+            profiler = cProfile.Profile()
+        else:
+            profiler = StackSampler(settings.PROFILE_SAMPLE_INTERVAL)
+        stats = current_stats.get()
+        before = (time.perf_counter(), stats.sql_count if stats else 0)
+        profiler.enable()
+        return profiler, stats, before
+
+    def finish(self, request, response, profiler, fmt, stats, before):
+        started, queries_before = before
+        ms = (time.perf_counter() - started) * 1000
+        queries = stats.sql_count - queries_before if stats else 0
+        match = getattr(request, "resolver_match", None)
+        #A full or read-only PROFILE_DIR costs the profile, not the response
+        try:
+            name = save(profiler, fmt, match.view_name if match else None, queries, ms)
+        except OSError as e:
+            logger.warning(f"Could not store profile for {request.path}: {e}")
+            return response
+        if request.user.is_staff:
+            response["X-Profile-Id"] = name
+        return response
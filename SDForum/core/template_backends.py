@@ -0,0 +1,17 @@
+from django.template.backends.django import DjangoTemplates, Template
+from .instrumentation import timed
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timed("template"):
+            return super().render(context, request)
+
+
+#DjangoTemplates that reports render time to the performance middleware
+class TimedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
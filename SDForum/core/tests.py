@@ -1,3 +1,191 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from forum.models import Category, Reply, Thread
+from .instrumentation import RequestStats, current_stats, timed
+from .metrics import labels, registry
+from .profiling import stored_profiles
 
-# Create your tests here.
+User = get_user_model()
+
+
+class PerformanceMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.category = Category.objects.create(name="General", slug="general")
+        cls.thread = Thread.objects.create(
+            category=cls.category, author=cls.author, title="Hello", content="Body", reply_count=2
+        )
+        for _ in range(2):
+            Reply.objects.create(thread=cls.thread, author=cls.author, content="Reply")
+
+    def setUp(self):
+        cache.clear()
+
+    def get_logged(self, url):
+        with self.assertLogs("core.middleware", level="INFO") as logs:
+            response = self.client.get(url)
+        return response, json.loads(logs.records[-1].getMessage())
+
+    def test_server_timing_and_log_line(self):
+        response, entry = self.get_logged(reverse("forum:thread_detail", args=[self.thread.pk]))
+
+        timing = response["Server-Timing"]
+        self.assertIn("sql;dur=", timing)
+        self.assertIn("template;dur=", timing)
+        self.assertIn("total;dur=", timing)
+        self.assertEqual(entry["view"], "forum:thread_detail")
+        self.assertEqual(entry["status"], 200)
+        self.assertGreater(entry["sql"], 0)
+        self.assertEqual(entry["over_budget"], [])
+
+    @override_settings(PERF_VIEW_BUDGETS={"forum:thread_detail": {"queries": 1}})
+    def test_going_over_a_budget_logs_a_warning(self):
+        with self.assertLogs("core.middleware", level="WARNING") as logs:
+            self.client.get(reverse("forum:thread_detail", args=[self.thread.pk]))
+        self.assertEqual(json.loads(logs.records[-1].getMessage())["over_budget"], ["queries"])
+
+    def test_repeated_queries_are_reported_as_duplicates(self):
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        try:
+            for _ in range(3):
+                Thread.objects.filter(pk=self.thread.pk).exists()
+            with timed("template"):
+                with timed("template"):
+                    pass
+        finally:
+            current_stats.reset(token)
+
+        self.assertEqual(stats.sql_count, 3)
+        self.assertEqual(stats.duplicate_count, 2)
+        self.assertEqual(list(stats.timings), ["template"])
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user("staff", password="pw", is_staff=True)
+        cls.student = User.objects.create_user("student", password="pw")
+        category = Category.objects.create(name="General", slug="general")
+        cls.thread = Thread.objects.create(
+            category=category, author=cls.student, title="Hello", content="Body"
+        )
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.enterContext(override_settings(METRICS_DIR=self.directory, METRICS_TOKEN="secret"))
+
+    def test_staff_see_request_histograms(self):
+        self.client.get(reverse("forum:thread_detail", args=[self.thread.pk]))
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("core:metrics"))
+
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('sdforum_request_duration_seconds_bucket{view="forum:thread_detail",le="+Inf"}', body)
+        self.assertIn('sdforum_request_queries_count{view="forum:thread_detail"}', body)
+        self.assertIn('sdforum_cache_hit_ratio{cache="page"}', body)
+
+    def test_other_users_need_the_token(self):
+        self.client.force_login(self.student)
+        self.assertEqual(self.client.get(reverse("core:metrics")).status_code, 403)
+        response = self.client.get(reverse("core:metrics"), headers={"Authorization": "Bearer secret"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_counts_from_other_workers_are_added(self):
+        key = labels(cache="test", result="hit")
+        registry.inc("sdforum_cache_requests_total", key, 2)
+        with open(os.path.join(self.directory, "mailer-999999-1.json"), "w") as f:
+            json.dump({"counters": [["sdforum_cache_requests_total", key, 3]], "histograms": []}, f)
+
+        response = self.client.get(reverse("core:metrics"), headers={"Authorization": "Bearer secret"})
+        self.assertIn('sdforum_cache_requests_total{cache="test",result="hit"} 5', response.content.decode())
+
+    def test_dead_processes_are_folded_into_the_retired_total(self):
+        key = labels(cache="retired", result="hit")
+        for name, value in [("retired.json", 4), ("mailer-999999-1.json", 3), ("mailer-999999-2.json", 2)]:
+            with open(os.path.join(self.directory, name), "w") as f:
+                json.dump({"counters": [["sdforum_cache_requests_total", key, value]], "histograms": []}, f)
+        #The first mailer stopped writing long ago; the second is alive
+        dead = os.path.join(self.directory, "mailer-999999-1.json")
+        os.utime(dead, (time.time() - 3600, time.time() - 3600))
+
+        for _ in range(2):
+            response = self.client.get(reverse("core:metrics"), headers={"Authorization": "Bearer secret"})
+            self.assertIn('sdforum_cache_requests_total{cache="retired",result="hit"} 9', response.content.decode())
+        self.assertFalse(os.path.exists(dead))
+        with open(os.path.join(self.directory, "retired.json")) as f:
+            self.assertEqual(json.load(f)["counters"], [["sdforum_cache_requests_total", [["cache", "retired"], ["result", "hit"]], 7]])
+
+
+class ProfilingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user("staff", password="pw", is_staff=True)
+        cls.student = User.objects.create_user("student", password="pw")
+        category = Category.objects.create(name="General", slug="general")
+        cls.thread = Thread.objects.create(
+            category=category, author=cls.student, title="Hello", content="Body"
+        )
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(PROFILE_DIR=directory.name, PROFILE_MAX_FILES=2))
+        self.url = reverse("forum:thread_detail", args=[self.thread.pk])
+
+    def test_staff_header_stores_a_tagged_profile(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url, headers={"X-Profile": "1"})
+
+        [profile] = stored_profiles()
+        self.assertEqual(response["X-Profile-Id"], profile["name"])
+        self.assertEqual(profile["view"], "forum:thread_detail")
+        self.assertEqual(profile["format"], "pstats")
+        self.assertGreater(profile["queries"], 0)
+
+        download = self.client.get(reverse("core:profile_download", args=[profile["name"]]))
+        self.assertEqual(download.status_code, 200)
+        listing = self.client.get(reverse("core:profile_list"))
+        self.assertContains(listing, profile["name"])
+
+    def test_header_from_non_staff_is_ignored(self):
+        self.client.force_login(self.student)
+        response = self.client.get(self.url, headers={"X-Profile": "1"})
+
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(stored_profiles(), [])
+        self.assertEqual(self.client.get(reverse("core:profile_list")).status_code, 302)
+
+    def test_oldest_profiles_are_rotated_out(self):
+        self.client.force_login(self.staff)
+        for fmt in ("1", "collapsed", "1"):
+            self.client.get(self.url, headers={"X-Profile": fmt})
+        self.assertEqual(len(stored_profiles()), 2)
+
+    def test_unwritable_profile_dir_still_serves_the_page(self):
+        self.client.force_login(self.staff)
+        with mock.patch("core.profiling.save", side_effect=OSError("No space left on device")):
+            with self.assertLogs("core.profiling", "WARNING"):
+                response = self.client.get(self.url, headers={"X-Profile": "1"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("X-Profile-Id", response)
+
+    @override_settings(PROFILE_SAMPLE_RATE=1)
+    def test_sampling_profiles_anyone(self):
+        response = self.client.get(self.url)
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(len(stored_profiles()), 1)
@@ -1,8 +1,12 @@
 from django.urls import path
-from .views import home
+from .views import home, metrics, profile_download, profile_list
 
 app_name = "core"
 
 urlpatterns = [
     path("", home, name="home"),
+    path("metrics/", metrics, name="metrics"),
+    #Before the admin site's catch-all in SDForum/urls.py
+    path("admin/profiles/", profile_list, name="profile_list"),
+    path("admin/profiles/<str:name>", profile_download, name="profile_download"),
 ]
@@ -1,4 +1,39 @@
+import hmac
+from django.conf import settings
+from django.contrib import admin
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
+from .metrics import render_prometheus
+from .profiling import profile_dir, profile_path, stored_profiles
 
 def home(request):
     return render(request, "core/home.html")
+
+
+#Staff in the browser, or the scraper with the shared token
+def metrics(request):
+    token = settings.METRICS_TOKEN
+    header = request.headers.get("Authorization", "")
+    scraper = bool(token) and hmac.compare_digest(header, f"Bearer {token}")
+    if not (scraper or request.user.is_staff):
+        return HttpResponseForbidden("Not allowed")
+    return HttpResponse(render_prometheus(), content_type="text/plain; version=0.0.4")
+
+
+#Served under /admin/ with the admin's own login and staff check
+@admin.site.admin_view
+def profile_list(request):
+    return render(request, "core/profile_list.html", {
+        **admin.site.each_context(request),
+        "title": "Request profiles",
+        "profiles": stored_profiles(),
+        "directory": profile_dir(),
+    })
+
+
+@admin.site.admin_view
+def profile_download(request, name):
+    path = profile_path(name)
+    if path is None:
+        raise Http404("No such profile")
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=name)
@@ -1,5 +1,13 @@
 from django.contrib import admin
-from .models import Category, Thread, Reply, Report, Tag
+from . import moderation
+from .models import Category, Thread, Reply, Report, Tag, OutboundEmail, PendingNotification, ModerationLog
+
+def report_batch(modeladmin, request, entry):
+    modeladmin.message_user(
+        request,
+        f"{entry.threads_changed} threads and {entry.replies_changed} replies changed, "
+        f"{entry.reports_resolved} reports resolved."
+    )
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -9,16 +17,50 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Thread)
 class ThreadAdmin(admin.ModelAdmin):
-    list_display = ("title", "category", "author", "created_at", "is_locked")
-    list_filter = ("category", "is_locked")
+    list_display = ("title", "category", "author", "created_at", "is_locked", "is_deleted", "like_count", "reply_count")
+    list_filter = ("category", "is_locked", "is_deleted")
     search_fields = ("title", "content")
     filter_horizontal = ("tags",)
+    actions = ["soft_delete_selected", "restore_selected"]
+
+    @admin.action(description="Soft delete selected threads and their replies")
+    def soft_delete_selected(self, request, queryset):
+        entry = moderation.soft_delete(
+            thread_ids=list(queryset.values_list("pk", flat=True)),
+            moderator=request.user, source="ADMIN"
+        )
+        report_batch(self, request, entry)
+
+    @admin.action(description="Restore selected threads")
+    def restore_selected(self, request, queryset):
+        entry = moderation.restore(
+            thread_ids=list(queryset.values_list("pk", flat=True)),
+            moderator=request.user, source="ADMIN"
+        )
+        report_batch(self, request, entry)
 
 @admin.register(Reply)
 class ReplyAdmin(admin.ModelAdmin):
-    list_display = ("thread", "author", "created_at", "is_deleted")
+    list_display = ("thread", "author", "created_at", "is_deleted", "like_count")
     list_filter = ("is_deleted",)
     search_fields = ("content",)
+    actions = ["soft_delete_selected", "restore_selected"]
+
+    @admin.action(description="Soft delete selected replies")
+    def soft_delete_selected(self, request, queryset):
+        entry = moderation.soft_delete(
+            reply_ids=list(queryset.values_list("pk", flat=True)),
+            moderator=request.user, source="ADMIN"
+        )
+        report_batch(self, request, entry)
+
+    @admin.action(description="Restore selected replies")
+    def restore_selected(self, request, queryset):
+        entry = moderation.restore(
+            reply_ids=list(queryset.values_list("pk", flat=True)),
+            moderator=request.user, source="ADMIN"
+        )
+        report_batch(self, request, entry)
 
 @admin.register(Report)
 class ReportAdmin(admin.ModelAdmin):
@@ -30,4 +72,24 @@ class ReportAdmin(admin.ModelAdmin):
 class TagAdmin(admin.ModelAdmin):
     list_display = ("name", "slug")
     prepopulated_fields = {"slug": ("name",)}
-    search_fields = ("name",)
\ No newline at end of file
+    search_fields = ("name",)
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ("recipient", "subject", "status", "attempts", "next_attempt_at", "sent_at")
+    list_filter = ("status",)
+    search_fields = ("recipient", "subject")
+
+@admin.register(PendingNotification)
+class PendingNotificationAdmin(admin.ModelAdmin):
+    list_display = ("user", "subject", "created_at")
+    search_fields = ("user__username", "subject")
+
+@admin.register(ModerationLog)
+class ModerationLogAdmin(admin.ModelAdmin):
+    list_display = ("created_at", "moderator", "action", "source", "target_author", "threads_changed", "replies_changed", "reports_resolved")
+    list_filter = ("action", "source")
+    readonly_fields = [field.name for field in ModerationLog._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
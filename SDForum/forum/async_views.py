@@ -0,0 +1,120 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.http import Http404, HttpResponseForbidden
+from django.shortcuts import aget_object_or_404, render
+from .models import Category, Thread, Reply
+from .utils import ViewerState, viewer_activity
+from .rendering import ensure_rendered, mention_cache
+from .pagination import CursorPaginator
+from .conditional import categories_validators, category_validators, conditional_page, thread_validators
+from .cache import CATEGORIES_KEY, attach_reply_fragments, cache_anonymous_page, category_key, thread_key
+from .views import PAGE_SIZE, REPLY_ORDERING, THREAD_ORDERINGS, search_context
+from .view_counts import count_view
+
+#Async versions of the hot read pages, used when settings.ASYNC_VIEWS is on.
+#Same templates, orderings and caching as views.py; only how the queries are
+#issued differs.
+
+arender = sync_to_async(render)
+
+
+def on_own_connection(call):
+    def run():
+        try:
+            return call()
+        finally:
+            #Hand the connection back per CONN_MAX_AGE / pool, as a request would
+            close_old_connections()
+    return run
+
+
+#Run independent blocking ORM calls. The async ORM funnels a request's queries
+#through one thread; with ASYNC_PARALLEL_QUERIES each call gets its own worker
+#thread, and so its own connection, and they run at the same time.
+async def run_queries(*calls):
+    if not settings.ASYNC_PARALLEL_QUERIES:
+        return [await sync_to_async(call)() for call in calls]
+    return await asyncio.gather(*(
+        sync_to_async(on_own_connection(call), thread_sensitive=False)()
+        for call in calls
+    ))
+
+#List all the categories
+@conditional_page(categories_validators)
+@cache_anonymous_page(lambda: [CATEGORIES_KEY])
+async def category_list(request):
+    categories = [category async for category in Category.objects.all()]
+    return await arender(request, "forum/category_list.html", {
+        "categories": categories
+    })
+
+#List threads in a category
+@conditional_page(category_validators)
+@cache_anonymous_page(lambda slug: [category_key(slug)])
+async def thread_list(request, slug):
+    category = await aget_object_or_404(Category, slug=slug)
+    sort = request.GET.get("sort", "latest")
+    if sort not in THREAD_ORDERINGS:
+        sort = "latest"
+    threads = category.threads.filter(is_deleted=False).select_related("author") # type: ignore
+
+    paginator = CursorPaginator(threads, THREAD_ORDERINGS[sort], PAGE_SIZE)
+    page_obj = await sync_to_async(paginator.get_page)(request.GET.get("cursor"))
+
+    return await arender(request, "forum/thread_list.html", {
+        "category": category,
+        "page_obj": page_obj,
+        "sort": sort,
+    })
+
+#View thread details
+@count_view
+@conditional_page(thread_validators)
+@cache_anonymous_page(lambda pk: [thread_key(pk)])
+async def thread_detail(request, pk):
+    replies_qs = Reply.objects.select_related("author").filter(thread_id=pk, is_deleted=False)
+    paginator = CursorPaginator(replies_qs, REPLY_ORDERING, PAGE_SIZE)
+    cursor = request.GET.get("cursor")
+    viewer = ViewerState(request)
+
+    def activity():
+        if not viewer.is_authenticated:
+            return []
+        #Everything the viewer did in this thread; the page's replies aren't known yet
+        return viewer_activity(viewer.user, Q(thread_id=pk), Q(reply__thread_id=pk))
+
+    thread, page_obj, rows = await run_queries(
+        lambda: (
+            Thread.objects.select_related("author", "category")
+            .prefetch_related("tags").filter(pk=pk).first()
+        ),
+        lambda: paginator.get_page(cursor),
+        activity,
+    )
+    if thread is None:
+        raise Http404("No Thread matches the given query.")
+    if thread.is_deleted:
+        return HttpResponseForbidden("Thread deleted")
+
+    viewer.record(rows)
+    viewer.annotate_all([thread], page_obj.object_list)
+
+    def prepare():
+        #Only posts from an older renderer version get rendered here
+        ensure_rendered([thread, *page_obj.object_list], mention_cache(request))
+        attach_reply_fragments(page_obj.object_list)
+    await sync_to_async(prepare)()
+
+    return await arender(request, "forum/thread_detail.html", {
+        "thread": thread,
+        "page_obj": page_obj,
+        "viewer": viewer,
+    })
+
+#Search system; the search backends build raw SQL, so they run in a thread
+async def search_threads(request):
+    context = await sync_to_async(search_context)(request)
+    return await arender(request, "forum/search_results.html", context)
@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import time
+from functools import wraps
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from core.metrics import cache_lookup
+from .models import Category
+from .rendering import RENDERER_VERSION
+
+#How long a rendered anonymous page may live; writes make it unreachable sooner
+PAGE_CACHE_SECONDS = getattr(settings, "PAGE_CACHE_SECONDS", 600)
+#How long one request may hold the right to rebuild a missing page
+LOCK_SECONDS = 10
+#How long the others wait for it before rendering the page themselves; a few
+#times a slow render, not the whole lock, so a stuck holder can't stall them
+LOCK_WAIT_SECONDS = 2
+LOCK_POLL_SECONDS = 0.05
+
+CATEGORIES_KEY = "gen:categories"
+#The hot page lists threads from every category, so any thread change retires it
+HOT_KEY = "gen:hot"
+
+#Viewer-independent part of each reply block in thread_detail
+REPLY_FRAGMENT_TEMPLATE = "forum/reply_body.html"
+REPLY_FRAGMENT_SECONDS = getattr(settings, "REPLY_FRAGMENT_SECONDS", 24 * 60 * 60)
+
+
+def thread_key(pk):
+    return f"gen:thread:{pk}"
+
+
+def category_key(slug):
+    return f"gen:category:{slug}"
+
+
+#Starting from the clock means a generation that was evicted and re-created
+#still comes back higher than any number it handed out before
+def initial_generation():
+    return time.time_ns() // 1000
+
+
+def generations(keys):
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    for key in missing:
+        cache.add(key, initial_generation(), None)
+    if missing:
+        found.update(cache.get_many(missing))
+    return [found[key] for key in keys]
+
+
+async def agenerations(keys):
+    found = await cache.aget_many(keys)
+    missing = [key for key in keys if key not in found]
+    for key in missing:
+        await cache.aadd(key, initial_generation(), None)
+    if missing:
+        found.update(await cache.aget_many(missing))
+    return [found[key] for key in keys]
+
+
+def bump(*keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, initial_generation(), None)
+
+
+#Bump after commit so a reader can't cache the old rows under the new generation
+def bump_on_commit(*keys):
+    transaction.on_commit(lambda: bump(*keys))
+
+
+def invalidate_thread(thread_id):
+    invalidate_threads([thread_id])
+
+
+def invalidate_threads(thread_ids):
+    thread_ids = list(thread_ids)
+    if not thread_ids:
+        return
+
+    def run():
+        slugs = (
+            Category.objects.filter(threads__pk__in=thread_ids)
+            .values_list("slug", flat=True).distinct()
+        )
+        bump(
+            HOT_KEY,
+            *[thread_key(pk) for pk in thread_ids],
+            *[category_key(slug) for slug in slugs]
+        )
+    transaction.on_commit(run)
+
+
+def invalidate_category(slug):
+    bump_on_commit(CATEGORIES_KEY, HOT_KEY, category_key(slug))
+
+
+def page_key(request, generation_values):
+    path = hashlib.md5(request.get_full_path().encode("utf-8")).hexdigest()
+    return "page:%s:%s" % (path, ".".join(str(value) for value in generation_values))
+
+
+def is_cacheable(request, response):
+    #A page that issued a CSRF token or cookie belongs to one visitor only
+    return (
+        response.status_code == 200
+        and not response.cookies
+        and not request.META.get("CSRF_COOKIE_NEEDS_UPDATE")
+    )
+
+
+#Cache a view's page for logged-out GETs. key_func maps the view's URL kwargs
+#to the generation keys the page depends on; bumping any of them retires it.
+def cache_anonymous_page(key_func):
+    def decorator(view):
+        if iscoroutinefunction(view):
+            return async_page_cache(view, key_func)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != "GET" or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+
+            key = page_key(request, generations(key_func(*args, **kwargs)))
+            response = cache.get(key)
+            if response is not None:
+                cache_lookup("page", hits=1)
+                return response
+            cache_lookup("page", hits=0, misses=1)
+
+            #Only one request rebuilds a missing page; the rest wait for it
+            lock = key + ":lock"
+            if cache.add(lock, 1, LOCK_SECONDS):
+                try:
+                    response = view(request, *args, **kwargs)
+                    if is_cacheable(request, response):
+                        cache.set(key, response, PAGE_CACHE_SECONDS)
+                finally:
+                    cache.delete(lock)
+                return response
+
+            #Stop waiting once the lock is gone: if the page isn't there by
+            #then, the holder's response couldn't be cached (403, 404, cookie)
+            deadline = time.monotonic() + LOCK_WAIT_SECONDS
+            while time.monotonic() < deadline:
+                time.sleep(LOCK_POLL_SECONDS)
+                found = cache.get_many([key, lock])
+                if key in found:
+                    return found[key]
+                if lock not in found:
+                    break
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+#cache_anonymous_page for async views, on the cache's async API
+def async_page_cache(view, key_func):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != "GET" or request.user.is_authenticated:
+            return await view(request, *args, **kwargs)
+
+        key = page_key(request, await agenerations(key_func(*args, **kwargs)))
+        response = await cache.aget(key)
+        if response is not None:
+            cache_lookup("page", hits=1)
+            return response
+        cache_lookup("page", hits=0, misses=1)
+
+        lock = key + ":lock"
+        if await cache.aadd(lock, 1, LOCK_SECONDS):
+            try:
+                response = await view(request, *args, **kwargs)
+                if is_cacheable(request, response):
+                    await cache.aset(key, response, PAGE_CACHE_SECONDS)
+            finally:
+                await cache.adelete(lock)
+            return response
+
+        #Waiting here yields the event loop instead of a whole worker
+        deadline = time.monotonic() + LOCK_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            await asyncio.sleep(LOCK_POLL_SECONDS)
+            found = await cache.aget_many([key, lock])
+            if key in found:
+                return found[key]
+            if lock not in found:
+                break
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+#Any edit, delete or like changes updated_at, so an old fragment is never reused
+def reply_fragment_key(reply):
+    return f"reply:{reply.pk}:{reply.updated_at.timestamp()}:{RENDERER_VERSION}"
+
+
+#Set reply.body_html for a page of replies with one get_many and one set_many
+def attach_reply_fragments(replies):
+    keys = {reply_fragment_key(reply): reply for reply in replies}
+    found = cache.get_many(list(keys))
+
+    rendered = {}
+    for key, reply in keys.items():
+        if key not in found:
+            found[key] = rendered[key] = render_to_string(
+                REPLY_FRAGMENT_TEMPLATE, {"reply": reply}
+            )
+        reply.body_html = mark_safe(found[key])
+
+    if rendered:
+        cache.set_many(rendered, REPLY_FRAGMENT_SECONDS)
+    cache_lookup("reply_fragment", hits=len(keys) - len(rendered), misses=len(rendered))
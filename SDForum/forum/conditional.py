@@ -0,0 +1,155 @@
+import hashlib
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.db.models import Count, Max, Subquery
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+from courses.models import Course
+from .cache import HOT_KEY, generations
+from .models import Category, Thread, Reply, Report, Tag
+from .rendering import RENDERER_VERSION
+from .utils import count_of, latest_of, sum_of
+
+#Each validator runs one indexed query and returns (etag parts, last modified),
+#or None when the page doesn't exist and the view should answer normally.
+
+
+def newest(*timestamps):
+    return max((value for value in timestamps if value is not None), default=None)
+
+
+def thread_validators(request, pk):
+    columns = ["updated_at", "like_count", "reply_count", "is_deleted", "is_locked", "last_reply", "view_count"]
+    threads = Thread.objects.filter(pk=pk).annotate(last_reply=latest_of(Reply, "thread"))
+    if request.user.is_authenticated:
+        #The viewer's own reports change which buttons the page shows
+        threads = threads.annotate(
+            last_report=Subquery(
+                Report.objects.filter(reporter=request.user)
+                .order_by("-id").values("id")[:1]
+            )
+        )
+        columns.append("last_report")
+    row = threads.values_list(*columns).first()
+    if row is None:
+        return None
+    return row, newest(row[0], row[5])
+
+
+def category_validators(request, slug):
+    row = (
+        Category.objects.filter(slug=slug)
+        .annotate(
+            last_thread=latest_of(Thread, "category"),
+            live_threads=count_of(Thread, "category", is_deleted=False),
+            #A view count flush leaves updated_at alone but reorders ?sort=views
+            views=sum_of(Thread, "category", "view_count", is_deleted=False),
+        )
+        .values_list("updated_at", "last_thread", "live_threads", "views")
+        .first()
+    )
+    if row is None:
+        return None
+    return row, newest(row[0], row[1])
+
+
+def tag_validators(request, slug):
+    row = (
+        Tag.objects.filter(slug=slug)
+        .annotate(
+            last_thread=latest_of(Thread, "tags"),
+            threads_count=count_of(Thread.tags.through, "tag"),
+        )
+        .values_list("name", "last_thread", "threads_count")
+        .first()
+    )
+    if row is None:
+        return None
+    return row, row[1]
+
+
+def course_validators(request, slug):
+    row = (
+        Course.objects.filter(slug=slug)
+        .annotate(
+            last_thread=latest_of(Thread, "course"),
+            live_threads=count_of(Thread, "course", is_deleted=False),
+        )
+        .values_list("code", "title", "last_thread", "live_threads")
+        .first()
+    )
+    if row is None:
+        return None
+    return row, row[2]
+
+
+#Spans every category, so no single indexed query covers it; the generation
+#the page cache keys it on already moves with every change it can show
+def hot_validators(request):
+    return (generations([HOT_KEY])[0],), None
+
+
+def categories_validators(request):
+    row = Category.objects.aggregate(
+        last=Max("updated_at"),
+        categories=Count("id"),
+    )
+    return (row["last"], row["categories"]), row["last"]
+
+
+def viewer_key(request):
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}:{bool(request.is_moderator)}"
+    return "anon"
+
+
+#ETag / Last-Modified for a read-only page, checked before the view runs
+def conditional_page(validator):
+    def decorator(view):
+        def validators(request, *args, **kwargs):
+            if not hasattr(request, "_page_validators"):
+                request._page_validators = validator(request, *args, **kwargs)
+            return request._page_validators
+
+        def etag(request, *args, **kwargs):
+            found = validators(request, *args, **kwargs)
+            if found is None:
+                return None
+            parts = (RENDERER_VERSION, viewer_key(request), *found[0])
+            return hashlib.md5(repr(parts).encode("utf-8")).hexdigest()
+
+        #Last-Modified can't tell viewers apart, so only anonymous pages get it
+        def last_modified(request, *args, **kwargs):
+            found = validators(request, *args, **kwargs)
+            if found is None or request.user.is_authenticated:
+                return None
+            return found[1]
+
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                #condition() calls etag/last_modified synchronously, so run the
+                #validator query in a thread first and let them read the memo
+                await sync_to_async(validators)(request, *args, **kwargs)
+                response = await conditional_view(request, *args, **kwargs)
+                return revalidate(request, response)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            return revalidate(request, response)
+        return wrapper
+    return decorator
+
+
+#Always revalidate; the page can change on any write
+def revalidate(request, response):
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ["Cookie"])
+    return response
@@ -1,20 +1,202 @@
-from django.core.mail import send_mail
-from django.conf import settings
+import hashlib
 import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+from core.metrics import labels, registry
+from .models import OutboundEmail, PendingNotification
 
 logger = logging.getLogger(__name__)
 
+MAX_ATTEMPTS = getattr(settings, "EMAIL_OUTBOX_MAX_ATTEMPTS", 5)
+BACKOFF_SECONDS = getattr(settings, "EMAIL_OUTBOX_BACKOFF_SECONDS", 60)
+#How long a worker owns a claimed batch before another worker may retry it
+CLAIM_SECONDS = getattr(settings, "EMAIL_OUTBOX_CLAIM_SECONDS", 300)
+#A digest goes out once a user's oldest held notification is this old
+DIGEST_WINDOW_MINUTES = getattr(settings, "NOTIFICATION_DIGEST_WINDOW_MINUTES", 60)
+#Individual lines listed in one digest; the rest are only counted
+DIGEST_MAX_LINES = 20
+
+
+def dedupe_key(recipient, subject, message):
+    return hashlib.sha256(
+        "\0".join([recipient, subject, message]).encode("utf-8")
+    ).hexdigest()
+
+
+#Queue the email in the caller's transaction; send_outbox delivers it later
 def send_notification_email(subject, message, recipients):
     if not recipients:
         return
 
-    try:
-        send_mail(
-            subject=subject,
-            message=message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=recipients,
-            fail_silently=True,
+    recipients = list(dict.fromkeys(recipients))
+    OutboundEmail.objects.bulk_create(
+        [
+            OutboundEmail(
+                recipient=recipient,
+                subject=subject,
+                body=message,
+                dedupe_key=dedupe_key(recipient, subject, message),
+            )
+            for recipient in recipients
+        ],
+        #An identical notification already waiting is not queued twice
+        ignore_conflicts=True,
+    )
+    registry.inc("sdforum_emails_queued_total", value=len(recipients))
+
+
+#Email users now or hold the notification for their digest, per profile setting
+def notify_users(users, subject, message):
+    immediate = []
+    held = []
+    for user in users:
+        if not user.email:
+            continue
+        profile = getattr(user, "profile", None)
+        if profile and profile.wants_digest:
+            held.append(PendingNotification(user=user, subject=subject, message=message))
+        else:
+            immediate.append(user.email)
+
+    send_notification_email(subject, message, immediate)
+    PendingNotification.objects.bulk_create(held)
+
+
+def digest_body(notifications):
+    counts = {}
+    for notification in notifications:
+        counts[notification.subject] = counts.get(notification.subject, 0) + 1
+
+    lines = [f"You have {len(notifications)} new notifications on SDForum:", ""]
+    lines += [f"- {subject}: {count}" for subject, count in counts.items()]
+    lines.append("")
+    lines += [notification.message for notification in notifications[:DIGEST_MAX_LINES]]
+    if len(notifications) > DIGEST_MAX_LINES:
+        lines.append(f"...and {len(notifications) - DIGEST_MAX_LINES} more.")
+    return "\n".join(lines)
+
+
+#Turn every due user's held notifications into one queued digest email
+def flush_digests(window_minutes=None):
+    if window_minutes is None:
+        window_minutes = DIGEST_WINDOW_MINUTES
+    cutoff = timezone.now() - timedelta(minutes=window_minutes)
+
+    with transaction.atomic():
+        due_users = (
+            PendingNotification.objects.values("user")
+            .annotate(oldest=Min("created_at"))
+            .filter(oldest__lte=cutoff)
+            .values_list("user", flat=True)
         )
+        notifications = list(
+            PendingNotification.objects.select_for_update()
+            .filter(user__in=list(due_users))
+            .select_related("user")
+            .order_by("user", "created_at")
+        )
+        by_user = {}
+        for notification in notifications:
+            by_user.setdefault(notification.user, []).append(notification)
+
+        for user, held in by_user.items():
+            send_notification_email(
+                subject=f"Your SDForum digest ({len(held)} new)",
+                message=digest_body(held),
+                recipients=[user.email],
+            )
+        PendingNotification.objects.filter(
+            pk__in=[notification.pk for notification in notifications]
+        ).delete()
+    return len(by_user)
+
+
+def claim_batch(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status="PENDING", next_attempt_at__lte=now)
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        OutboundEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+            next_attempt_at=now + timedelta(seconds=CLAIM_SECONDS)
+        )
+    return batch
+
+
+#Count a failed attempt: back off exponentially (1, 2, 4, ... x
+#BACKOFF_SECONDS), or give up after MAX_ATTEMPTS
+def record_failure(email, error, now):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = "FAILED"
+        logger.error(f"Email to {email.recipient} failed permanently: {error}")
+    else:
+        delay = BACKOFF_SECONDS * 2 ** (email.attempts - 1)
+        email.next_attempt_at = now + timedelta(seconds=delay)
+
+
+#Send one batch over a single mail connection; returns (sent, failed)
+def deliver_outbox(batch_size=100):
+    batch = claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+
+    now = timezone.now()
+    sent = failed = 0
+    attempted = set()
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+        for email in batch:
+            message = EmailMessage(
+                subject=email.subject,
+                body=email.body,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                to=[email.recipient],
+                connection=connection,
+            )
+            attempted.add(email.pk)
+            try:
+                connection.send_messages([message])
+            except Exception as e:
+                failed += 1
+                record_failure(email, e, now)
+            else:
+                email.attempts += 1
+                sent += 1
+                email.status = "SENT"
+                email.sent_at = now
+                email.last_error = ""
     except Exception as e:
-        logger.error(f"Email sending failed: {e}")
\ No newline at end of file
+        #Could not even connect: every row not tried yet counts as a failed
+        #attempt, so a dead mail server still backs off and ends in FAILED
+        logger.error(f"Email connection failed: {e}")
+        for email in batch:
+            if email.pk not in attempted:
+                failed += 1
+                record_failure(email, e, now)
+    finally:
+        connection.close()
+
+    OutboundEmail.objects.bulk_update(
+        batch,
+        ["status", "attempts", "next_attempt_at", "last_error", "sent_at"]
+    )
+    record_delivery(batch)
+    return sent, failed
+
+
+def record_delivery(batch):
+    results = {"SENT": "sent", "PENDING": "retry", "FAILED": "failed"}
+    counts = {}
+    for email in batch:
+        counts[results[email.status]] = counts.get(results[email.status], 0) + 1
+    for result, count in counts.items():
+        registry.inc("sdforum_emails_total", labels(result=result), count)
@@ -0,0 +1,53 @@
+import statistics
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the request cycle's connection handling and time the first query "
+        "of each request. Run once per SQL_CONN_MODE to compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+
+    def handle(self, *args, **options):
+        connects = []
+
+        def count_connect(sender, connection, **kwargs):
+            connects.append(connection.alias)
+
+        connection_created.connect(count_connect)
+        try:
+            timings = [self.one_request() for _ in range(options["requests"])]
+        finally:
+            connection_created.disconnect(count_connect)
+            connection.close()
+
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f"mode={settings.SQL_CONN_MODE} vendor={connection.vendor} "
+            f"requests={len(timings)} connects={len(connects)}"
+        )
+        self.stdout.write(
+            f"first query ms: mean={statistics.mean(timings):.3f} "
+            f"p50={statistics.median(timings):.3f} p95={p95:.3f} max={timings[-1]:.3f}"
+        )
+
+    #Same signals the handler sends, so close_old_connections decides reuse
+    def one_request(self):
+        request_started.send(sender=self.__class__)
+        try:
+            start = time.perf_counter()
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            return (time.perf_counter() - start) * 1000
+        finally:
+            request_finished.send(sender=self.__class__)
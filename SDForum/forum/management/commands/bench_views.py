@@ -0,0 +1,224 @@
+import json
+import statistics
+import time
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils.http import urlencode
+from courses.models import Course
+from forum import urls as forum_urls
+from forum.models import Reply, Report, Tag, Thread
+
+VIEWERS = ("anonymous", "student", "moderator")
+
+#Which sample row fills a URL kwarg, when the kwarg name alone doesn't say
+KWARG_SAMPLES = {
+    ("pk", "report_delete"): "report",
+    ("pk", "report_safe"): "report",
+    ("pk", "report_reply"): "reply",
+    ("slug", "tag_threads"): "tag",
+    ("slug", "course_threads"): "course",
+}
+KWARG_DEFAULTS = {
+    "pk": "thread",
+    "thread_id": "thread",
+    "reply_id": "reply",
+    "user_id": "author",
+    "slug": "category",
+}
+
+
+#Form posts for the views that only write on POST; everything else is a GET
+def post_data(name, samples):
+    return {
+        "thread_create": {"title": "Benchmark", "content": "Benchmark body", "tags": "bench"},
+        "reply_create": {"content": "Benchmark reply"},
+        "report_thread": {"reason": "benchmark"},
+        "report_reply": {"reason": "benchmark"},
+        "resolve_reports": {"targets": [f"thread:{samples['thread']}"], "action": "safe"},
+        "moderate_author": {"action": "delete"},
+    }.get(name)
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive every forum URL through the test client as each kind of viewer, "
+        "record latency percentiles and query counts, and compare with a baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--only", nargs="*", default=[], help="URL names to run")
+        parser.add_argument("--cold", action="store_true", help="Clear the cache before every request")
+        parser.add_argument("--baseline", help="JSON file from an earlier --save to compare against")
+        parser.add_argument("--save", help="Write this run's results to a JSON file")
+        parser.add_argument(
+            "--tolerance", type=float, default=0.25,
+            help="Allowed p95 growth over the baseline before it counts as a regression",
+        )
+        parser.add_argument(
+            "--strict-latency", action="store_true",
+            help="Fail on latency regressions too, not only on extra queries",
+        )
+
+    def handle(self, *args, **options):
+        samples = self.samples()
+        clients = self.clients(samples)
+
+        #Lets the test client through ALLOWED_HOSTS; already done under the test runner
+        try:
+            setup_test_environment()
+        except RuntimeError:
+            owns_environment = False
+        else:
+            owns_environment = True
+
+        results = {}
+        try:
+            for pattern in forum_urls.urlpatterns:
+                if options["only"] and pattern.name not in options["only"]:
+                    continue
+                path = self.path_for(pattern, samples)
+                data = post_data(pattern.name, samples)
+                for viewer in VIEWERS:
+                    results[f"{pattern.name}[{viewer}]"] = self.measure(
+                        clients[viewer], path, data, options["repeat"], options["cold"]
+                    )
+        finally:
+            if owns_environment:
+                teardown_test_environment()
+
+        baseline = {}
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+        regressions = self.report(results, baseline, options["tolerance"], options["strict_latency"])
+
+        if options["save"]:
+            with open(options["save"], "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Saved {len(results)} results to {options['save']}")
+        if regressions:
+            raise CommandError(f"{regressions} regressions against {options['baseline']}")
+
+    #The busiest thread and things around it, so pages are as big as production's
+    def samples(self):
+        thread = (
+            Thread.objects.filter(is_deleted=False)
+            .select_related("category").order_by("-reply_count", "-id").first()
+        )
+        report = Report.objects.filter(status="PENDING").order_by("-id").first()
+        tag = Tag.objects.annotate(n=Count("threads")).order_by("-n", "id").first()
+        course = Course.objects.annotate(n=Count("threads")).order_by("-n", "id").first()
+        if not (thread and report and tag and course):
+            raise CommandError("Not enough data to benchmark; run seed_forum first")
+
+        User = get_user_model()
+        moderator = User.objects.filter(profile__role="MODERATOR").order_by("id").first()
+        student = (
+            User.objects.filter(profile__role="STUDENT").exclude(pk=thread.author_id) # type: ignore
+            .order_by("id").first()
+        )
+        if not (moderator and student):
+            raise CommandError("Need at least one student and one moderator; run seed_forum first")
+
+        return {
+            "thread": thread.pk,
+            "reply": Reply.objects.filter(thread=thread, is_deleted=False).order_by("id").values_list("pk", flat=True).first(),
+            "report": report.pk,
+            "tag": tag.slug,
+            "course": course.slug,
+            "category": thread.category.slug,
+            "author": thread.author_id, # type: ignore
+            "search": tag.name,
+            "student": student,
+            "moderator": moderator,
+        }
+
+    def clients(self, samples):
+        clients = {viewer: Client() for viewer in VIEWERS}
+        clients["student"].force_login(samples["student"])
+        clients["moderator"].force_login(samples["moderator"])
+        return clients
+
+    def path_for(self, pattern, samples):
+        kwargs = {
+            key: samples[KWARG_SAMPLES.get((key, pattern.name), KWARG_DEFAULTS[key])]
+            for key in pattern.pattern.converters
+        }
+        path = reverse(f"forum:{pattern.name}", kwargs=kwargs)
+        if pattern.name == "search_threads":
+            path += "?" + urlencode({"q": samples["search"]})
+        return path
+
+    #Each request runs in a transaction that is rolled back, so write views
+    #can be repeated against the same data
+    def request(self, client, path, data):
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                if data is None:
+                    response = client.get(path)
+                else:
+                    response = client.post(path, data)
+                elapsed = (time.perf_counter() - start) * 1000
+            transaction.set_rollback(True)
+        return response.status_code, elapsed, len(captured)
+
+    def measure(self, client, path, data, repeat, cold):
+        #Untimed first request, so role and fragment caches are as warm as in
+        #production and query counts don't depend on what ran before
+        if not cold:
+            self.request(client, path, data)
+
+        timings, queries, statuses = [], [], []
+        for _ in range(repeat):
+            if cold:
+                cache.clear()
+            status, elapsed, count = self.request(client, path, data)
+            timings.append(elapsed)
+            queries.append(count)
+            statuses.append(status)
+
+        timings.sort()
+        return {
+            "path": path,
+            "method": "GET" if data is None else "POST",
+            "status": statistics.mode(statuses),
+            "queries": max(queries),
+            "p50": round(percentile(timings, 0.5), 3),
+            "p95": round(percentile(timings, 0.95), 3),
+            "p99": round(percentile(timings, 0.99), 3),
+        }
+
+    def report(self, results, baseline, tolerance, strict_latency):
+        regressions = 0
+        self.stdout.write(f"{'view[viewer]':<34} {'status':>6} {'queries':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for key, row in results.items():
+            notes = []
+            old = baseline.get(key)
+            if old:
+                if row["queries"] > old["queries"]:
+                    notes.append(f"queries {old['queries']} -> {row['queries']}")
+                    regressions += 1
+                if row["p95"] > old["p95"] * (1 + tolerance):
+                    notes.append(f"p95 {old['p95']} -> {row['p95']}")
+                    regressions += strict_latency
+                if row["status"] != old["status"]:
+                    notes.append(f"status {old['status']} -> {row['status']}")
+                    regressions += 1
+            self.stdout.write(
+                f"{key:<34} {row['status']:>6} {row['queries']:>7} {row['p50']:>9.2f} "
+                f"{row['p95']:>9.2f} {row['p99']:>9.2f}"
+                + (f"  REGRESSION: {', '.join(notes)}" if notes else "")
+            )
+        return regressions
@@ -0,0 +1,47 @@
+import logging
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from forum.view_counts import flush_spool, requeue_claimed
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Add the thread views spooled by web workers to Thread.view_count"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep flushing the spool instead of exiting after one pass",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=10.0,
+            help="Seconds between flushes (with --loop)",
+        )
+
+    def handle(self, *args, **options):
+        requeued = requeue_claimed()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} files left by an earlier run")
+
+        while True:
+            #Drop a connection a failed pass left broken, like a request would
+            close_old_connections()
+            try:
+                updated, added = flush_spool(options["batch_size"])
+            except Exception:
+                if not options["loop"]:
+                    raise
+                #The spool is untouched; the next pass retries it
+                logger.exception("View count flush failed")
+            else:
+                if added:
+                    self.stdout.write(f"Added {added} views to {updated} threads")
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
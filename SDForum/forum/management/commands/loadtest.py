@@ -0,0 +1,99 @@
+import random
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from forum.models import Category, Tag, Thread
+
+#Share of requests per page kind, roughly what the access logs show
+MIX = (
+    ("thread_detail", 60),
+    ("thread_list", 20),
+    ("category_list", 10),
+    ("search_threads", 10),
+)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a seeded mix of forum reads against a running server and report "
+        "throughput and latency, to compare the sync and ASGI deployments"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://localhost:8000")
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument("--threads", type=int, default=50, help="Busiest threads to spread thread_detail over")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--cookie", default="", help="Cookie header, e.g. sessionid=..., for logged-in runs")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        urls = self.urls(options["threads"])
+        kinds = [kind for kind, _ in MIX if urls[kind]]
+        weights = [weight for kind, weight in MIX if urls[kind]]
+        plan = [
+            (kind, rng.choice(urls[kind]))
+            for kind in rng.choices(kinds, weights, k=options["requests"])
+        ]
+
+        headers = {"Cookie": options["cookie"]} if options["cookie"] else {}
+        base_url = options["base_url"].rstrip("/")
+
+        def fetch(item):
+            kind, path = item
+            request = urllib.request.Request(base_url + path, headers=headers)
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    response.read()
+                    ok = response.status == 200
+            except (urllib.error.URLError, OSError):
+                ok = False
+            return kind, (time.perf_counter() - start) * 1000, ok
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options["concurrency"]) as pool:
+            results = list(pool.map(fetch, plan))
+        elapsed = time.perf_counter() - started
+
+        errors = sum(1 for _, _, ok in results if not ok)
+        self.stdout.write(
+            f"{len(results)} requests, {errors} errors, {len(results) / elapsed:.1f} req/s "
+            f"at concurrency {options['concurrency']}"
+        )
+        for kind in ["all", *kinds]:
+            timings = sorted(ms for k, ms, _ in results if kind in ("all", k))
+            self.stdout.write(
+                f"{kind:<16} n={len(timings):<6} p50={percentile(timings, 0.5):.1f}ms "
+                f"p90={percentile(timings, 0.9):.1f}ms p99={percentile(timings, 0.99):.1f}ms"
+            )
+
+    def urls(self, top_threads):
+        thread_ids = (
+            Thread.objects.filter(is_deleted=False)
+            .order_by("-like_count", "-id")
+            .values_list("pk", flat=True)[:top_threads]
+        )
+        return {
+            "category_list": [reverse("forum:category_list")],
+            "thread_list": [
+                reverse("forum:thread_list", args=[slug])
+                for slug in Category.objects.order_by("id").values_list("slug", flat=True)
+            ],
+            "thread_detail": [reverse("forum:thread_detail", args=[pk]) for pk in thread_ids],
+            "search_threads": [
+                reverse("forum:search_threads") + "?q=" + urllib.parse.quote(name)
+                for name in Tag.objects.order_by("id").values_list("name", flat=True)[:20]
+            ],
+        }
@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from forum import moderation
+
+
+def id_list(value):
+    return [int(pk) for pk in value.split(",") if pk.strip()]
+
+
+class Command(BaseCommand):
+    help = "Soft delete or restore threads, replies or every post by one author"
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["delete", "restore"])
+        parser.add_argument("--threads", type=id_list, default=[], help="Comma-separated thread ids")
+        parser.add_argument("--replies", type=id_list, default=[], help="Comma-separated reply ids")
+        parser.add_argument("--author", help="Username whose posts are all affected")
+        parser.add_argument("--moderator", help="Username recorded in the moderation log")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+
+        def user(username):
+            if not username:
+                return None
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f"No user named {username!r}")
+
+        author = user(options["author"])
+        if not (options["threads"] or options["replies"] or author):
+            raise CommandError("Give --threads, --replies and/or --author")
+
+        run = moderation.soft_delete if options["action"] == "delete" else moderation.restore
+        entry = run(
+            thread_ids=options["threads"],
+            reply_ids=options["replies"],
+            author=author,
+            moderator=user(options["moderator"]),
+            source="COMMAND",
+        )
+        self.stdout.write(
+            f"{entry.threads_changed} threads and {entry.replies_changed} replies changed, "
+            f"{entry.reports_resolved} reports resolved (log #{entry.pk})"
+        )
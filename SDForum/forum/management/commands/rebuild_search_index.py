@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from forum.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index for every thread and reply"
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.rebuild()
+        self.stdout.write(f"Rebuilt search index with {type(backend).__name__}")
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from forum.models import Thread, Reply, ThreadLike, ReplyLike
+from forum.utils import count_of
+
+
+class Command(BaseCommand):
+    help = "Repair drift in the denormalized like/reply counters"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.reconcile(
+            Thread,
+            {
+                "like_count": count_of(ThreadLike, "thread"),
+                "reply_count": count_of(Reply, "thread", is_deleted=False),
+            },
+            options["batch_size"],
+        )
+        self.reconcile(
+            Reply,
+            {"like_count": count_of(ReplyLike, "reply")},
+            options["batch_size"],
+        )
+
+    def reconcile(self, model, counters, batch_size):
+        fixed = 0
+        last_id = 0
+        while True:
+            ids = list(
+                model.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            #Recount the batch and rewrite only the rows that drifted
+            with transaction.atomic():
+                rows = (
+                    model.objects.filter(id__in=ids)
+                    .select_for_update()
+                    .only("id", "updated_at", *counters)
+                    .annotate(**{f"actual_{name}": expr for name, expr in counters.items()})
+                )
+                drifted = []
+                for row in rows:
+                    changed = False
+                    for name in counters:
+                        actual = getattr(row, f"actual_{name}")
+                        if getattr(row, name) != actual:
+                            setattr(row, name, actual)
+                            changed = True
+                    if changed:
+                        row.updated_at = timezone.now()
+                        drifted.append(row)
+                model.objects.bulk_update(drifted, [*counters, "updated_at"])
+            fixed += len(drifted)
+
+        self.stdout.write(f"{model.__name__}: repaired {fixed} rows")
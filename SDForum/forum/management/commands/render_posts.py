@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from forum.models import Thread, Reply
+from forum.rendering import RENDERER_VERSION, render_posts
+
+
+class Command(BaseCommand):
+    help = "Backfill stored HTML for threads and replies rendered by an older renderer"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Re-render every post, not only stale ones",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        #Shared across batches so each username is looked up once per run
+        mention_cache = {}
+
+        for model in (Thread, Reply):
+            posts = model.objects.only("id", "content").order_by("id")
+            if not options["force"]:
+                posts = posts.exclude(renderer_version=RENDERER_VERSION)
+
+            rendered = 0
+            last_id = 0
+            while True:
+                #Walk by primary key so re-rendered rows don't shift the batches
+                batch = list(posts.filter(id__gt=last_id)[:batch_size])
+                if not batch:
+                    break
+
+                render_posts(batch, mention_cache)
+
+                rendered += len(batch)
+                last_id = batch[-1].id
+            self.stdout.write(f"{model.__name__}: rendered {rendered}")
@@ -0,0 +1,28 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from forum.cache import HOT_KEY, bump, category_key
+from forum.models import Category, Thread
+from forum.ranking import rescore
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the hot score of recently active threads, catching any the "
+        "incremental updates missed (bulk loads, counter repairs, weight changes)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7, help="Threads updated within this many days")
+        parser.add_argument("--all", action="store_true", help="Every thread, e.g. after changing the weights")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        threads = Thread.objects.order_by("id")
+        if not options["all"]:
+            threads = threads.filter(updated_at__gte=timezone.now() - timedelta(days=options["days"]))
+        changed = rescore(threads, options["batch_size"])
+        if changed:
+            #Retire cached hot pages and sort=hot listings
+            bump(HOT_KEY, *[category_key(slug) for slug in Category.objects.values_list("slug", flat=True)])
+        self.stdout.write(f"Rescored {changed} threads")
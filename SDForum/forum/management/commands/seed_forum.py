@@ -0,0 +1,315 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+from courses.models import Course
+from forum.cache import CATEGORIES_KEY, HOT_KEY, bump, category_key
+from forum.models import Category, Mention, Reply, ReplyLike, Report, Tag, Thread, ThreadLike
+from forum.ranking import hot_score
+from forum.rendering import RENDERER_VERSION, content_hash, render_markdown
+from forum.search import get_search_backend
+from users.models import Profile
+
+User = get_user_model()
+
+CATEGORY_NAMES = [
+    "General", "Announcements", "Assignments", "Exams", "Projects",
+    "Placements", "Clubs", "Hostel", "Off-topic", "Feedback",
+]
+DEPARTMENTS = ["Computer Science", "Mathematics", "Physics", "Chemistry", "Biology", "Economics"]
+TITLE_WORDS = [
+    "Doubt", "Help", "Question", "Notes", "Midsem", "Compre", "Lab", "Quiz",
+    "Tutorial", "Assignment", "Deadline", "Resources", "Project", "Grading",
+]
+BODIES = [
+    "Can someone explain how this works? I have tried the examples from the lecture.",
+    "Sharing my notes from today's class.\n\n- Recursion\n- Big-O\n- Sorting",
+    "Is the deadline for the assignment extended?",
+    "Here is the snippet that fails:\n\n```\nfor i in range(10):\n    print(i)\n```\n\nAny idea why?",
+    "| Topic | Weightage |\n|---|---|\n| Calculus | 40% |\n| Algebra | 60% |",
+    "Thanks, that fixed it!",
+    "Same problem here, following this thread.",
+    "The **tutorial sheet** has a typo in question 3.",
+]
+REPORT_REASONS = ["spam", "off-topic", "abusive", "duplicate"]
+
+
+#Weight of the item at each rank falls off as 1/rank^skew (a Zipf curve):
+#a few hot threads and power users, and a long tail of everything else
+def zipf_cum_weights(n, skew):
+    total, cumulative = 0.0, []
+    for rank in range(1, n + 1):
+        total += 1 / rank ** skew
+        cumulative.append(total)
+    return cumulative
+
+
+#auto_now / auto_now_add would stamp every generated row with the current time
+@contextmanager
+def keep_timestamps(*models):
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = "Fill the database with a synthetic forum of production-like size and skew"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=500)
+        parser.add_argument("--moderators", type=int, default=5)
+        parser.add_argument("--categories", type=int, default=8)
+        parser.add_argument("--courses", type=int, default=20)
+        parser.add_argument("--tags", type=int, default=60)
+        parser.add_argument("--threads", type=int, default=3000)
+        parser.add_argument("--replies", type=int, default=30000)
+        parser.add_argument("--likes", type=int, default=60000)
+        parser.add_argument("--reports", type=int, default=300)
+        parser.add_argument("--mention-rate", type=float, default=0.05)
+        parser.add_argument("--days", type=int, default=365, help="Spread posts over this many past days")
+        parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent for hot threads and power users")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--password", default="seed", help="Password for every generated user")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.skew = options["skew"]
+        self.now = timezone.now()
+        self.rendered = {}
+
+        with keep_timestamps(Thread, Reply), transaction.atomic():
+            users = self.create_users(options)
+            categories = self.create_categories(options["categories"])
+            courses = self.create_courses(options["courses"])
+            tags = self.create_tags(options["tags"])
+
+            #Everything is generated before it is inserted, so the denormalized
+            #counters go in with the rows instead of a second pass of UPDATEs
+            threads, mentions = self.build_threads(options, users, categories, courses)
+            replies, reply_mentions = self.build_replies(options, users)
+            thread_likes, reply_likes = self.build_likes(options["likes"], users, replies)
+            for thread in threads:
+                thread.hot_score = hot_score(thread.like_count, thread.reply_count, thread.created_at)
+
+            Thread.objects.bulk_create(threads, batch_size=self.batch_size)
+            self.tag_threads(threads, tags)
+            Reply.objects.bulk_create(replies, batch_size=self.batch_size)
+            ThreadLike.objects.bulk_create(thread_likes, batch_size=self.batch_size)
+            ReplyLike.objects.bulk_create(reply_likes, batch_size=self.batch_size)
+            Mention.objects.bulk_create(mentions + reply_mentions, batch_size=self.batch_size)
+            reports = self.create_reports(options["reports"], users, replies)
+
+        #bulk_create skips the post_save signals that index posts and retire pages
+        get_search_backend().rebuild()
+        bump(CATEGORIES_KEY, HOT_KEY, *[category_key(category.slug) for category in categories])
+
+        self.stdout.write(
+            f"Seeded {len(users)} users, {len(categories)} categories, {len(courses)} courses, "
+            f"{len(tags)} tags, {len(threads)} threads, {len(replies)} replies, "
+            f"{len(thread_likes) + len(reply_likes)} likes, "
+            f"{len(mentions) + len(reply_mentions)} mentions, {reports} reports"
+        )
+
+    def pick(self, items, k, skew=None):
+        if not items or k <= 0:
+            return []
+        cumulative = zipf_cum_weights(len(items), self.skew if skew is None else skew)
+        return self.rng.choices(items, cum_weights=cumulative, k=k)
+
+    #Rows are matched by a unique column, so a second run reuses what exists
+    def insert(self, model, objects, field):
+        model.objects.bulk_create(objects, batch_size=self.batch_size, ignore_conflicts=True)
+        keys = [getattr(obj, field) for obj in objects]
+        found = model.objects.in_bulk(keys, field_name=field)
+        return [found[key] for key in keys]
+
+    def create_users(self, options):
+        password = make_password(options["password"])
+        users = self.insert(User, [
+            User(username=f"seed{i}", email=f"seed{i}@example.com", password=password)
+            for i in range(options["users"])
+        ], "username")
+        Profile.objects.bulk_create([
+            Profile(user=user, role="MODERATOR" if i < options["moderators"] else "STUDENT")
+            for i, user in enumerate(users)
+        ], batch_size=self.batch_size, ignore_conflicts=True)
+        #Rank order is the posting skew: seed0 is the busiest poster
+        return users
+
+    def create_categories(self, count):
+        names = [
+            CATEGORY_NAMES[i] if i < len(CATEGORY_NAMES) else f"Category {i}"
+            for i in range(count)
+        ]
+        return self.insert(Category, [
+            Category(name=name, slug=slugify(name), description=f"{name} discussions")
+            for name in names
+        ], "slug")
+
+    def create_courses(self, count):
+        return self.insert(Course, [
+            Course(
+                code=f"SD F{100 + i}",
+                slug=slugify(f"SD F{100 + i}"),
+                title=f"Seed course {i}",
+                department=DEPARTMENTS[i % len(DEPARTMENTS)],
+            )
+            for i in range(count)
+        ], "code")
+
+    def create_tags(self, count):
+        return self.insert(Tag, [
+            Tag(name=f"topic {i}", slug=f"topic-{i}") for i in range(count)
+        ], "slug")
+
+    #Body plus stored HTML, rendered once per distinct text
+    def post_fields(self, content, mentioned=None):
+        if content not in self.rendered:
+            known = {mentioned.username} if mentioned else set()
+            self.rendered[content] = (render_markdown(content, known), content_hash(content))
+        html, digest = self.rendered[content]
+        return {
+            "content": content,
+            "content_html": html,
+            "content_hash": digest,
+            "renderer_version": RENDERER_VERSION,
+        }
+
+    def maybe_mention(self, rate, users):
+        if self.rng.random() < rate:
+            return self.rng.choice(users)
+        return None
+
+    def build_threads(self, options, users, categories, courses):
+        count = options["threads"]
+        authors = self.pick(users, count)
+        thread_categories = self.pick(categories, count, skew=0.8)
+        window = options["days"] * 24 * 60 * 60
+
+        threads, mentioned = [], []
+        for i in range(count):
+            body = self.rng.choice(BODIES)
+            user = self.maybe_mention(options["mention_rate"], users)
+            if user:
+                body += f"\n\nWhat do you think, @{user.username}?"
+            created_at = self.now - timedelta(seconds=self.rng.uniform(0, window))
+            threads.append(Thread(
+                category=thread_categories[i],
+                author=authors[i],
+                course=self.rng.choice(courses) if courses and self.rng.random() < 0.4 else None,
+                title=f"{self.rng.choice(TITLE_WORDS)} #{i}",
+                created_at=created_at,
+                updated_at=created_at,
+                **self.post_fields(body, user),
+            ))
+            mentioned.append(user)
+
+        mentions = [
+            Mention(mentioned_user=user, thread=thread)
+            for thread, user in zip(threads, mentioned) if user
+        ]
+        #Hot threads are scattered over time, not just the oldest ones
+        self.hot_threads = self.rng.sample(threads, len(threads))
+        return threads, mentions
+
+    def tag_threads(self, threads, tags):
+        if not tags:
+            return
+        Through = Thread.tags.through
+        rows = {
+            (thread.pk, tag.pk)
+            for thread in threads
+            for tag in self.pick(tags, self.rng.randint(0, 3))
+        }
+        Through.objects.bulk_create(
+            [Through(thread_id=thread_id, tag_id=tag_id) for thread_id, tag_id in rows],
+            batch_size=self.batch_size
+        )
+
+    def build_replies(self, options, users):
+        count = options["replies"] if self.hot_threads else 0
+        authors = self.pick(users, count)
+        targets = self.pick(self.hot_threads, count)
+
+        replies, mentioned = [], []
+        for author, thread in zip(authors, targets):
+            body = self.rng.choice(BODIES)
+            user = self.maybe_mention(options["mention_rate"], users)
+            if user:
+                body += f"\n\ncc @{user.username}"
+            #Most replies come soon after the thread, a few much later
+            created_at = min(
+                thread.created_at + timedelta(hours=self.rng.expovariate(1 / 12)), self.now
+            )
+            replies.append(Reply(
+                thread=thread, author=author,
+                created_at=created_at, updated_at=created_at,
+                **self.post_fields(body, user),
+            ))
+            mentioned.append(user)
+            thread.reply_count += 1
+            thread.updated_at = max(thread.updated_at, created_at)
+
+        mentions = [
+            Mention(mentioned_user=user, reply=reply)
+            for reply, user in zip(replies, mentioned) if user
+        ]
+        return replies, mentions
+
+    #One like per (post, user); the posts aren't saved yet, so they can't be hashed
+    def unique_pairs(self, posts, users):
+        return list({(id(post), user.pk): (post, user) for post, user in zip(posts, users)}.values())
+
+    #Two thirds on threads, the rest on replies; both favour hot posts
+    def build_likes(self, count, users, replies):
+        on_threads = count * 2 // 3
+        thread_pairs = self.unique_pairs(
+            self.pick(self.hot_threads, on_threads), self.pick(users, on_threads, skew=0.5)
+        )
+        reply_pairs = self.unique_pairs(
+            self.pick(replies, count - on_threads), self.pick(users, count - on_threads, skew=0.5)
+        )
+        for thread, _ in thread_pairs:
+            thread.like_count += 1
+        for reply, _ in reply_pairs:
+            reply.like_count += 1
+        return (
+            [ThreadLike(thread=thread, user=user) for thread, user in thread_pairs],
+            [ReplyLike(reply=reply, user=user) for reply, user in reply_pairs],
+        )
+
+    def create_reports(self, count, users, replies):
+        if not self.hot_threads:
+            return 0
+        reported_threads = self.pick(self.hot_threads, count)
+        reported_replies = self.pick(replies, count)
+
+        reports = []
+        for i, reporter in enumerate(self.rng.choices(users, k=count)):
+            target = {"thread": reported_threads[i]}
+            if reported_replies and self.rng.random() < 0.5:
+                target = {"reply": reported_replies[i]}
+            reports.append(Report(
+                reporter=reporter,
+                reason=self.rng.choice(REPORT_REASONS),
+                status="PENDING" if self.rng.random() < 0.8 else "RESOLVED",
+                **target,
+            ))
+        Report.objects.bulk_create(reports, batch_size=self.batch_size)
+        return len(reports)
@@ -0,0 +1,34 @@
+import time
+from django.core.management.base import BaseCommand
+from forum.email_utils import deliver_outbox, flush_digests
+
+
+class Command(BaseCommand):
+    help = "Queue due digests and deliver queued notification emails in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling the outbox instead of exiting once it is drained",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5.0,
+            help="Seconds to sleep when the outbox is empty (with --loop)",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            digests = flush_digests()
+            if digests:
+                self.stdout.write(f"Queued {digests} digests")
+            sent, failed = deliver_outbox(options["batch_size"])
+            if sent or failed:
+                self.stdout.write(f"Sent {sent}, failed {failed}")
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,37 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.urls import reverse
+from forum import views
+from forum.models import Category, Thread
+
+
+class Command(BaseCommand):
+    help = "Render the busiest anonymous pages into the page cache after a deploy"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=50)
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+
+        def warm(view, url, **kwargs):
+            request = factory.get(url)
+            request.user = AnonymousUser()
+            request.is_moderator = False
+            return view(request, **kwargs).status_code == 200
+
+        pages = [(views.category_list, reverse("forum:category_list"), {})]
+        for slug in Category.objects.values_list("slug", flat=True):
+            pages.append((views.thread_list, reverse("forum:thread_list", args=[slug]), {"slug": slug}))
+
+        top_threads = (
+            Thread.objects.filter(is_deleted=False)
+            .order_by("-like_count", "-created_at")
+            .values_list("pk", flat=True)[:options["threads"]]
+        )
+        for pk in top_threads:
+            pages.append((views.thread_detail, reverse("forum:thread_detail", args=[pk]), {"pk": pk}))
+
+        warmed = sum(warm(view, url, **kwargs) for view, url, kwargs in pages)
+        self.stdout.write(f"Warmed {warmed} of {len(pages)} pages")
@@ -1,3 +1,4 @@
+from django.contrib.postgres.operations import TrigramExtension
 from django.db import migrations
 
 class Migration(migrations.Migration):
@@ -6,9 +7,7 @@ class Migration(migrations.Migration):
         ("forum", "0009_thread_course"),
     ]
 
+    #TrigramExtension is a no-op on non-Postgres databases (SQLite dev/tests)
     operations = [
-        migrations.RunSQL(
-            "CREATE EXTENSION IF NOT EXISTS pg_trgm;",
-            reverse_sql="DROP EXTENSION IF EXISTS pg_trgm;",
-        )
+        TrigramExtension(),
     ]
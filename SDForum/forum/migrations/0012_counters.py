@@ -0,0 +1,62 @@
+# Generated by Django 6.0 on 2026-10-18 02:29
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, fk, **filters):
+    counts = (
+        model.objects.filter(**{fk: OuterRef("pk")}, **filters)
+        .order_by()
+        .values(fk)
+        .annotate(n=Count("pk"))
+        .values("n")
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
+def backfill_counters(apps, schema_editor):
+    Thread = apps.get_model("forum", "Thread")
+    Reply = apps.get_model("forum", "Reply")
+    ThreadLike = apps.get_model("forum", "ThreadLike")
+    ReplyLike = apps.get_model("forum", "ReplyLike")
+
+    Thread.objects.update(
+        like_count=count_of(ThreadLike, "thread"),
+        reply_count=count_of(Reply, "thread", is_deleted=False),
+    )
+    Reply.objects.update(like_count=count_of(ReplyLike, "reply"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0002_course_slug'),
+        ('forum', '0011_rendered_content'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reply',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['category', '-like_count', '-created_at'], name='thread_popular_idx'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
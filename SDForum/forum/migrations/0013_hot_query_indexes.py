@@ -0,0 +1,48 @@
+# Generated by Django 6.0 on 2026-10-18 02:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0002_course_slug'),
+        ('forum', '0012_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='thread',
+            name='thread_popular_idx',
+        ),
+        migrations.AddIndex(
+            model_name='mention',
+            index=models.Index(fields=['mentioned_user', '-created_at'], name='mention_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reply',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['thread', 'created_at', 'id'], name='reply_thread_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['-created_at'], name='report_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['category', '-created_at', '-id'], name='thread_category_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['category', '-like_count', '-created_at', '-id'], name='thread_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['course', '-created_at'], name='thread_course_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['-created_at'], name='thread_recent_idx'),
+        ),
+    ]
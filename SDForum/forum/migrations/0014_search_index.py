@@ -0,0 +1,64 @@
+# Generated by Django 6.0 on 2026-10-18 02:32
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+#GIN indexes and the FTS5 table are vendor specific, so they are created
+#here rather than through Meta.indexes.
+POSTGRES_FORWARDS = [
+    "CREATE INDEX thread_search_vector_idx ON forum_thread USING gin (search_vector)",
+    "CREATE INDEX reply_search_vector_idx ON forum_reply USING gin (search_vector)",
+    "UPDATE forum_thread SET search_vector = "
+    "setweight(to_tsvector('english', title), 'A') || "
+    "setweight(to_tsvector('english', content), 'B')",
+    "UPDATE forum_reply SET search_vector = setweight(to_tsvector('english', content), 'C')",
+]
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS thread_search_vector_idx",
+    "DROP INDEX IF EXISTS reply_search_vector_idx",
+]
+
+SQLITE_FORWARDS = [
+    "CREATE VIRTUAL TABLE forum_search USING fts5("
+    "title, body, reply, thread_id UNINDEXED, reply_id UNINDEXED, "
+    "tokenize = 'porter unicode61')",
+    "INSERT INTO forum_search (rowid, title, body, reply, thread_id, reply_id) "
+    "SELECT id * 2, title, content, '', id, NULL FROM forum_thread",
+    "INSERT INTO forum_search (rowid, title, body, reply, thread_id, reply_id) "
+    "SELECT id * 2 + 1, '', '', content, thread_id, id FROM forum_reply",
+]
+SQLITE_BACKWARDS = [
+    "DROP TABLE IF EXISTS forum_search",
+]
+
+
+def run_for_vendor(postgres, sqlite):
+    def run(apps, schema_editor):
+        statements = {"postgresql": postgres, "sqlite": sqlite}
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0013_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reply',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(
+            run_for_vendor(POSTGRES_FORWARDS, SQLITE_FORWARDS),
+            run_for_vendor(POSTGRES_BACKWARDS, SQLITE_BACKWARDS),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 6.0 on 2026-10-18 02:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0018_report_queue'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reply',
+            name='deleted_with_thread',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ModerationLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('DELETE', 'Delete'), ('RESTORE', 'Restore')], max_length=10)),
+                ('source', models.CharField(choices=[('UI', 'Forum'), ('ADMIN', 'Admin'), ('COMMAND', 'Command')], default='UI', max_length=10)),
+                ('thread_ids', models.JSONField(blank=True, default=list)),
+                ('reply_ids', models.JSONField(blank=True, default=list)),
+                ('threads_changed', models.PositiveIntegerField(default=0)),
+                ('replies_changed', models.PositiveIntegerField(default=0)),
+                ('reports_resolved', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('moderator', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='moderation_logs', to=settings.AUTH_USER_MODEL)),
+                ('target_author', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 6.0 on 2026-10-18 03:11
+
+import datetime
+import math
+from django.conf import settings
+from django.db import migrations, models
+
+HOT_EPOCH = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def backfill_hot_scores(apps, schema_editor):
+    Thread = apps.get_model("forum", "Thread")
+    threads = list(Thread.objects.only("id", "like_count", "reply_count", "created_at"))
+    for thread in threads:
+        activity = thread.like_count + thread.reply_count * 2
+        thread.hot_score = (
+            math.log10(max(activity, 1))
+            + (thread.created_at - HOT_EPOCH).total_seconds() / 45000
+        )
+    Thread.objects.bulk_update(threads, ["hot_score"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0002_course_slug'),
+        ('forum', '0019_bulk_moderation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='hot_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_hot_scores, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['category', '-hot_score', '-id'], name='thread_category_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['-hot_score', '-id'], name='thread_hot_idx'),
+        ),
+    ]
@@ -1,6 +1,11 @@
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import F, Q
 from django.conf import settings
+from django.utils import timezone
 from courses.models import Course
+from .ranking import hot_score, hot_score_update
+from .rendering import RENDERER_VERSION, RENDER_FIELDS, content_hash, render_markdown
 
 User = settings.AUTH_USER_MODEL
 
@@ -10,6 +15,7 @@ class Category(models.Model):
     description = models.TextField(blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name_plural = "Categories"
@@ -28,7 +34,33 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
-class Thread(models.Model):
+#Markdown compiled once at write time, so page views only read stored HTML
+class RenderedContent(models.Model):
+    content_html = models.TextField(blank=True, editable=False)
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
+    renderer_version = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def render_content(self, known_usernames=None):
+        self.content_html = render_markdown(self.content, known_usernames) # type: ignore
+        self.content_hash = content_hash(self.content) # type: ignore
+        self.renderer_version = RENDERER_VERSION
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "content" in update_fields:
+            if (
+                self.renderer_version != RENDERER_VERSION
+                or self.content_hash != content_hash(self.content) # type: ignore
+            ):
+                self.render_content()
+                if update_fields is not None:
+                    kwargs["update_fields"] = {*update_fields, *RENDER_FIELDS}
+        super().save(*args, **kwargs)
+
+class Thread(RenderedContent):
     category = models.ForeignKey(
         Category,
         on_delete=models.CASCADE,
@@ -57,16 +89,84 @@ class Thread(models.Model):
     is_locked = models.BooleanField(default=False)
     is_deleted = models.BooleanField(default=False)
 
+    #Denormalized counters, kept exact by F() updates in the views.
+    #Those updates also touch updated_at so page validators see the change.
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    reply_count = models.PositiveIntegerField(default=0, editable=False)
+    #Time-decayed rank for sort=hot (see forum.ranking), moved in the same
+    #UPDATE as the counters and recomputed by rescore_hot_threads
+    hot_score = models.FloatField(default=0, editable=False)
+    #Deduplicated page views, added in batches by flush_view_counts (see
+    #forum.view_counts). Unlike the counters above it leaves updated_at alone.
+    view_count = models.PositiveIntegerField(default=0, editable=False)
+
+    #Weighted title/content vector, only populated on Postgres (see forum.search)
+    search_vector = SearchVectorField(null=True, editable=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["-created_at"]
+        #Partial indexes match the is_deleted=False filter every listing uses
+        indexes = [
+            models.Index(
+                fields=["category", "-created_at", "-id"],
+                condition=Q(is_deleted=False),
+                name="thread_category_recent_idx",
+            ),
+            models.Index(
+                fields=["category", "-like_count", "-created_at", "-id"],
+                condition=Q(is_deleted=False),
+                name="thread_popular_idx",
+            ),
+            models.Index(
+                fields=["category", "-hot_score", "-id"],
+                condition=Q(is_deleted=False),
+                name="thread_category_hot_idx",
+            ),
+            models.Index(
+                fields=["-hot_score", "-id"],
+                condition=Q(is_deleted=False),
+                name="thread_hot_idx",
+            ),
+            models.Index(
+                fields=["category", "-view_count", "-created_at", "-id"],
+                condition=Q(is_deleted=False),
+                name="thread_category_views_idx",
+            ),
+            models.Index(
+                fields=["course", "-created_at"],
+                condition=Q(is_deleted=False),
+                name="thread_course_recent_idx",
+            ),
+            models.Index(
+                fields=["-created_at"],
+                condition=Q(is_deleted=False),
+                name="thread_recent_idx",
+            ),
+            #Newest change in a category or course, for listing validators
+            models.Index(
+                fields=["category", "updated_at"],
+                name="thread_category_updated_idx",
+            ),
+            models.Index(
+                fields=["course", "updated_at"],
+                name="thread_course_updated_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.title
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.hot_score = hot_score(
+                self.like_count, self.reply_count, self.created_at or timezone.now()
+            )
+        super().save(*args, **kwargs)
     
-class Reply(models.Model):
+class Reply(RenderedContent):
     thread = models.ForeignKey(
         Thread,
         on_delete=models.CASCADE,
@@ -81,14 +181,48 @@ class Reply(models.Model):
     content = models.TextField()
 
     is_deleted = models.BooleanField(default=False)
+    #Set when the reply went down with its thread, so restoring the thread
+    #brings back only those replies and not ones deleted on their own
+    deleted_with_thread = models.BooleanField(default=False, editable=False)
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(
+                fields=["thread", "created_at", "id"],
+                condition=Q(is_deleted=False),
+                name="reply_thread_recent_idx",
+            ),
+            #Newest change in a thread, for thread_detail validators
+            models.Index(
+                fields=["thread", "updated_at"],
+                name="reply_thread_updated_idx",
+            ),
+        ]
     
     def __str__(self):
         return f"Reply by {self.author} on {self.thread}"
+
+    def soft_delete(self):
+        #Only the call that actually flips the flag touches the thread's counter
+        with transaction.atomic():
+            deleted = Reply.objects.filter(pk=self.pk, is_deleted=False).update(
+                is_deleted=True,
+                updated_at=timezone.now()
+            )
+            if deleted:
+                Thread.objects.filter(pk=self.thread_id).update( # type: ignore
+                    reply_count=F("reply_count") - 1,
+                    hot_score=hot_score_update(
+                        self.thread.created_at, reply_count=F("reply_count") - 1
+                    ),
+                    updated_at=timezone.now()
+                )
+        self.is_deleted = True
     
 class ThreadLike(models.Model):
     thread = models.ForeignKey(
@@ -164,10 +298,75 @@ class Report(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["-created_at", "-id"],
+                condition=Q(status="PENDING"),
+                name="report_pending_idx",
+            ),
+            #Pending reports per target, for grouping the moderator queue
+            models.Index(
+                fields=["thread", "id"],
+                condition=Q(status="PENDING"),
+                name="report_pending_thread_idx",
+            ),
+            models.Index(
+                fields=["reply", "id"],
+                condition=Q(status="PENDING"),
+                name="report_pending_reply_idx",
+            ),
+        ]
+
     def __str__(self):
         target = self.thread or self.reply
         return f"Report by {self.reporter} on {target}"
 
+#One row per bulk moderation call, whatever its size
+class ModerationLog(models.Model):
+    ACTION_CHOICES = [
+        ("DELETE", "Delete"),
+        ("RESTORE", "Restore"),
+    ]
+    SOURCE_CHOICES = [
+        ("UI", "Forum"),
+        ("ADMIN", "Admin"),
+        ("COMMAND", "Command"),
+    ]
+
+    moderator = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="moderation_logs"
+    )
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES, default="UI")
+
+    #What was asked for; the counts say what actually changed
+    target_author = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+"
+    )
+    thread_ids = models.JSONField(default=list, blank=True)
+    reply_ids = models.JSONField(default=list, blank=True)
+
+    threads_changed = models.PositiveIntegerField(default=0)
+    replies_changed = models.PositiveIntegerField(default=0)
+    reports_resolved = models.PositiveIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.get_action_display()} by {self.moderator}: {self.threads_changed} threads, {self.replies_changed} replies" # type: ignore
+
 class Mention(models.Model):
     mentioned_user = models.ForeignKey(
         User,
@@ -191,6 +390,78 @@ class Mention(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["mentioned_user", "-created_at"],
+                name="mention_user_recent_idx",
+            ),
+        ]
+
     def __str__(self):
         target = self.thread or self.reply
-        return f"{self.mentioned_user} mentioned in {target}"
\ No newline at end of file
+        return f"{self.mentioned_user} mentioned in {target}"
+
+class OutboundEmail(models.Model):
+    STATUS_CHOICES = [
+        ("PENDING", "Pending"),
+        ("SENT", "Sent"),
+        ("FAILED", "Failed"),
+    ]
+
+    recipient = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    #Hash of recipient + subject + body, unique among pending rows
+    dedupe_key = models.CharField(max_length=64)
+
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default="PENDING"
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dedupe_key"],
+                condition=Q(status="PENDING"),
+                name="outbox_pending_dedupe",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=Q(status="PENDING"),
+                name="outbox_due_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {self.recipient} ({self.status})"
+
+
+#Notifications held back for users on digest delivery
+class PendingNotification(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="pending_notifications"
+    )
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "created_at"], name="pending_user_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} for {self.user}"
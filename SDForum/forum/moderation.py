@@ -0,0 +1,175 @@
+from django.db import transaction
+from django.db.models import Exists, F, Func, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .cache import invalidate_threads
+from .models import ModerationLog, Report, Thread, Reply
+from .ranking import rescore
+from .utils import count_of
+
+#Report groups shown per page of the moderator queue
+QUEUE_PAGE_SIZE = 20
+#Newest report first; the cursor walks report_pending_idx
+QUEUE_ORDERING = ("-created_at", "-id")
+
+
+def pending_reports():
+    return Report.objects.filter(status="PENDING")
+
+
+#Reports on the same target as the outer report (thread and reply reports
+#never share a column, so one of these comparisons is always NULL)
+def same_target():
+    return Q(thread_id=OuterRef("thread_id")) | Q(reply_id=OuterRef("reply_id"))
+
+
+#One row per reported thread or reply: its newest pending report, annotated
+#with how many pending reports the target has. No GROUP BY, so the queue can
+#be keyset-paginated on the newest report like any other listing.
+def report_queue():
+    newer = pending_reports().filter(same_target(), id__gt=OuterRef("id"))
+    report_count = (
+        pending_reports().filter(same_target())
+        .annotate(n=Func(F("id"), function="COUNT"))
+        .values("n")
+    )
+    return (
+        pending_reports()
+        .filter(~Exists(newer))
+        .annotate(
+            report_count=Subquery(report_count),
+            target_author_id=Coalesce("reply__author_id", "thread__author_id"),
+        )
+        .select_related("reporter", "thread", "reply__thread")
+    )
+
+
+#Values look like "thread:12" or "reply:34", as posted by the queue's checkboxes
+def parse_targets(values):
+    thread_ids, reply_ids = set(), set()
+    for value in values:
+        kind, _, pk = value.partition(":")
+        if not pk.isdigit():
+            continue
+        if kind == "thread":
+            thread_ids.add(int(pk))
+        elif kind == "reply":
+            reply_ids.add(int(pk))
+    return thread_ids, reply_ids
+
+
+def targets_of(report):
+    if report.reply_id:
+        return set(), {report.reply_id}
+    return {report.thread_id}, set()
+
+
+#Clear every pending report on the given targets with one UPDATE
+def resolve_targets(thread_ids, reply_ids):
+    if not thread_ids and not reply_ids:
+        return 0
+    return pending_reports().filter(
+        Q(thread_id__in=thread_ids) | Q(reply_id__in=reply_ids)
+    ).update(status="RESOLVED")
+
+
+def live_ids(queryset, deleted):
+    return set(queryset.filter(is_deleted=deleted).values_list("pk", flat=True))
+
+
+#Expand the requested targets into the ids the batch will actually change
+def collect(thread_ids, reply_ids, author, deleted):
+    threads = Thread.objects.filter(pk__in=thread_ids)
+    replies = Reply.objects.filter(pk__in=reply_ids)
+    if author is not None:
+        threads = threads | Thread.objects.filter(author=author)
+        replies = replies | Reply.objects.filter(author=author)
+    return live_ids(threads, deleted), live_ids(replies, deleted)
+
+
+#Replies whose visibility changed move their thread's reply_count; recount
+#instead of adding deltas so racing moderators can't skew it
+def recount_replies(thread_ids, now):
+    threads = Thread.objects.filter(pk__in=thread_ids)
+    threads.update(
+        reply_count=count_of(Reply, "thread", is_deleted=False),
+        updated_at=now
+    )
+    rescore(threads, every_row=True)
+
+
+def log(action, moderator, source, author, thread_ids, reply_ids, threads, replies, reports=0):
+    return ModerationLog.objects.create(
+        moderator=moderator,
+        action=action,
+        source=source,
+        target_author=author,
+        thread_ids=sorted(thread_ids),
+        reply_ids=sorted(reply_ids),
+        threads_changed=threads,
+        replies_changed=replies,
+        reports_resolved=reports,
+    )
+
+
+#Soft delete threads (with their replies), replies, and/or everything by one
+#author, resolve their reports, and record one ModerationLog row
+def soft_delete(thread_ids=(), reply_ids=(), author=None, moderator=None, source="UI"):
+    now = timezone.now()
+    with transaction.atomic():
+        threads, replies = collect(thread_ids, reply_ids, author, deleted=False)
+
+        #Replies asked for by name go first so they count as deleted on their own
+        touched = set(
+            Reply.objects.filter(pk__in=replies).values_list("thread_id", flat=True)
+        ) - threads
+        replies_changed = Reply.objects.filter(pk__in=replies, is_deleted=False).update(
+            is_deleted=True, updated_at=now
+        )
+        threads_changed = Thread.objects.filter(pk__in=threads, is_deleted=False).update(
+            is_deleted=True, updated_at=now
+        )
+        cascaded = Reply.objects.filter(thread_id__in=threads, is_deleted=False).update(
+            is_deleted=True, deleted_with_thread=True, updated_at=now
+        )
+        recount_replies(threads | touched, now)
+
+        reports = pending_reports().filter(
+            Q(thread_id__in=threads) | Q(reply_id__in=replies) | Q(reply__thread_id__in=threads)
+        ).update(status="RESOLVED")
+
+        entry = log(
+            "DELETE", moderator, source, author, thread_ids, reply_ids,
+            threads_changed, replies_changed + cascaded, reports
+        )
+        invalidate_threads(threads | touched)
+    return entry
+
+
+#Undo soft_delete; replies that were deleted on their own stay deleted when
+#only their thread is restored
+def restore(thread_ids=(), reply_ids=(), author=None, moderator=None, source="UI"):
+    now = timezone.now()
+    with transaction.atomic():
+        threads, replies = collect(thread_ids, reply_ids, author, deleted=True)
+
+        threads_changed = Thread.objects.filter(pk__in=threads, is_deleted=True).update(
+            is_deleted=False, updated_at=now
+        )
+        cascaded = Reply.objects.filter(
+            thread_id__in=threads, is_deleted=True, deleted_with_thread=True
+        ).update(is_deleted=False, deleted_with_thread=False, updated_at=now)
+        touched = set(
+            Reply.objects.filter(pk__in=replies).values_list("thread_id", flat=True)
+        ) - threads
+        replies_changed = Reply.objects.filter(pk__in=replies, is_deleted=True).update(
+            is_deleted=False, deleted_with_thread=False, updated_at=now
+        )
+        recount_replies(threads | touched, now)
+
+        entry = log(
+            "RESTORE", moderator, source, author, thread_ids, reply_ids,
+            threads_changed, replies_changed + cascaded
+        )
+        invalidate_threads(threads | touched)
+    return entry
@@ -0,0 +1,157 @@
+import base64
+import binascii
+import datetime
+import json
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+#Cursor directions
+NEXT = "n"
+PREV = "p"
+
+
+#Keeps full microsecond precision, unlike DjangoJSONEncoder
+def encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__} in a cursor")
+
+
+def encode_cursor(payload):
+    raw = json.dumps(payload, default=encode_value, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+#Opaque token for "the last page", without counting rows
+def last_page_cursor():
+    return encode_cursor({"d": PREV})
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def last_cursor(self):
+        return last_page_cursor()
+
+
+#Keyset pagination: every page is one indexed range scan, no COUNT or OFFSET.
+#ordering must end in a unique column (usually "id") so the keys are total.
+class CursorPaginator:
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = [
+            (name.lstrip("-"), name.startswith("-")) for name in ordering
+        ]
+        self.per_page = per_page
+
+    def get_page(self, cursor=None):
+        direction, values = self.decode_cursor(cursor)
+
+        if direction == PREV:
+            #Walk backwards from the cursor (or the very end) and flip the rows
+            rows = self.fetch(values, reverse=True)
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            previous_cursor = self.encode_cursor(PREV, rows[0]) if has_more else None
+            next_cursor = (
+                self.encode_cursor(NEXT, rows[-1]) if values is not None and rows else None
+            )
+        else:
+            rows = self.fetch(values)
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            next_cursor = self.encode_cursor(NEXT, rows[-1]) if has_more else None
+            previous_cursor = (
+                self.encode_cursor(PREV, rows[0]) if values is not None and rows else None
+            )
+
+        return CursorPage(rows, next_cursor, previous_cursor)
+
+    def fetch(self, values, reverse=False):
+        ordering = [(name, desc != reverse) for name, desc in self.ordering]
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self.after(ordering, values))
+        queryset = queryset.order_by(
+            *[f"-{name}" if desc else name for name, desc in ordering]
+        )
+        return list(queryset[:self.per_page + 1])
+
+    #(a, b, c) "comes after" (x, y, z) in the given ordering, expanded to ORs
+    def after(self, ordering, values):
+        condition = Q()
+        for i, (name, desc) in enumerate(ordering):
+            equal = {ordering[j][0]: values[j] for j in range(i)}
+            lookup = f"{name}__lt" if desc else f"{name}__gt"
+            condition |= Q(**equal, **{lookup: values[i]})
+        return condition
+
+    def encode_cursor(self, direction, row):
+        return self.encode({
+            "d": direction,
+            "v": [self.value_of(row, name) for name, _ in self.ordering],
+        })
+
+    def value_of(self, row, name):
+        if isinstance(row, dict):
+            return row[name]
+        return getattr(row, name)
+
+    def encode(self, payload):
+        return encode_cursor(payload)
+
+    #A missing or tampered cursor falls back to the first page
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return NEXT, None
+
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            payload = json.loads(raw)
+            direction = payload["d"]
+            values = payload.get("v")
+            if direction not in (NEXT, PREV):
+                return NEXT, None
+            if values is None:
+                return direction, None
+            if len(values) != len(self.ordering):
+                return NEXT, None
+            values = [
+                self.to_python(name, value)
+                for (name, _), value in zip(self.ordering, values)
+            ]
+            #Ordering columns are never NULL, and None can't be compared in SQL
+            if any(value is None for value in values):
+                return NEXT, None
+            return direction, values
+        except (binascii.Error, ValueError, KeyError, TypeError, AttributeError, ValidationError):
+            return NEXT, None
+
+    def to_python(self, name, value):
+        try:
+            field = self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return value
+        return field.to_python(value)
@@ -0,0 +1,52 @@
+import datetime
+import math
+from django.utils import timezone
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Greatest, Log
+
+#"Hot" score, as on Reddit: log10 of a thread's weighted likes and replies
+#plus its creation time in units of HOT_DECAY_SECONDS. A thread needs ten
+#times the activity to outrank one posted HOT_DECAY_SECONDS later. Nothing in
+#the score depends on the current time, so it only changes when the counters
+#do and can be stored and indexed.
+HOT_EPOCH = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+HOT_DECAY_SECONDS = 45000
+LIKE_WEIGHT = 1
+REPLY_WEIGHT = 2
+
+
+def age_term(created_at):
+    return (created_at - HOT_EPOCH).total_seconds() / HOT_DECAY_SECONDS
+
+
+def hot_score(like_count, reply_count, created_at):
+    activity = like_count * LIKE_WEIGHT + reply_count * REPLY_WEIGHT
+    return math.log10(max(activity, 1)) + age_term(created_at)
+
+
+#hot_score as an UPDATE expression, for the same statement that moves a
+#counter. Pass the counters' new values, e.g. F("like_count") + 1, since
+#the right-hand side of an UPDATE sees the row as it was.
+def hot_score_update(created_at, like_count=F("like_count"), reply_count=F("reply_count")):
+    activity = Greatest(
+        like_count * LIKE_WEIGHT + reply_count * REPLY_WEIGHT, Value(1),
+        output_field=FloatField(),
+    )
+    return Log(Value(10.0), activity) + Value(age_term(created_at))
+
+
+#Recompute the score of every thread in queryset. Only the ones that moved are
+#written, unless every_row is set to keep the number of queries fixed. A new
+#score reorders listings, so it touches updated_at for the page validators.
+def rescore(queryset, batch_size=1000, every_row=False):
+    now = timezone.now()
+    changed = []
+    rows = queryset.only("id", "like_count", "reply_count", "created_at", "hot_score")
+    for thread in rows.iterator(chunk_size=batch_size):
+        score = hot_score(thread.like_count, thread.reply_count, thread.created_at)
+        if every_row or not math.isclose(thread.hot_score, score, abs_tol=1e-9):
+            thread.hot_score = score
+            thread.updated_at = now
+            changed.append(thread)
+    queryset.model.objects.bulk_update(changed, ["hot_score", "updated_at"], batch_size=batch_size)
+    return len(changed)
@@ -0,0 +1,105 @@
+import hashlib
+import re
+import markdown
+from django.contrib.auth import get_user_model
+from core.instrumentation import timed
+
+#Bump this whenever the markdown pipeline changes so stored HTML gets re-rendered
+RENDERER_VERSION = 1
+
+MARKDOWN_EXTENSIONS = ["fenced_code", "tables"]
+
+#regex pattern to find mentions
+MENTION_PATTERN = re.compile(r'@(\w+)')
+
+RENDER_FIELDS = ["content_html", "content_hash", "renderer_version"]
+
+
+def content_hash(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def mentioned_usernames(text):
+    return set(MENTION_PATTERN.findall(text or ""))
+
+
+#Resolve many @handles with one query; cache maps username -> exists
+def resolve_usernames(usernames, cache=None):
+    if cache is None:
+        cache = {}
+
+    missing = set(usernames) - cache.keys()
+    if missing:
+        User = get_user_model()
+        with timed("mentions"):
+            found = set(
+                User.objects.filter(username__in=missing).values_list("username", flat=True)
+            )
+        for username in missing:
+            cache[username] = username in found
+
+    return {username for username in usernames if cache[username]}
+
+
+#Request-scoped cache so every post on a page shares one username lookup
+def mention_cache(request):
+    if not hasattr(request, "_mention_cache"):
+        request._mention_cache = {}
+    return request._mention_cache
+
+
+def link_mentions(text, known_usernames):
+
+    def replacer(match):
+        username = match.group(1)
+
+        if username in known_usernames:
+            return f'<strong>@{username}</strong>'
+
+        return f"@{username}"
+
+    return MENTION_PATTERN.sub(replacer, text)
+
+
+def render_markdown(text, known_usernames=None):
+    if not text:
+        return ""
+
+    if known_usernames is None:
+        known_usernames = resolve_usernames(mentioned_usernames(text))
+
+    text = link_mentions(text, known_usernames)
+
+    with timed("markdown"):
+        return markdown.markdown(
+            text,
+            extensions=MARKDOWN_EXTENSIONS
+        )
+
+
+#Render a batch of threads/replies, resolving all their mentions at once
+def render_posts(posts, cache=None):
+    posts = list(posts)
+    if not posts:
+        return
+
+    usernames = set()
+    for post in posts:
+        usernames |= mentioned_usernames(post.content)
+    known_usernames = resolve_usernames(usernames, cache)
+
+    by_model = {}
+    for post in posts:
+        post.render_content(known_usernames)
+        by_model.setdefault(type(post), []).append(post)
+
+    for model, group in by_model.items():
+        model.objects.bulk_update(group, RENDER_FIELDS)
+
+
+#Re-render posts whose stored HTML came from an older renderer
+def ensure_rendered(posts, cache=None):
+    render_posts(
+        [post for post in posts if post.renderer_version != RENDERER_VERSION],
+        cache
+    )
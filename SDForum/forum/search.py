@@ -0,0 +1,175 @@
+import re
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, FloatField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from .models import Thread, Reply
+
+#Text search configuration for the Postgres tsvectors
+SEARCH_CONFIG = "english"
+
+#SQLite FTS5 table mirroring thread and reply text (created by migration 0014)
+FTS_TABLE = "forum_search"
+
+#Title hits outrank body hits, which outrank reply hits
+THREAD_VECTOR = (
+    SearchVector("title", weight="A", config=SEARCH_CONFIG) +
+    SearchVector("content", weight="B", config=SEARCH_CONFIG)
+)
+REPLY_VECTOR = SearchVector("content", weight="C", config=SEARCH_CONFIG)
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def live_threads():
+    return Thread.objects.filter(is_deleted=False).select_related("author", "category")
+
+
+#Stored tsvector + GIN index, ranked with ts_rank
+class PostgresSearchBackend:
+    def index_thread(self, thread_id):
+        Thread.objects.filter(pk=thread_id).update(search_vector=THREAD_VECTOR)
+
+    def index_reply(self, reply_id):
+        Reply.objects.filter(pk=reply_id).update(search_vector=REPLY_VECTOR)
+
+    def rebuild(self):
+        Thread.objects.update(search_vector=THREAD_VECTOR)
+        Reply.objects.update(search_vector=REPLY_VECTOR)
+
+    def search(self, query, offset, limit):
+        search_query = SearchQuery(query, search_type="websearch", config=SEARCH_CONFIG)
+        matching_replies = Reply.objects.filter(is_deleted=False, search_vector=search_query)
+        best_reply_rank = (
+            matching_replies.filter(thread=OuterRef("pk"))
+            .annotate(rank=SearchRank(F("search_vector"), search_query))
+            .order_by("-rank")
+            .values("rank")[:1]
+        )
+        threads = (
+            live_threads()
+            .filter(
+                Q(search_vector=search_query) |
+                Q(pk__in=matching_replies.values("thread_id"))
+            )
+            .annotate(
+                rank=(
+                    SearchRank(F("search_vector"), search_query) +
+                    Coalesce(Subquery(best_reply_rank), Value(0.0), output_field=FloatField())
+                )
+            )
+            .order_by("-rank", "-id")
+        )
+        return list(threads[offset:offset + limit])
+
+
+#FTS5 virtual table for dev and tests, ranked with bm25
+class SQLiteSearchBackend:
+    #rowids interleave threads (even) and replies (odd) in one table
+    def index_thread(self, thread_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [thread_id * 2])
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, body, reply, thread_id, reply_id) "
+                f"SELECT id * 2, title, content, '', id, NULL FROM forum_thread WHERE id = %s",
+                [thread_id]
+            )
+
+    def index_reply(self, reply_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [reply_id * 2 + 1])
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, body, reply, thread_id, reply_id) "
+                f"SELECT id * 2 + 1, '', '', content, thread_id, id FROM forum_reply WHERE id = %s",
+                [reply_id]
+            )
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, body, reply, thread_id, reply_id) "
+                f"SELECT id * 2, title, content, '', id, NULL FROM forum_thread"
+            )
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, body, reply, thread_id, reply_id) "
+                f"SELECT id * 2 + 1, '', '', content, thread_id, id FROM forum_reply"
+            )
+
+    def match_expression(self, query):
+        #Quote every word so user input can't inject FTS5 query syntax
+        return " ".join(
+            '"%s"' % word for word in WORD_PATTERN.findall(query)
+        )
+
+    def search(self, query, offset, limit):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+
+        #MATERIALIZED keeps bm25() inside the FTS query instead of the join
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH hit AS MATERIALIZED (
+                    SELECT thread_id, reply_id, bm25({FTS_TABLE}, 10.0, 4.0, 1.0) AS score
+                    FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s
+                )
+                SELECT hit.thread_id, MIN(hit.score) AS score
+                FROM hit
+                INNER JOIN forum_thread ON forum_thread.id = hit.thread_id
+                LEFT JOIN forum_reply ON forum_reply.id = hit.reply_id
+                WHERE NOT forum_thread.is_deleted
+                    AND (hit.reply_id IS NULL OR NOT forum_reply.is_deleted)
+                GROUP BY hit.thread_id
+                ORDER BY score, hit.thread_id DESC
+                LIMIT %s OFFSET %s
+                """,
+                [expression, limit, offset]
+            )
+            ranked = cursor.fetchall()
+
+        threads = live_threads().in_bulk([thread_id for thread_id, _ in ranked])
+        results = []
+        for thread_id, score in ranked:
+            #Deleted between the FTS query and this fetch
+            thread = threads.get(thread_id)
+            if thread is None:
+                continue
+            #bm25 is lower-is-better; flip it so rank reads like ts_rank
+            thread.rank = -score
+            results.append(thread)
+        return results
+
+
+#Unindexed icontains scan for any other database
+class FallbackSearchBackend:
+    def index_thread(self, thread_id):
+        pass
+
+    def index_reply(self, reply_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, query, offset, limit):
+        threads = live_threads().filter(
+            Q(title__icontains=query) |
+            Q(content__icontains=query) |
+            Q(pk__in=Reply.objects.filter(
+                is_deleted=False,
+                content__icontains=query
+            ).values("thread_id"))
+        ).order_by("-created_at", "-id")
+        return list(threads[offset:offset + limit])
+
+
+BACKENDS = {
+    "postgresql": PostgresSearchBackend,
+    "sqlite": SQLiteSearchBackend,
+}
+
+
+def get_search_backend():
+    return BACKENDS.get(connection.vendor, FallbackSearchBackend)()
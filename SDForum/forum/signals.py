@@ -0,0 +1,46 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .cache import invalidate_category, invalidate_thread
+from .models import Category, Thread, Reply, ThreadLike, ReplyLike
+from .search import get_search_backend
+
+SEARCHABLE_FIELDS = {"title", "content"}
+
+
+def touches_search_text(update_fields):
+    return update_fields is None or bool(SEARCHABLE_FIELDS & set(update_fields))
+
+
+#Keep the search index in step with every saved post
+@receiver(post_save, sender=Thread)
+def index_thread(sender, instance, update_fields, **kwargs):
+    if touches_search_text(update_fields):
+        get_search_backend().index_thread(instance.pk)
+
+
+@receiver(post_save, sender=Reply)
+def index_reply(sender, instance, update_fields, **kwargs):
+    if touches_search_text(update_fields):
+        get_search_backend().index_reply(instance.pk)
+
+
+#Retire cached anonymous pages that show the changed rows
+@receiver([post_save, post_delete], sender=Thread)
+def invalidate_thread_pages(sender, instance, **kwargs):
+    invalidate_thread(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Reply)
+@receiver([post_save, post_delete], sender=ThreadLike)
+def invalidate_parent_thread_pages(sender, instance, **kwargs):
+    invalidate_thread(instance.thread_id)
+
+
+@receiver([post_save, post_delete], sender=ReplyLike)
+def invalidate_reply_like_pages(sender, instance, **kwargs):
+    invalidate_thread(instance.reply.thread_id)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_pages(sender, instance, **kwargs):
+    invalidate_category(instance.slug)
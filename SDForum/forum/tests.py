@@ -0,0 +1,1701 @@
+import json
+import logging
+import math
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from io import StringIO
+from unittest import mock
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count, F
+from django.http import HttpResponseForbidden
+from django.template.loader import render_to_string
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from core.instrumentation import trace_queries
+from courses.models import Course
+from . import async_views, cache as page_cache, moderation, urls as forum_urls, view_counts, views
+from .email_utils import deliver_outbox, flush_digests, send_notification_email
+from .ranking import HOT_DECAY_SECONDS, hot_score
+from .pagination import CursorPaginator, encode_cursor
+from .rendering import RENDERER_VERSION, content_hash, render_markdown
+from .models import Category, Thread, Reply, Report, ReplyLike, Tag, ThreadLike, OutboundEmail, PendingNotification, ModerationLog
+
+User = get_user_model()
+
+#One performance log line per test request would bury the test output
+logging.getLogger("core.middleware").setLevel(logging.ERROR)
+
+class StoredRenderingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.category = Category.objects.create(name="General", slug="general")
+
+    def setUp(self):
+        cache.clear()
+
+    def create_thread(self, content):
+        return Thread.objects.create(category=self.category, author=self.author, title="Hello", content=content)
+
+    def stored(self, thread):
+        return Thread.objects.values("content_html", "content_hash", "renderer_version").get(pk=thread.pk)
+
+    def test_html_is_stored_on_save(self):
+        thread = self.create_thread("**Bold** for @author and @nobody")
+        reply = Reply.objects.create(thread=thread, author=self.author, content="*Hi*")
+
+        stored = self.stored(thread)
+        self.assertIn("<strong>Bold</strong>", stored["content_html"])
+        self.assertIn("<strong>@author</strong>", stored["content_html"])
+        self.assertNotIn("<strong>@nobody</strong>", stored["content_html"])
+        self.assertEqual(stored["content_hash"], content_hash(thread.content))
+        self.assertEqual(stored["renderer_version"], RENDERER_VERSION)
+        self.assertEqual(Reply.objects.get(pk=reply.pk).content_html, "<p><em>Hi</em></p>")
+
+    def test_only_changed_content_is_rendered_again(self):
+        thread = self.create_thread("First")
+        #Same hash and version: saving other fields keeps the stored HTML
+        Thread.objects.filter(pk=thread.pk).update(content_html="<p>kept</p>")
+        thread.refresh_from_db()
+        thread.title = "Renamed"
+        thread.save()
+        self.assertEqual(self.stored(thread)["content_html"], "<p>kept</p>")
+
+        thread.content = "Second"
+        thread.save(update_fields=["content"])
+        stored = self.stored(thread)
+        self.assertEqual(stored["content_html"], "<p>Second</p>")
+        self.assertEqual(stored["content_hash"], content_hash("Second"))
+
+    def test_older_renderer_version_is_rendered_again_on_view(self):
+        thread = self.create_thread("*New*")
+        reply = Reply.objects.create(thread=thread, author=self.author, content="*Reply*")
+        Thread.objects.filter(pk=thread.pk).update(content_html="old", renderer_version=RENDERER_VERSION - 1)
+        Reply.objects.filter(pk=reply.pk).update(content_html="old", renderer_version=RENDERER_VERSION - 1)
+
+        response = self.client.get(reverse("forum:thread_detail", args=[thread.pk]))
+        self.assertContains(response, "<em>New</em>")
+        self.assertContains(response, "<em>Reply</em>")
+        self.assertEqual(self.stored(thread)["renderer_version"], RENDERER_VERSION)
+        self.assertEqual(Reply.objects.get(pk=reply.pk).renderer_version, RENDERER_VERSION)
+
+    def test_current_pages_do_no_markdown_work(self):
+        thread = self.create_thread("*New*")
+        Reply.objects.create(thread=thread, author=self.author, content="*Reply*")
+        with mock.patch("forum.rendering.markdown.markdown") as markdown:
+            response = self.client.get(reverse("forum:thread_detail", args=[thread.pk]))
+        self.assertContains(response, "<em>Reply</em>")
+        markdown.assert_not_called()
+
+    def test_backfill_command_renders_stale_posts(self):
+        thread = self.create_thread("Body")
+        Thread.objects.bulk_create([
+            Thread(category=self.category, author=self.author, title=f"T{i}", content=f"*{i}* @author")
+            for i in range(3)
+        ])
+        Reply.objects.bulk_create([
+            Reply(thread=thread, author=self.author, content=f"*{i}*") for i in range(2)
+        ])
+
+        out = StringIO()
+        call_command("render_posts", "--batch-size", "2", stdout=out)
+        self.assertIn("Thread: rendered 3", out.getvalue())
+        self.assertIn("Reply: rendered 2", out.getvalue())
+        self.assertFalse(Thread.objects.exclude(renderer_version=RENDERER_VERSION).exists())
+        self.assertFalse(Reply.objects.exclude(renderer_version=RENDERER_VERSION).exists())
+        self.assertEqual(
+            Thread.objects.get(title="T1").content_html, "<p><em>1</em> <strong>@author</strong></p>"
+        )
+
+        out = StringIO()
+        call_command("render_posts", stdout=out)
+        self.assertIn("Thread: rendered 0", out.getvalue())
+        call_command("render_posts", "--force", stdout=out)
+        self.assertIn("Thread: rendered 4", out.getvalue())
+
+
+class MentionQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.users = [User.objects.create_user(f"user{i}", password="pw") for i in range(12)]
+        cls.category = Category.objects.create(name="General", slug="general")
+        cls.thread = Thread.objects.create(
+            category=cls.category, author=cls.author, title="Hello", content="Hi @user0 and @ghost"
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def add_replies(self, count):
+        start = Reply.objects.count()
+        for i in range(start, start + count):
+            handles = " ".join(f"@{user.username}" for user in self.users[i % 4:i % 4 + 3])
+            Reply.objects.create(thread=self.thread, author=self.author, content=f"{handles} @nobody{i}")
+
+    #Queries for one thread page whose posts all come from an older renderer
+    def stale_page_queries(self):
+        cache.clear()
+        Thread.objects.filter(pk=self.thread.pk).update(renderer_version=0)
+        Reply.objects.update(renderer_version=0)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("forum:thread_detail", args=[self.thread.pk]))
+        self.assertContains(response, "<strong>@user2</strong>")
+        return [q["sql"] for q in ctx.captured_queries]
+
+    def test_query_count_does_not_grow_with_mentions(self):
+        self.add_replies(2)
+        few = self.stale_page_queries()
+        self.add_replies(8)
+        many = self.stale_page_queries()
+
+        self.assertEqual(len(few), len(many))
+        #Every handle on the page is resolved by one username lookup
+        lookups = [sql for sql in many if 'FROM "auth_user"' in sql and '"username" IN' in sql]
+        self.assertEqual(len(lookups), 1)
+
+    def test_mentions_are_resolved_at_write_time(self):
+        self.add_replies(10)
+        url = reverse("forum:thread_detail", args=[self.thread.pk])
+        response = self.client.get(url)
+        self.assertContains(response, "<strong>@user0</strong>")
+        self.assertNotContains(response, "<strong>@ghost</strong>")
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url)
+        self.assertFalse([q for q in ctx.captured_queries if '"username" IN' in q["sql"]])
+
+
+class CounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.students = [User.objects.create_user(f"student{i}", password="pw") for i in range(2)]
+        cls.category = Category.objects.create(name="General", slug="general")
+        cls.thread = Thread.objects.create(category=cls.category, author=cls.author, title="Hello", content="Body")
+        cls.reply = Reply.objects.create(thread=cls.thread, author=cls.author, content="Reply")
+        Thread.objects.filter(pk=cls.thread.pk).update(reply_count=1)
+
+    def counts(self):
+        thread = Thread.objects.get(pk=self.thread.pk)
+        return thread.like_count, thread.reply_count, Reply.objects.get(pk=self.reply.pk).like_count
+
+    def like(self, user, times=1):
+        self.client.force_login(user)
+        for _ in range(times):
+            self.client.post(reverse("forum:thread_like", args=[self.thread.pk]))
+            self.client.post(reverse("forum:reply_like", args=[self.reply.pk]))
+
+    def test_likes_toggle(self):
+        self.like(self.students[0])
+        self.assertEqual(self.counts(), (1, 1, 1))
+        self.like(self.students[1])
+        self.assertEqual(self.counts(), (2, 1, 2))
+        self.like(self.students[0])
+        self.assertEqual(self.counts(), (1, 1, 1))
+
+    def test_repeated_toggles_match_the_like_rows(self):
+        self.like(self.students[0], times=5)
+        self.like(self.students[1], times=4)
+        self.assertEqual(self.counts(), (1, 1, 1))
+        self.assertEqual(ThreadLike.objects.filter(thread=self.thread).count(), 1)
+        self.assertEqual(ReplyLike.objects.filter(reply=self.reply).count(), 1)
+
+    def test_replies_move_the_reply_count(self):
+        self.client.force_login(self.students[0])
+        for content in ("One", "Two"):
+            self.client.post(reverse("forum:reply_create", args=[self.thread.pk]), {"content": content})
+        self.assertEqual(self.counts()[1], 3)
+
+        reply = Reply.objects.get(content="One")
+        self.client.post(reverse("forum:reply_delete", args=[reply.pk]))
+        #Deleting an already deleted reply must not count twice
+        self.client.post(reverse("forum:reply_delete", args=[reply.pk]))
+        self.assertEqual(self.counts()[1], 2)
+
+    def test_reconcile_repairs_drifted_counters(self):
+        self.like(self.students[0])
+        Thread.objects.filter(pk=self.thread.pk).update(like_count=7, reply_count=9)
+        Reply.objects.filter(pk=self.reply.pk).update(like_count=3)
+
+        out = StringIO()
+        call_command("reconcile_counters", stdout=out)
+        self.assertEqual(self.counts(), (1, 1, 1))
+        self.assertIn("Thread: repaired 1 rows", out.getvalue())
+        self.assertIn("Reply: repaired 1 rows", out.getvalue())
+
+        out = StringIO()
+        call_command("reconcile_counters", stdout=out)
+        self.assertIn("Thread: repaired 0 rows", out.getvalue())
+
+
+class CursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.category = Category.objects.create(name="General", slug="general")
+        Thread.objects.bulk_create([
+            Thread(category=cls.category, author=cls.author, title=f"T{i}", content="Body", renderer_version=1)
+            for i in range(25)
+        ])
+        #Groups of threads share created_at and like_count, so only id breaks the ties
+        now = timezone.now()
+        for i, thread in enumerate(Thread.objects.order_by("id")):
+            Thread.objects.filter(pk=thread.pk).update(
+                created_at=now - timezone.timedelta(minutes=i // 4), like_count=i % 3
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, ordering, per_page=10):
+        paginator = CursorPaginator(Thread.objects.all(), ordering, per_page)
+        expected = list(Thread.objects.order_by(*ordering).values_list("pk", flat=True))
+
+        forward, pages, page = [], [], paginator.get_page()
+        while True:
+            pages.append([t.pk for t in page])
+            forward += pages[-1]
+            if not page.has_next():
+                break
+            page = paginator.get_page(page.next_cursor)
+        self.assertEqual(forward, expected)
+
+        #Back from the last page to the first, through the same pages
+        backward, page = [], paginator.get_page(page.last_cursor)
+        while True:
+            backward.append([t.pk for t in page])
+            if not page.has_previous():
+                break
+            page = paginator.get_page(page.previous_cursor)
+        self.assertEqual(sum(backward[::-1], []), expected)
+        self.assertEqual(backward[0], expected[-len(backward[0]):])
+
+        #Stepping back then forward again returns the same page
+        second = paginator.get_page(paginator.get_page().next_cursor)
+        first = paginator.get_page(second.previous_cursor)
+        self.assertEqual([t.pk for t in first], expected[:per_page])
+        self.assertEqual([t.pk for t in paginator.get_page(first.next_cursor)], pages[1])
+
+    def test_latest_walks_every_row_once_with_ties(self):
+        self.walk(views.THREAD_ORDERINGS["latest"])
+
+    def test_popular_walks_every_row_once_with_ties(self):
+        self.walk(views.THREAD_ORDERINGS["popular"], per_page=7)
+
+    def test_bad_cursors_fall_back_to_the_first_page(self):
+        url = reverse("forum:thread_list", args=[self.category.slug])
+        first = [t.pk for t in self.client.get(url).context["page_obj"]]
+        bad = [
+            "garbage", "!!!", "e30", encode_cursor([1, 2]), encode_cursor("n"),
+            encode_cursor({"d": "x", "v": [1, 2]}), encode_cursor({"d": "n", "v": [1]}),
+            encode_cursor({"d": "n", "v": ["yesterday", "x"]}),
+            encode_cursor({"d": "n", "v": [None, None]}),
+            encode_cursor({"d": "p", "v": [[1], {"a": 1}]}),
+        ]
+        for cursor in bad:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(url, {"cursor": cursor})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([t.pk for t in response.context["page_obj"]], first)
+
+
+#Tables whose hot queries must stay on an index
+HOT_TABLES = ("forum_thread", "forum_reply", "forum_report", "forum_mention")
+
+
+def plan_for(sql, params):
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            #Tiny test tables would otherwise make a seq scan the cheapest plan
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("EXPLAIN " + sql, params)
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+#Records raw SQL and params so each statement can be EXPLAINed as it ran
+class StatementRecorder:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def plan_problems(plan):
+    problems = []
+    for line in plan:
+        if connection.vendor == "postgresql":
+            if re.search(r"Seq Scan on (%s)\b" % "|".join(HOT_TABLES), line):
+                problems.append(line.strip())
+            elif re.match(r"\s*(->\s*)?(Incremental )?Sort\b", line):
+                problems.append(line.strip())
+        else:
+            match = re.match(r"SCAN (\w+)", line)
+            if match and match.group(1) in HOT_TABLES and "INDEX" not in line:
+                problems.append(line)
+            elif "TEMP B-TREE" in line:
+                problems.append(line)
+    return problems
+
+
+class HotQueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.moderator = User.objects.create_user("mod", password="pw")
+        cls.moderator.profile.role = "MODERATOR" # type: ignore
+        cls.moderator.profile.save() # type: ignore
+
+        cls.course = Course.objects.create(code="CS F111", title="Programming", department="CS")
+        cls.categories = [
+            Category.objects.create(name=f"Category {i}", slug=f"category-{i}")
+            for i in range(3)
+        ]
+        threads = []
+        for i in range(300):
+            threads.append(Thread(
+                category=cls.categories[i % 3],
+                author=cls.author,
+                course=cls.course if i % 4 == 0 else None,
+                title=f"Thread {i}",
+                content=f"Body {i}",
+                is_deleted=i % 10 == 0,
+                like_count=i % 7,
+            ))
+        Thread.objects.bulk_create(threads)
+        cls.thread = Thread.objects.filter(is_deleted=False).first()
+
+        Reply.objects.bulk_create([
+            Reply(
+                thread=cls.thread,
+                author=cls.author,
+                content=f"Reply {i}",
+                is_deleted=i % 9 == 0,
+            )
+            for i in range(120)
+        ])
+        Report.objects.bulk_create([
+            Report(
+                reporter=cls.author,
+                thread=threads[i],
+                reason="spam",
+                status="PENDING" if i % 3 else "RESOLVED",
+            )
+            for i in range(60)
+        ])
+        ThreadLike.objects.create(thread=cls.thread, user=cls.author)
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        #A cached page would run no SQL and so prove nothing
+        cache.clear()
+
+    def assertIndexedPlans(self, url, user=None):
+        if user:
+            self.client.force_login(user)
+        recorder = StatementRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        for sql, params in recorder.statements:
+            if not sql.startswith("SELECT") or not any(f'"{t}"' in sql for t in HOT_TABLES):
+                continue
+            with transaction.atomic():
+                plan = plan_for(sql, params)
+            self.assertFalse(
+                plan_problems(plan),
+                f"{url} ran an unindexed or sorted query:\n{sql}\n" + "\n".join(plan)
+            )
+
+    def test_thread_list_latest(self):
+        self.assertIndexedPlans(reverse("forum:thread_list", args=[self.categories[0].slug]))
+
+    def test_thread_list_popular(self):
+        self.assertIndexedPlans(
+            reverse("forum:thread_list", args=[self.categories[0].slug]) + "?sort=popular"
+        )
+
+    def test_thread_list_deep_page(self):
+        url = reverse("forum:thread_list", args=[self.categories[1].slug])
+        for _ in range(3):
+            cursor = self.client.get(url).context["page_obj"].next_cursor
+            url = reverse("forum:thread_list", args=[self.categories[1].slug]) + f"?cursor={cursor}"
+        self.assertIndexedPlans(url)
+
+    def test_thread_list_hot(self):
+        self.assertIndexedPlans(
+            reverse("forum:thread_list", args=[self.categories[0].slug]) + "?sort=hot"
+        )
+
+    def test_hot_threads(self):
+        self.assertIndexedPlans(reverse("forum:hot_threads"))
+
+    def test_thread_list_most_viewed(self):
+        self.assertIndexedPlans(
+            reverse("forum:thread_list", args=[self.categories[0].slug]) + "?sort=views"
+        )
+
+    def test_thread_detail(self):
+        self.assertIndexedPlans(reverse("forum:thread_detail", args=[self.thread.pk]))
+
+    def test_thread_detail_last_page(self):
+        response = self.client.get(reverse("forum:thread_detail", args=[self.thread.pk]))
+        cursor = response.context["page_obj"].last_cursor
+        self.assertIndexedPlans(
+            reverse("forum:thread_detail", args=[self.thread.pk]) + f"?cursor={cursor}"
+        )
+
+    def test_course_threads(self):
+        self.assertIndexedPlans(reverse("forum:course_threads", args=[self.course.slug]))
+
+    def test_search_without_query(self):
+        self.assertIndexedPlans(reverse("forum:search_threads"))
+
+    def test_report_list(self):
+        self.assertIndexedPlans(reverse("forum:report_list"), user=self.moderator)
+
+
+class HotRankingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.student = User.objects.create_user("student", password="pw")
+        cls.category = Category.objects.create(name="General", slug="general")
+        cls.old = Thread.objects.create(category=cls.category, author=cls.author, title="Old", content="Body")
+        cls.new = Thread.objects.create(category=cls.category, author=cls.author, title="New", content="Body")
+        #A year of age outweighs far more likes than any thread here has
+        old_created = cls.new.created_at - timezone.timedelta(days=365)
+        Thread.objects.filter(pk=cls.old.pk).update(
+            created_at=old_created, like_count=500,
+            hot_score=hot_score(500, 0, old_created),
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_likes_and_replies_move_the_score(self):
+        self.client.force_login(self.student)
+        self.client.post(reverse("forum:thread_like", args=[self.new.pk]))
+        self.client.post(reverse("forum:reply_create", args=[self.new.pk]), {"content": "Hi"})
+
+        self.new.refresh_from_db()
+        self.assertAlmostEqual(self.new.hot_score, hot_score(1, 1, self.new.created_at))
+        self.assertAlmostEqual(
+            self.new.hot_score - hot_score(0, 0, self.new.created_at), math.log10(3)
+        )
+
+    def test_recent_activity_beats_old_likes(self):
+        response = self.client.get(reverse("forum:hot_threads"))
+        self.assertEqual([t.pk for t in response.context["page_obj"]], [self.new.pk, self.old.pk])
+
+        response = self.client.get(reverse("forum:thread_list", args=[self.category.slug]) + "?sort=popular")
+        self.assertEqual(response.context["page_obj"][0].pk, self.old.pk)
+        response = self.client.get(reverse("forum:thread_list", args=[self.category.slug]) + "?sort=hot")
+        self.assertEqual(response.context["page_obj"][0].pk, self.new.pk)
+
+    def test_ten_times_the_activity_is_worth_one_decay_period(self):
+        later = self.new.created_at + timezone.timedelta(seconds=HOT_DECAY_SECONDS)
+        self.assertAlmostEqual(hot_score(10, 0, self.new.created_at), hot_score(1, 0, later))
+
+    def test_rescore_repairs_scores_the_updates_missed(self):
+        Thread.objects.filter(pk=self.new.pk).update(like_count=20, reply_count=5)
+        out = StringIO()
+        call_command("rescore_hot_threads", stdout=out)
+
+        self.new.refresh_from_db()
+        self.assertAlmostEqual(self.new.hot_score, hot_score(20, 5, self.new.created_at))
+        self.assertIn("Rescored 1 threads", out.getvalue())
+
+    def test_rescore_retires_cached_hot_pages(self):
+        url = reverse("forum:hot_threads")
+        self.assertEqual(self.client.get(url).context["page_obj"][0].pk, self.new.pk)
+        #A data fix the incremental updates never saw
+        Thread.objects.filter(pk=self.old.pk).update(created_at=self.new.created_at + timezone.timedelta(days=1))
+        call_command("rescore_hot_threads", "--all", stdout=StringIO())
+        self.assertEqual(self.client.get(url).context["page_obj"][0].pk, self.old.pk)
+
+    def test_hot_page_answers_304_until_a_thread_changes(self):
+        url = reverse("forum:hot_threads")
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.force_login(self.student)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("forum:thread_like", args=[self.new.pk]))
+        self.client.logout()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class ViewCountTests(TestCase):
+    BROWSER = "Mozilla/5.0 (X11; Linux x86_64) Firefox/130.0"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.student = User.objects.create_user("student", password="pw")
+        cls.category = Category.objects.create(name="General", slug="general")
+        cls.threads = [
+            Thread.objects.create(category=cls.category, author=cls.author, title=f"Thread {i}", content="Body")
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        settings = override_settings(VIEW_COUNT_DIR=spool.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        #A fresh buffer, so no viewer is remembered from another test
+        self.buffer = view_counts.ViewBuffer()
+        patcher = mock.patch.object(view_counts, "buffer", self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.buffer.take)
+
+    def view(self, thread, agent=BROWSER, **headers):
+        return self.client.get(
+            reverse("forum:thread_detail", args=[thread.pk]), HTTP_USER_AGENT=agent, **headers
+        )
+
+    def flush(self):
+        self.buffer.spool()
+        return view_counts.flush_spool()
+
+    def view_count(self, thread):
+        return Thread.objects.values_list("view_count", flat=True).get(pk=thread.pk)
+
+    def test_each_viewer_counts_once(self):
+        thread = self.threads[0]
+        #The second anonymous view is answered from the page cache
+        self.view(thread)
+        self.view(thread)
+        self.view(thread, REMOTE_ADDR="10.0.0.2")
+        self.client.force_login(self.student)
+        self.view(thread)
+        self.view(thread)
+
+        self.assertEqual(self.flush(), (1, 3))
+        self.assertEqual(self.view_count(thread), 3)
+
+    def test_bots_prefetches_and_posts_are_not_counted(self):
+        thread = self.threads[0]
+        self.view(thread, agent="")
+        self.view(thread, agent="Mozilla/5.0 (compatible; Googlebot/2.1)")
+        self.view(thread, agent="curl/8.5.0")
+        self.view(thread, HTTP_SEC_PURPOSE="prefetch")
+        self.client.post(reverse("forum:thread_detail", args=[thread.pk]), HTTP_USER_AGENT=self.BROWSER)
+
+        self.assertEqual(self.flush(), (0, 0))
+        self.assertEqual(self.view_count(thread), 0)
+
+    def test_authors_own_views_are_dropped(self):
+        self.client.force_login(self.author)
+        self.view(self.threads[0])
+        self.client.force_login(self.student)
+        self.view(self.threads[0])
+
+        self.flush()
+        self.assertEqual(self.view_count(self.threads[0]), 1)
+
+    def test_flush_is_one_update_for_many_threads(self):
+        self.client.force_login(self.student)
+        for thread in self.threads:
+            self.view(thread)
+        self.client.logout()
+        self.view(self.threads[0])
+        before = Thread.objects.get(pk=self.threads[0].pk).updated_at
+        self.buffer.spool()
+
+        out = StringIO()
+        with CaptureQueriesContext(connection) as ctx:
+            call_command("flush_view_counts", stdout=out)
+        updates = [q["sql"] for q in ctx.captured_queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertIn("Added 4 views to 3 threads", out.getvalue())
+        self.assertEqual([self.view_count(t) for t in self.threads], [2, 1, 1])
+        #A view isn't an edit
+        self.assertEqual(Thread.objects.get(pk=self.threads[0].pk).updated_at, before)
+        #The spool is consumed exactly once
+        self.assertEqual(view_counts.flush_spool(), (0, 0))
+
+    def test_only_the_proxy_added_forwarded_address_counts(self):
+        thread = self.threads[0]
+        #Whatever the client puts before nginx's entry must not make a new viewer
+        self.view(thread, HTTP_X_FORWARDED_FOR="1.1.1.1, 203.0.113.9")
+        self.view(thread, HTTP_X_FORWARDED_FOR="2.2.2.2, 203.0.113.9")
+        self.view(thread, HTTP_X_FORWARDED_FOR="203.0.113.10")
+
+        self.flush()
+        self.assertEqual(self.view_count(thread), 2)
+
+    def test_failed_flush_leaves_the_spool_for_the_next_pass(self):
+        self.client.force_login(self.student)
+        for thread in self.threads[:2]:
+            self.view(thread)
+        self.buffer.spool()
+
+        with mock.patch.object(view_counts, "Case", side_effect=DatabaseError("connection lost")):
+            with self.assertRaises(DatabaseError):
+                view_counts.flush_spool()
+        self.assertEqual([self.view_count(t) for t in self.threads[:2]], [0, 0])
+
+        self.assertEqual(view_counts.flush_spool(), (2, 2))
+        self.assertEqual([self.view_count(t) for t in self.threads[:2]], [1, 1])
+
+    def test_command_requeues_files_a_dead_flusher_claimed(self):
+        self.client.force_login(self.student)
+        self.view(self.threads[0])
+        self.buffer.spool()
+        #A flusher that claimed the files and died before applying them
+        view_counts.claim_spool()
+
+        out = StringIO()
+        call_command("flush_view_counts", stdout=out)
+        self.assertIn("Requeued 1 files", out.getvalue())
+        self.assertEqual(self.view_count(self.threads[0]), 1)
+
+    def test_sort_by_views(self):
+        Thread.objects.filter(pk=self.threads[1].pk).update(view_count=50)
+        Thread.objects.filter(pk=self.threads[0].pk).update(view_count=10)
+        response = self.client.get(reverse("forum:thread_list", args=[self.category.slug]) + "?sort=views")
+        self.assertEqual(
+            [t.pk for t in response.context["page_obj"]],
+            [self.threads[1].pk, self.threads[0].pk, self.threads[2].pk],
+        )
+
+    def test_flush_refreshes_cached_pages_and_validators(self):
+        url = reverse("forum:thread_list", args=[self.category.slug]) + "?sort=views"
+        listing = self.client.get(url)
+        detail = self.view(self.threads[2])
+        self.client.force_login(self.student)
+        self.view(self.threads[2])
+        self.client.logout()
+        #Served from the page cache, with the old order
+        self.assertEqual(self.client.get(url)["ETag"], listing["ETag"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.flush()
+
+        response = self.client.get(url, headers={"if-none-match": listing["ETag"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], listing["ETag"])
+        self.assertEqual(response.context["page_obj"][0].pk, self.threads[2].pk)
+        response = self.view(self.threads[2], HTTP_IF_NONE_MATCH=detail["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "2 views")
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = view_counts.BloomFilter(bits=4096, hashes=4)
+        keys = [f"a{i}:{i % 7}" for i in range(300)]
+        self.assertFalse(bloom.add(keys[0]))
+        self.assertTrue(bloom.add(keys[0]))
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+        #Sized for a few hundred keys, unseen ones should mostly read as new
+        unseen = sum(f"b{i}" in bloom for i in range(1000))
+        self.assertLess(unseen, 100)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.category = Category.objects.create(name="General", slug="general")
+        cls.title_hit = Thread.objects.create(
+            category=cls.category, author=cls.author,
+            title="Recursion explained", content="Base cases first",
+        )
+        cls.reply_hit = Thread.objects.create(
+            category=cls.category, author=cls.author,
+            title="Midsem doubts", content="Anything goes", reply_count=1,
+        )
+        Reply.objects.create(thread=cls.reply_hit, author=cls.author, content="Try recursion here")
+        cls.deleted = Thread.objects.create(
+            category=cls.category, author=cls.author,
+            title="Recursion again", content="Old", is_deleted=True,
+        )
+
+    def search(self, query, page=1):
+        response = self.client.get(reverse("forum:search_threads"), {"q": query, "page": page})
+        self.assertEqual(response.status_code, 200)
+        return response.context
+
+    def test_title_matches_rank_above_reply_matches(self):
+        threads = self.search("recursion")["threads"]
+        self.assertEqual(threads, [self.title_hit, self.reply_hit])
+
+    def test_edits_are_reindexed_on_save(self):
+        self.title_hit.title = "Dynamic programming"
+        self.title_hit.save()
+        self.assertEqual(self.search("dynamic")["threads"], [self.title_hit])
+        self.assertEqual(self.search("recursion")["threads"], [self.reply_hit])
+
+    def test_deleted_replies_are_excluded(self):
+        self.reply_hit.replies.get().soft_delete() # type: ignore
+        self.assertEqual(self.search("recursion")["threads"], [self.title_hit])
+
+    def test_threads_deleted_mid_search_are_skipped(self):
+        #The thread goes between the ranked FTS query and the fetch of the rows
+        live = Thread.objects.filter(is_deleted=False).exclude(pk=self.reply_hit.pk)
+        with mock.patch("forum.search.live_threads", return_value=live):
+            self.assertEqual(self.search("recursion")["threads"], [self.title_hit])
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(self.search('recursion" OR NEAR(')["threads"], [])
+        self.assertEqual(self.search("***")["threads"], [])
+
+    def test_results_are_paginated(self):
+        Thread.objects.bulk_create([
+            Thread(category=self.category, author=self.author, title=f"Paging {i}", content="x")
+            for i in range(15)
+        ])
+        from .search import get_search_backend
+        get_search_backend().rebuild()
+
+        first = self.search("paging")
+        second = self.search("paging", page=2)
+        self.assertEqual(len(first["threads"]), 10)
+        self.assertTrue(first["has_next"])
+        self.assertEqual(len(second["threads"]), 5)
+        self.assertFalse(second["has_next"])
+
+
+class EmailOutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", email="author@example.com", password="pw")
+        cls.replier = User.objects.create_user("replier", password="pw")
+        cls.category = Category.objects.create(name="General", slug="general")
+        cls.thread = Thread.objects.create(
+            category=cls.category, author=cls.author, title="Hello", content="Body"
+        )
+
+    def test_posting_queues_instead_of_sending(self):
+        self.client.force_login(self.replier)
+        self.client.post(
+            reverse("forum:reply_create", args=[self.thread.pk]),
+            {"content": "Hi @author"},
+        )
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(
+            sorted(OutboundEmail.objects.values_list("subject", flat=True)),
+            ["New reply to your thread", "You were mentioned on SDForum"],
+        )
+
+    def test_identical_pending_notifications_are_deduped(self):
+        for _ in range(3):
+            send_notification_email("Subject", "Body", ["a@example.com", "a@example.com"])
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+
+    def test_worker_sends_batch_over_one_connection(self):
+        send_notification_email("Subject", "Body", ["a@example.com", "b@example.com"])
+        with mock.patch("forum.email_utils.get_connection", wraps=mail.get_connection) as factory:
+            self.assertEqual(deliver_outbox(), (2, 0))
+        factory.assert_called_once()
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ["a@example.com", "b@example.com"])
+        self.assertFalse(OutboundEmail.objects.exclude(status="SENT").exists())
+
+        #Once sent, the same notification may be queued again
+        send_notification_email("Subject", "Body", ["a@example.com"])
+        self.assertEqual(OutboundEmail.objects.filter(status="PENDING").count(), 1)
+
+    def test_failures_back_off_then_give_up(self):
+        send_notification_email("Subject", "Body", ["a@example.com"])
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=OSError("smtp down"),
+        ):
+            self.assertEqual(deliver_outbox(), (0, 1))
+            email = OutboundEmail.objects.get()
+            self.assertEqual(email.status, "PENDING")
+            self.assertGreater(email.next_attempt_at, timezone.now())
+            #Not due yet, so the next run leaves it alone
+            self.assertEqual(deliver_outbox(), (0, 0))
+
+            for _ in range(4):
+                OutboundEmail.objects.update(next_attempt_at=timezone.now())
+                deliver_outbox()
+        email.refresh_from_db()
+        self.assertEqual(email.status, "FAILED")
+        self.assertEqual(email.attempts, 5)
+        self.assertIn("smtp down", email.last_error)
+
+    def test_unreachable_server_backs_off_then_gives_up(self):
+        send_notification_email("Subject", "Body", ["a@example.com", "b@example.com"])
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.open",
+            side_effect=ConnectionRefusedError("connection refused"),
+        ), self.assertLogs("forum.email_utils", "ERROR"):
+            self.assertEqual(deliver_outbox(), (0, 2))
+            delays = []
+            for _ in range(4):
+                before = timezone.now()
+                OutboundEmail.objects.update(next_attempt_at=before)
+                deliver_outbox()
+                email = OutboundEmail.objects.first()
+                if email.status == "PENDING":
+                    delays.append((email.next_attempt_at - before).total_seconds())
+        #Exponential, not a fixed retry every BACKOFF_SECONDS
+        self.assertEqual(len(delays), 3)
+        self.assertTrue(delays[0] < delays[1] < delays[2])
+        self.assertEqual(
+            list(OutboundEmail.objects.values_list("status", "attempts").distinct()), [("FAILED", 5)]
+        )
+        self.assertIn("connection refused", OutboundEmail.objects.first().last_error)
+
+    def test_digest_users_get_one_summary_email(self):
+        self.author.profile.notification_mode = "DIGEST" # type: ignore
+        self.author.profile.save() # type: ignore
+        self.client.force_login(self.replier)
+        for i in range(5):
+            self.client.post(
+                reverse("forum:reply_create", args=[self.thread.pk]),
+                {"content": f"Reply {i} for @author"},
+            )
+        self.assertFalse(OutboundEmail.objects.exists())
+        self.assertEqual(PendingNotification.objects.count(), 10)
+
+        #Nothing is due until the oldest notification is older than the window
+        self.assertEqual(flush_digests(window_minutes=60), 0)
+        self.assertEqual(flush_digests(window_minutes=0), 1)
+        self.assertFalse(PendingNotification.objects.exists())
+
+        digest = OutboundEmail.objects.get()
+        self.assertEqual(digest.recipient, "author@example.com")
+        self.assertIn("10 new notifications", digest.body)
+        self.assertIn("- New reply to your thread: 5", digest.body)
+        self.assertIn("- You were mentioned on SDForum: 5", digest.body)
+
+
+class WritePathQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.category = Category.objects.create(name="General", slug="general")
+        cls.users = [
+            User.objects.create_user(f"user{i}", email=f"user{i}@example.com", password="pw")
+            for i in range(5)
+        ]
+        Tag.objects.create(name="existing", slug="existing")
+        cls.thread = Thread.objects.create(
+            category=cls.category, author=cls.author, title="Hello", content="Body"
+        )
+
+    def setUp(self):
+        self.client.force_login(self.author)
+
+    def create_thread(self, tags, mentions):
+        return self.client.post(
+            reverse("forum:thread_create", args=[self.category.slug]),
+            {
+                "title": "Title",
+                "content": " ".join(f"@{user.username}" for user in mentions),
+                "tags": ", ".join(tags),
+            },
+        )
+
+    def create_reply(self, mentions):
+        return self.client.post(
+            reverse("forum:reply_create", args=[self.thread.pk]),
+            {"content": " ".join(f"@{user.username}" for user in mentions)},
+        )
+
+    def test_thread_create_query_count_is_fixed(self):
+        with self.assertNumQueries(16):
+            self.create_thread(["new", "existing"], self.users[:1])
+        with self.assertNumQueries(16):
+            self.create_thread(["one", "two", "three", "four", "existing"], self.users)
+
+        thread = Thread.objects.latest("id")
+        self.assertEqual(
+            sorted(thread.tags.values_list("name", flat=True)),
+            ["existing", "four", "one", "three", "two"],
+        )
+        self.assertEqual(thread.mentions.count(), 5) # type: ignore
+
+    def test_reply_create_query_count_is_fixed(self):
+        with self.assertNumQueries(13):
+            self.create_reply(self.users[:1])
+        with self.assertNumQueries(13):
+            self.create_reply(self.users)
+        self.assertEqual(Reply.objects.latest("id").mentions.count(), 5) # type: ignore
+
+
+class ViewerStateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.viewer = User.objects.create_user("viewer", password="pw")
+        cls.category = Category.objects.create(name="General", slug="general")
+        cls.thread = Thread.objects.create(
+            category=cls.category, author=cls.author, title="Hello", content="Body", reply_count=3
+        )
+        cls.replies = [
+            Reply.objects.create(thread=cls.thread, author=user, content="Reply")
+            for user in (cls.author, cls.viewer, cls.author)
+        ]
+        ReplyLike.objects.create(reply=cls.replies[0], user=cls.viewer)
+        Report.objects.create(reporter=cls.viewer, reply=cls.replies[2], reason="spam")
+        ThreadLike.objects.create(thread=cls.thread, user=cls.viewer)
+
+    def test_flags_are_loaded_for_the_whole_page(self):
+        self.client.force_login(self.viewer)
+        response = self.client.get(reverse("forum:thread_detail", args=[self.thread.pk]))
+        thread = response.context["thread"]
+        replies = list(response.context["page_obj"])
+
+        self.assertTrue(thread.viewer_liked)
+        self.assertFalse(thread.viewer_can_delete)
+        self.assertEqual([r.viewer_liked for r in replies], [True, False, False])
+        self.assertEqual([r.viewer_reported for r in replies], [False, False, True])
+        self.assertEqual([r.viewer_can_delete for r in replies], [False, True, False])
+
+    def test_query_count_does_not_grow_with_replies(self):
+        self.client.force_login(self.viewer)
+        url = reverse("forum:thread_detail", args=[self.thread.pk])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+
+        Reply.objects.bulk_create([
+            Reply(thread=self.thread, author=self.author, content="More", renderer_version=1)
+            for _ in range(6)
+        ])
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(url)
+        self.assertEqual(len(few), len(many))
+
+
+class AnonymousPageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.category = Category.objects.create(name="General", slug="general")
+        cls.thread = Thread.objects.create(
+            category=cls.category, author=cls.author, title="Hello", content="Body"
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse("forum:thread_detail", args=[self.thread.pk])
+
+    def test_repeat_anonymous_reads_skip_rendering(self):
+        self.client.get(self.url)
+        #Only the ETag validator query runs
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertContains(response, "Hello")
+        self.assertNotIn("csrftoken", response.cookies)
+
+    def test_writes_retire_cached_pages(self):
+        list_url = reverse("forum:thread_list", args=[self.category.slug])
+        self.client.get(self.url)
+        self.client.get(list_url)
+
+        self.client.force_login(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("forum:reply_create", args=[self.thread.pk]), {"content": "Fresh reply"})
+            self.client.post(reverse("forum:thread_like", args=[self.thread.pk]))
+        self.client.logout()
+
+        response = self.client.get(self.url)
+        self.assertContains(response, "Fresh reply")
+        self.assertEqual(response.context["thread"].like_count, 1)
+        self.assertIsNotNone(self.client.get(list_url).context)
+
+    def test_logged_in_pages_are_not_cached(self):
+        self.client.force_login(self.author)
+        self.client.get(self.url)
+        response = self.client.get(self.url)
+        self.assertIsNotNone(response.context)
+
+    def test_warm_command_fills_the_cache(self):
+        call_command("warm_page_cache", threads=5, stdout=StringIO())
+        #Only the ETag validator query runs
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+    #A view whose page is never cached, and a request that finds another
+    #request already holding the lock to build it
+    def locked_forbidden_view(self, is_async=False):
+        calls = []
+        if is_async:
+            async def view(request):
+                calls.append(request)
+                return HttpResponseForbidden("Thread deleted")
+        else:
+            def view(request):
+                calls.append(request)
+                return HttpResponseForbidden("Thread deleted")
+        view = page_cache.cache_anonymous_page(lambda: ["gen:test"])(view)
+        request = RequestFactory().get("/locked/")
+        request.user = AnonymousUser()
+        lock = page_cache.page_key(request, page_cache.generations(["gen:test"])) + ":lock"
+        cache.add(lock, 1, page_cache.LOCK_SECONDS)
+        return view, request, lock, calls
+
+    def test_waiters_stop_when_an_uncacheable_holder_finishes(self):
+        for is_async in (False, True):
+            with self.subTest(is_async=is_async):
+                cache.clear()
+                view, request, lock, calls = self.locked_forbidden_view(is_async)
+                #The holder got a 403, which isn't cached, and released the lock
+                threading.Timer(0.2, cache.delete, [lock]).start()
+                started = time.monotonic()
+                response = async_to_sync(view)(request) if is_async else view(request)
+                self.assertLess(time.monotonic() - started, 1)
+                self.assertEqual(response.status_code, 403)
+                self.assertEqual(len(calls), 1)
+
+    def test_waiters_give_up_on_a_stuck_holder(self):
+        view, request, lock, calls = self.locked_forbidden_view()
+        with mock.patch.object(page_cache, "LOCK_WAIT_SECONDS", 0.3):
+            started = time.monotonic()
+            self.assertEqual(view(request).status_code, 403)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertIsNotNone(cache.get(lock))
+
+
+class ConditionalResponseTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.category = Category.objects.create(name="General", slug="general")
+        cls.thread = Thread.objects.create(
+            category=cls.category, author=cls.author, title="Hello", content="Body", reply_count=1
+        )
+        cls.reply = Reply.objects.create(thread=cls.thread, author=cls.author, content="Reply")
+
+    def setUp(self):
+        cache.clear()
+
+    def revalidate(self, url):
+        etag = self.client.get(url)["ETag"]
+        return etag, self.client.get(url, headers={"if-none-match": etag})
+
+    def test_unchanged_pages_answer_304_with_one_query(self):
+        urls = [
+            reverse("forum:category_list"),
+            reverse("forum:thread_list", args=[self.category.slug]),
+            reverse("forum:thread_detail", args=[self.thread.pk]),
+        ]
+        for url in urls:
+            etag = self.client.get(url)["ETag"]
+            with self.assertNumQueries(1):
+                response = self.client.get(url, headers={"if-none-match": etag})
+            self.assertEqual(response.status_code, 304, url)
+
+    def test_reply_like_changes_the_thread_validator(self):
+        url = reverse("forum:thread_detail", args=[self.thread.pk])
+        etag = self.client.get(url)["ETag"]
+        self.client.force_login(self.author)
+        self.client.post(reverse("forum:reply_like", args=[self.reply.pk]))
+        self.client.logout()
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_validators_vary_by_viewer(self):
+        url = reverse("forum:thread_detail", args=[self.thread.pk])
+        anonymous = self.client.get(url)
+        self.client.force_login(self.author)
+        response = self.client.get(url, headers={"if-none-match": anonymous["ETag"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Last-Modified"))
+        self.assertIn("private", response["Cache-Control"])
+
+
+class ReplyFragmentCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.category = Category.objects.create(name="General", slug="general")
+        cls.thread = Thread.objects.create(
+            category=cls.category, author=cls.author, title="Hello", content="Body", reply_count=3
+        )
+        cls.replies = [
+            Reply.objects.create(thread=cls.thread, author=cls.author, content=f"Reply **{i}**")
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.author)
+        self.url = reverse("forum:thread_detail", args=[self.thread.pk])
+
+    def fragment_renders(self):
+        with mock.patch("forum.cache.render_to_string", wraps=render_to_string) as render:
+            response = self.client.get(self.url)
+        return response, render.call_count
+
+    def test_warm_page_renders_no_fragments(self):
+        response, renders = self.fragment_renders()
+        self.assertEqual(renders, 3)
+        self.assertContains(response, "<strong>1</strong>")
+
+        response, renders = self.fragment_renders()
+        self.assertEqual(renders, 0)
+        self.assertContains(response, "<strong>1</strong>")
+
+    def test_only_the_changed_reply_is_rendered_again(self):
+        self.fragment_renders()
+        self.client.post(reverse("forum:reply_like", args=[self.replies[1].pk]))
+        response, renders = self.fragment_renders()
+        self.assertEqual(renders, 1)
+        self.assertContains(response, "btn btn-sm btn-primary", count=1)
+
+
+class ReportQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.moderator = User.objects.create_user("mod", password="pw")
+        cls.moderator.profile.role = "MODERATOR" # type: ignore
+        cls.moderator.profile.save() # type: ignore
+        cls.category = Category.objects.create(name="General", slug="general")
+        cls.threads = [
+            Thread.objects.create(
+                category=cls.category, author=cls.author, title=f"Thread {i}", content="Body"
+            )
+            for i in range(3)
+        ]
+        cls.reply = Reply.objects.create(thread=cls.threads[0], author=cls.author, content="Spam")
+        Thread.objects.filter(pk=cls.threads[0].pk).update(reply_count=1)
+
+    def setUp(self):
+        self.client.force_login(self.moderator)
+
+    def report(self, reason, thread=None, reply=None):
+        return Report.objects.create(reporter=self.author, thread=thread, reply=reply, reason=reason)
+
+    def queue(self, cursor=None):
+        response = self.client.get(reverse("forum:report_list"), {"cursor": cursor or ""})
+        self.assertEqual(response.status_code, 200)
+        return response.context["page_obj"]
+
+    def test_reports_are_grouped_by_target(self):
+        for i in range(3):
+            self.report(f"spam {i}", reply=self.reply)
+        self.report("off topic", thread=self.threads[1])
+        self.report("old", thread=self.threads[0])
+        self.report("newest", thread=self.threads[0])
+
+        rows = [(r.thread_id, r.reply_id, r.report_count, r.reason) for r in self.queue()]
+        self.assertEqual(rows, [
+            (self.threads[0].pk, None, 2, "newest"),
+            (self.threads[1].pk, None, 1, "off topic"),
+            (None, self.reply.pk, 3, "spam 2"),
+        ])
+
+    def test_query_count_does_not_grow_with_reports(self):
+        for thread in self.threads:
+            self.report("spam", thread=thread)
+        self.queue()
+        with CaptureQueriesContext(connection) as few:
+            self.queue()
+
+        for _ in range(5):
+            for thread in self.threads:
+                self.report("spam", thread=thread)
+            self.report("spam", reply=self.reply)
+        with CaptureQueriesContext(connection) as many:
+            self.queue()
+        self.assertEqual(len(few), len(many))
+
+    def test_queue_is_cursor_paginated(self):
+        Report.objects.bulk_create([
+            Report(reporter=self.author, thread=self.threads[0], reason="x") for _ in range(5)
+        ])
+        extra = [
+            Thread(category=self.category, author=self.author, title=f"T{i}", content="x")
+            for i in range(25)
+        ]
+        Thread.objects.bulk_create(extra)
+        for thread in Thread.objects.exclude(pk__in=[t.pk for t in self.threads]):
+            self.report("x", thread=thread)
+
+        first = self.queue()
+        second = self.queue(first.next_cursor)
+        self.assertEqual(len(first), 20)
+        self.assertEqual(len(second), 6)
+        self.assertFalse(second.has_next())
+
+    def test_bulk_resolve_clears_every_report_on_the_targets(self):
+        for _ in range(3):
+            self.report("spam", reply=self.reply)
+            self.report("spam", thread=self.threads[1])
+        kept = self.report("spam", thread=self.threads[2])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse("forum:report_resolve"), {
+                "action": "safe",
+                "targets": [f"reply:{self.reply.pk}", f"thread:{self.threads[1].pk}"],
+            })
+        updates = [q for q in queries if q["sql"].startswith('UPDATE "forum_report"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(list(Report.objects.filter(status="PENDING")), [kept])
+
+    def test_bulk_delete_soft_deletes_the_content(self):
+        self.report("spam", reply=self.reply)
+        self.report("spam", thread=self.threads[1])
+        self.client.post(reverse("forum:report_resolve"), {
+            "action": "delete",
+            "targets": [f"reply:{self.reply.pk}", f"thread:{self.threads[1].pk}"],
+        })
+        self.reply.refresh_from_db()
+        self.threads[1].refresh_from_db()
+        self.assertTrue(self.reply.is_deleted)
+        self.assertTrue(self.threads[1].is_deleted)
+        self.assertEqual(Thread.objects.get(pk=self.threads[0].pk).reply_count, 0)
+        self.assertFalse(Report.objects.filter(status="PENDING").exists())
+
+
+class BulkModerationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.spammer = User.objects.create_user("spammer", password="pw")
+        cls.student = User.objects.create_user("student", password="pw")
+        cls.moderator = User.objects.create_user("mod", password="pw")
+        cls.moderator.profile.role = "MODERATOR" # type: ignore
+        cls.moderator.profile.save() # type: ignore
+        cls.category = Category.objects.create(name="General", slug="general")
+
+        cls.good = Thread.objects.create(
+            category=cls.category, author=cls.student, title="Good", content="x", reply_count=3
+        )
+        cls.spam_threads = [
+            Thread.objects.create(
+                category=cls.category, author=cls.spammer, title=f"Spam {i}", content="x", reply_count=2
+            )
+            for i in range(3)
+        ]
+        cls.spam_replies = [
+            Reply.objects.create(thread=cls.good, author=cls.spammer, content="buy now")
+            for _ in range(2)
+        ]
+        cls.good_reply = Reply.objects.create(thread=cls.good, author=cls.student, content="ok")
+        for thread in cls.spam_threads:
+            Reply.objects.create(thread=thread, author=cls.student, content="reported")
+            Reply.objects.create(thread=thread, author=cls.spammer, content="bump")
+        Report.objects.create(reporter=cls.student, thread=cls.spam_threads[0], reason="spam")
+        Report.objects.create(reporter=cls.student, reply=cls.spam_replies[0], reason="spam")
+        Report.objects.create(
+            reporter=cls.student, reply=cls.spam_threads[1].replies.first(), reason="spam" # type: ignore
+        )
+
+    def test_author_sweep_cascades_and_resolves_reports(self):
+        with CaptureQueriesContext(connection) as queries:
+            entry = moderation.soft_delete(author=self.spammer, moderator=self.moderator)
+        #Fixed cost however many posts the author has, hot score rewrite included
+        self.assertLessEqual(len(queries), 14)
+
+        self.assertFalse(Thread.objects.filter(author=self.spammer, is_deleted=False).exists())
+        self.assertFalse(Reply.objects.filter(thread__in=self.spam_threads, is_deleted=False).exists())
+        self.assertEqual(Thread.objects.get(pk=self.good.pk).reply_count, 1)
+        self.assertFalse(Report.objects.filter(status="PENDING").exists())
+        self.assertEqual(
+            (entry.threads_changed, entry.replies_changed, entry.reports_resolved), (3, 8, 3)
+        )
+        self.assertEqual(ModerationLog.objects.count(), 1)
+
+    def test_restoring_a_thread_keeps_replies_deleted_on_their_own(self):
+        thread = self.spam_threads[0]
+        own = thread.replies.get(author=self.spammer) # type: ignore
+        moderation.soft_delete(reply_ids=[own.pk])
+        moderation.soft_delete(thread_ids=[thread.pk])
+        self.assertEqual(thread.replies.filter(is_deleted=False).count(), 0) # type: ignore
+
+        moderation.restore(thread_ids=[thread.pk])
+        thread.refresh_from_db()
+        self.assertFalse(thread.is_deleted)
+        self.assertEqual(list(thread.replies.filter(is_deleted=False)), [thread.replies.get(author=self.student)]) # type: ignore
+        self.assertEqual(thread.reply_count, 1)
+
+    def test_moderator_endpoint_and_command(self):
+        self.client.force_login(self.moderator)
+        self.client.post(
+            reverse("forum:moderate_author", args=[self.spammer.pk]), {"action": "delete"}
+        )
+        self.assertFalse(Thread.objects.filter(author=self.spammer, is_deleted=False).exists())
+
+        call_command("moderate", "restore", author="spammer", moderator="mod", stdout=StringIO())
+        self.assertEqual(Thread.objects.filter(author=self.spammer, is_deleted=False).count(), 3)
+        self.assertEqual(Thread.objects.get(pk=self.good.pk).reply_count, 3)
+        self.assertEqual(
+            list(ModerationLog.objects.values_list("source", flat=True)), ["COMMAND", "UI"]
+        )
+
+    def test_students_cannot_sweep_authors(self):
+        self.client.force_login(self.student)
+        response = self.client.post(
+            reverse("forum:moderate_author", args=[self.spammer.pk]), {"action": "delete"}
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_author_sweep_needs_an_explicit_action(self):
+        self.client.force_login(self.moderator)
+        url = reverse("forum:moderate_author", args=[self.spammer.pk])
+        for data in ({}, {"action": "delet"}, {"action": "safe"}):
+            with self.subTest(data=data):
+                self.assertEqual(self.client.post(url, data).status_code, 400)
+        self.assertEqual(Thread.objects.filter(author=self.spammer, is_deleted=False).count(), 3)
+        self.assertFalse(ModerationLog.objects.exists())
+
+    def test_authors_deleting_their_own_posts_is_not_moderation(self):
+        reply = self.spam_replies[0]
+        thread = self.spam_threads[0]
+        self.client.force_login(self.spammer)
+        self.client.post(reverse("forum:reply_delete", args=[reply.pk]))
+        self.client.post(reverse("forum:thread_delete", args=[thread.pk]))
+
+        self.assertTrue(Reply.objects.get(pk=reply.pk).is_deleted)
+        self.assertTrue(Thread.objects.get(pk=thread.pk).is_deleted)
+        self.assertEqual(Thread.objects.get(pk=self.good.pk).reply_count, 2)
+        self.assertFalse(ModerationLog.objects.exists())
+        self.assertEqual(Report.objects.filter(status="PENDING").count(), 3)
+
+    def test_moderators_deleting_a_post_log_it_and_resolve_reports(self):
+        self.client.force_login(self.moderator)
+        self.client.post(reverse("forum:reply_delete", args=[self.spam_replies[0].pk]))
+        self.client.post(reverse("forum:thread_delete", args=[self.spam_threads[0].pk]))
+
+        self.assertEqual(
+            list(ModerationLog.objects.values_list("moderator__username", flat=True)), ["mod", "mod"]
+        )
+        self.assertEqual(Report.objects.filter(status="PENDING").count(), 1)
+
+
+class RoleCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.student = User.objects.create_user("student", password="pw")
+        cls.category = Category.objects.create(name="General", slug="general")
+
+    def setUp(self):
+        cache.clear()
+
+    def profile_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [q for q in queries if "users_profile" in q["sql"]]
+
+    def test_role_is_cached_between_requests(self):
+        self.client.force_login(self.student)
+        url = reverse("forum:category_list")
+        _, first = self.profile_queries(url)
+        self.assertEqual(len(first), 1)
+        _, second = self.profile_queries(url)
+        self.assertEqual(second, [])
+
+    def test_role_change_takes_effect_on_next_request(self):
+        self.client.force_login(self.student)
+        url = reverse("forum:report_list")
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.student.profile.role = "MODERATOR" # type: ignore
+            self.student.profile.save() # type: ignore
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class AsyncReadPathTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.viewer = User.objects.create_user("viewer", password="pw")
+        cls.category = Category.objects.create(name="General", slug="general")
+        cls.thread = Thread.objects.create(
+            category=cls.category, author=cls.author, title="Hello", content="Body", reply_count=2
+        )
+        cls.replies = [
+            Reply.objects.create(thread=cls.thread, author=user, content=f"Reply by {user}")
+            for user in (cls.author, cls.viewer)
+        ]
+        ReplyLike.objects.create(reply=cls.replies[0], user=cls.viewer)
+        Report.objects.create(reporter=cls.viewer, thread=cls.thread, reason="spam")
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, factory, path, user=None):
+        request = factory.get(path)
+        request.user = user or AnonymousUser()
+        request.is_moderator = False
+        return request
+
+    def without_tokens(self, response):
+        return re.sub(rb'name="csrfmiddlewaretoken" value="[^"]+"', b"", response.content)
+
+    async def test_pages_match_the_sync_views(self):
+        pages = [
+            ("category_list", reverse("forum:category_list"), {}),
+            ("thread_list", reverse("forum:thread_list", args=["general"]), {"slug": "general"}),
+            ("thread_detail", reverse("forum:thread_detail", args=[self.thread.pk]), {"pk": self.thread.pk}),
+            ("search_threads", reverse("forum:search_threads") + "?q=hello", {}),
+        ]
+        for name, path, kwargs in pages:
+            for user in (None, self.viewer):
+                expected = await sync_to_async(getattr(views, name))(
+                    self.get(RequestFactory(), path, user), **kwargs
+                )
+                response = await getattr(async_views, name)(
+                    self.get(AsyncRequestFactory(), path, user), **kwargs
+                )
+                self.assertEqual(response.status_code, 200, name)
+                self.assertEqual(self.without_tokens(response), self.without_tokens(expected), name)
+
+    def test_anonymous_thread_page_is_served_from_cache(self):
+        path = reverse("forum:thread_detail", args=[self.thread.pk])
+        view = async_to_sync(async_views.thread_detail)
+        view(self.get(AsyncRequestFactory(), path), pk=self.thread.pk)
+        with CaptureQueriesContext(connection) as queries:
+            response = view(self.get(AsyncRequestFactory(), path), pk=self.thread.pk)
+        self.assertEqual(response.status_code, 200)
+        #Only the ETag validator
+        self.assertEqual(len(queries), 1)
+
+    async def test_deleted_thread_is_forbidden(self):
+        await Thread.objects.filter(pk=self.thread.pk).aupdate(is_deleted=True)
+        path = reverse("forum:thread_detail", args=[self.thread.pk])
+        response = await async_views.thread_detail(
+            self.get(AsyncRequestFactory(), path, self.viewer), pk=self.thread.pk
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class SeedAndBenchmarkTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            "seed_forum", users=20, moderators=2, threads=30, replies=200,
+            likes=300, reports=10, stdout=StringIO()
+        )
+
+    def test_seeded_counters_match_rows(self):
+        self.assertEqual(Thread.objects.count(), 30)
+        for thread in Thread.objects.annotate(
+            replies_n=Count("replies", distinct=True), likes_n=Count("likes", distinct=True)
+        ):
+            self.assertEqual((thread.reply_count, thread.like_count), (thread.replies_n, thread.likes_n))
+        self.assertFalse(Reply.objects.filter(created_at__lt=F("thread__created_at")).exists())
+
+    def test_benchmark_flags_extra_queries_against_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/baseline.json"
+            call_command("bench_views", repeat=1, only=["thread_detail"], save=path, stdout=StringIO())
+            with open(path) as f:
+                baseline = json.load(f)
+            self.assertEqual(set(baseline), {
+                "thread_detail[anonymous]", "thread_detail[student]", "thread_detail[moderator]"
+            })
+
+            baseline["thread_detail[student]"]["queries"] -= 1
+            with open(path, "w") as f:
+                json.dump(baseline, f)
+            with self.assertRaises(CommandError):
+                call_command(
+                    "bench_views", repeat=1, only=["thread_detail"], baseline=path, stdout=StringIO()
+                )
+
+
+#Queries per request for (anonymous, student, moderator), with a full page of
+#rows behind every list. A view that needs more must say why in review.
+QUERY_BUDGETS = {
+    "forum:category_list": (2, 5, 5),
+    "forum:thread_list": (3, 6, 6),
+    "forum:thread_detail": (5, 9, 9),
+    "forum:thread_create": (0, 15, 15),
+    "forum:reply_create": (0, 12, 12),
+    "forum:thread_delete": (0, 5, 16),
+    "forum:reply_delete": (0, 5, 16),
+    "forum:thread_like": (0, 10, 10),
+    "forum:reply_like": (0, 11, 11),
+    "forum:thread_lock": (0, 3, 7),
+    "forum:report_thread": (0, 4, 4),
+    "forum:report_reply": (0, 5, 5),
+    "forum:report_list": (0, 3, 4),
+    "forum:report_resolve": (0, 3, 4),
+    "forum:report_delete": (0, 3, 14),
+    "forum:report_safe": (0, 3, 5),
+    "forum:moderate_author": (0, 3, 17),
+    "forum:tag_list": (1, 3, 3),
+    "forum:tag_threads": (3, 7, 7),
+    "forum:course_list": (1, 1, 1),
+    "forum:course_threads": (3, 7, 7),
+    "forum:search_threads": (1, 4, 4),
+    "forum:hot_threads": (1, 5, 5),
+}
+
+
+def describe_queries(queries, limit=None):
+    counts = Counter(origin for _, origin in queries)
+    examples = dict((origin, sql) for sql, origin in reversed(queries))
+    return "\n".join(
+        f"  {n} x {origin}\n      {examples[origin][:160]}"
+        for origin, n in counts.most_common(limit)
+    )
+
+
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", password="pw")
+        cls.student = User.objects.create_user("student", password="pw")
+        cls.moderator = User.objects.create_user("mod", password="pw")
+        cls.moderator.profile.role = "MODERATOR" # type: ignore
+        cls.moderator.profile.save() # type: ignore
+
+        cls.category = Category.objects.create(name="General", slug="general")
+        cls.course = Course.objects.create(code="CS F111", title="Programming", department="CS")
+        cls.tag = Tag.objects.create(name="exams", slug="exams")
+        cls.thread = Thread.objects.create(
+            category=cls.category, author=cls.author, course=cls.course,
+            title="Hello", content="Body @student",
+        )
+        cls.thread.tags.add(cls.tag)
+        cls.reply = Reply.objects.create(thread=cls.thread, author=cls.author, content="Reply")
+        cls.report = Report.objects.create(reporter=cls.student, thread=cls.thread, reason="spam")
+        Report.objects.create(reporter=cls.student, reply=cls.reply, reason="spam")
+
+    def setUp(self):
+        self.clients = {"anonymous": self.client_class()}
+        for viewer in ("student", "moderator"):
+            self.clients[viewer] = self.client_class()
+            self.clients[viewer].force_login(getattr(self, viewer))
+
+    #Every list the views show gets more than a page of rows, each of which
+    #has likes, reports, tags and a course, so per-row queries would multiply
+    def populate(self, count):
+        #bulk_create skips save(), which is where the HTML is rendered
+        rendered = {
+            "content": "Body", "content_html": render_markdown("Body"),
+            "content_hash": content_hash("Body"), "renderer_version": RENDERER_VERSION,
+        }
+        threads = Thread.objects.bulk_create([
+            Thread(
+                category=self.category, author=self.author, course=self.course,
+                title=f"Thread {i}", **rendered,
+            )
+            for i in range(count)
+        ])
+        replies = Reply.objects.bulk_create([
+            Reply(thread=self.thread, author=self.author, **rendered)
+            for i in range(count)
+        ])
+        Thread.tags.through.objects.bulk_create([
+            Thread.tags.through(thread_id=thread.pk, tag_id=self.tag.pk) for thread in threads
+        ])
+        Thread.objects.filter(pk=self.thread.pk).update(reply_count=count + 1)
+        for user in (self.student, self.moderator):
+            ThreadLike.objects.bulk_create([ThreadLike(thread=t, user=user) for t in threads])
+            ReplyLike.objects.bulk_create([ReplyLike(reply=r, user=user) for r in replies])
+        Report.objects.bulk_create(
+            [Report(reporter=self.student, thread=t, reason="spam") for t in threads]
+            + [Report(reporter=self.student, reply=r, reason="spam") for r in replies]
+        )
+        Course.objects.bulk_create([
+            Course(code=f"CS F{200 + i}", slug=f"cs-f{200 + i}", title="Course", department="CS")
+            for i in range(count)
+        ])
+        Tag.objects.bulk_create([Tag(name=f"tag {i}", slug=f"tag-{i}") for i in range(count)])
+        Category.objects.bulk_create([
+            Category(name=f"Category {i}", slug=f"category-{i}") for i in range(count)
+        ])
+
+    #(path, POST data or None) for every URL name in QUERY_BUDGETS
+    def requests(self):
+        thread, reply, report = self.thread.pk, self.reply.pk, self.report.pk
+        forum = {
+            "category_list": (), "tag_list": (), "course_list": (), "report_list": (),
+            "report_resolve": (), "search_threads": (), "hot_threads": (),
+            "thread_detail": (thread,), "reply_create": (thread,), "thread_delete": (thread,),
+            "thread_like": (thread,), "report_thread": (thread,), "thread_lock": (thread,),
+            "reply_delete": (reply,), "reply_like": (reply,), "report_reply": (reply,),
+            "report_delete": (report,), "report_safe": (report,),
+            "moderate_author": (self.author.pk,),
+            "tag_threads": (self.tag.slug,), "course_threads": (self.course.slug,),
+            "thread_list": (self.category.slug,), "thread_create": (self.category.slug,),
+        }
+        posts = {
+            "thread_create": {"title": "New", "content": "Body @author", "tags": "exams, new"},
+            "reply_create": {"content": "Reply @author"},
+            "report_thread": {"reason": "spam"},
+            "report_reply": {"reason": "spam"},
+            "report_resolve": {"targets": [f"thread:{thread}", f"reply:{reply}"], "action": "safe"},
+            "moderate_author": {"action": "delete"},
+        }
+        paths = {
+            f"forum:{name}": (reverse(f"forum:{name}", args=args), posts.get(name))
+            for name, args in forum.items()
+        }
+        paths["forum:search_threads"] = (reverse("forum:search_threads") + "?q=Thread", None)
+        return paths
+
+    #Writes are rolled back, so every view sees the same rows each time
+    def measure(self, viewer, path, data):
+        cache.clear()
+        client = self.clients[viewer]
+        with transaction.atomic():
+            with trace_queries(connection) as queries:
+                response = client.get(path) if data is None else client.post(path, data)
+            transaction.set_rollback(True)
+        return response.status_code, queries
+
+    def test_every_view_has_a_budget(self):
+        names = {f"forum:{pattern.name}" for pattern in forum_urls.urlpatterns}
+        self.assertEqual(set(QUERY_BUDGETS), names)
+
+    def test_query_counts_are_fixed_and_independent_of_size(self):
+        viewers = ("anonymous", "student", "moderator")
+        small = {
+            (name, viewer): self.measure(viewer, path, data)
+            for name, (path, data) in self.requests().items()
+            for viewer in viewers
+        }
+        self.populate(25)
+
+        for name, (path, data) in self.requests().items():
+            for viewer, budget in zip(viewers, QUERY_BUDGETS[name]):
+                with self.subTest(view=name, viewer=viewer):
+                    small_status, small_queries = small[(name, viewer)]
+                    status, queries = self.measure(viewer, path, data)
+                    self.assertEqual(status, small_status)
+
+                    grown = Counter(origin for _, origin in queries)
+                    grown.subtract(origin for _, origin in small_queries)
+                    extra = [(sql, origin) for sql, origin in queries if grown[origin] > 0]
+                    self.assertLessEqual(
+                        len(queries), len(small_queries),
+                        f"{name} as {viewer} ran {len(small_queries)} queries with one row "
+                        f"per list and {len(queries)} with many; the extra ones come from:\n"
+                        + describe_queries(extra)
+                    )
+                    self.assertEqual(
+                        len(queries), budget,
+                        f"{name} as {viewer} ran {len(queries)} queries, budget {budget}:\n"
+                        + describe_queries(queries)
+                    )
@@ -1,11 +1,15 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 
 app_name = "forum"
 
+#The hot read pages come from async_views when serving over ASGI
+reads = async_views if settings.ASYNC_VIEWS else views
+
 urlpatterns = [
-    path("", views.category_list, name="category_list"),
-    path("thread/<int:pk>/", views.thread_detail, name="thread_detail"),
+    path("", reads.category_list, name="category_list"),
+    path("thread/<int:pk>/", reads.thread_detail, name="thread_detail"),
     path("thread/<int:thread_id>/reply/", views.reply_create, name="reply_create"),
     path("reply/<int:reply_id>/delete/", views.reply_delete, name="reply_delete"),
     path("thread/<int:pk>/delete/", views.thread_delete, name="thread_delete"),
@@ -14,6 +18,8 @@ urlpatterns = [
     path("thread/<int:pk>/report/", views.report_thread, name="report_thread"),
 
     path("reports/", views.report_list, name="report_list"),
+    path("reports/resolve/", views.resolve_reports, name="report_resolve"),
+    path("moderate/author/<int:user_id>/", views.moderate_author, name="moderate_author"),
     path("reports/<int:pk>/delete/", views.resolve_report_delete, name="report_delete"),
     path("reports/<int:pk>/safe/", views.resolve_report_safe, name="report_safe"),
     path("reply/<int:pk>/report/", views.report_reply, name="report_reply"),
@@ -23,11 +29,12 @@ urlpatterns = [
     path("tags/", views.tag_list, name="tag_list"),
     path("tags/<slug:slug>/", views.tag_threads, name="tag_threads"),
 
-    path("search/", views.search_threads, name="search_threads"),
+    path("search/", reads.search_threads, name="search_threads"),
+    path("hot/", views.hot_threads, name="hot_threads"),
 
     path("courses/", views.course_list, name="course_list"),
     path("courses/<slug:slug>/", views.course_threads, name="course_threads"),
 
-    path("<slug:slug>/", views.thread_list, name="thread_list"),
+    path("<slug:slug>/", reads.thread_list, name="thread_list"),
     path("<slug:slug>/new/", views.thread_create, name="thread_create"),
 ]
@@ -1,11 +1,140 @@
-import re
 from django.contrib.auth import get_user_model
+from django.db.models import Count, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from .models import Tag, Mention, ThreadLike, ReplyLike, Report
+from .rendering import mentioned_usernames
 
 User = get_user_model()
 
-#regex for mentions
-MENTION_PATTERN = r'@(\w+)'
-
 def extract_mentions(text):
-    usernames = set(re.findall(MENTION_PATTERN, text))
-    return User.objects.filter(username__in=usernames)
+    usernames = mentioned_usernames(text)
+    return User.objects.filter(username__in=usernames).select_related("profile")
+
+#Correlated COUNT of model rows pointing at the outer row through fk
+def count_of(model, fk, **filters):
+    counts = (
+        model.objects.filter(**{fk: OuterRef("pk")}, **filters)
+        .order_by()
+        .values(fk)
+        .annotate(n=Count("pk"))
+        .values("n")
+    )
+    return Coalesce(Subquery(counts), 0)
+
+#Correlated SUM of field over model rows pointing at the outer row through fk
+def sum_of(model, fk, field, **filters):
+    sums = (
+        model.objects.filter(**{fk: OuterRef("pk")}, **filters)
+        .order_by()
+        .values(fk)
+        .annotate(n=Sum(field))
+        .values("n")
+    )
+    return Coalesce(Subquery(sums), 0)
+
+#Correlated newest value of field among model rows pointing at the outer row
+def latest_of(model, fk, field="updated_at"):
+    return Subquery(
+        model.objects.filter(**{fk: OuterRef("pk")})
+        .order_by(f"-{field}")
+        .values(field)[:1]
+    )
+
+def parse_tag_names(raw):
+    names = [name.strip().lower() for name in raw.split(",")]
+    return list(dict.fromkeys(name for name in names if name))
+
+#Attach tags with a fixed number of queries, however many tags there are
+def attach_tags(thread, tag_names):
+    if not tag_names:
+        return []
+
+    tags = list(Tag.objects.filter(name__in=tag_names))
+    missing = set(tag_names) - {tag.name for tag in tags}
+    if missing:
+        slugs = [name.replace(" ", "-") for name in missing]
+        #Another request may create the same tag concurrently
+        Tag.objects.bulk_create(
+            [Tag(name=name, slug=slug) for name, slug in zip(missing, slugs)],
+            ignore_conflicts=True
+        )
+        tags += Tag.objects.filter(Q(name__in=missing) | Q(slug__in=slugs))
+
+    Through = thread.tags.through
+    Through.objects.bulk_create(
+        [Through(thread_id=thread.pk, tag_id=tag.pk) for tag in tags],
+        ignore_conflicts=True
+    )
+    return tags
+
+def create_mentions(users, thread=None, reply=None):
+    Mention.objects.bulk_create([
+        Mention(mentioned_user=user, thread=thread, reply=reply)
+        for user in users
+    ])
+
+#What the current viewer may do and has done, so templates never query per row
+class ViewerState:
+    def __init__(self, request):
+        self.user = request.user
+        self.is_authenticated = self.user.is_authenticated
+        self.is_moderator = bool(request.is_moderator)
+        self.liked_threads = set()
+        self.liked_replies = set()
+        self.reported_threads = set()
+        self.reported_replies = set()
+
+    def annotate(self, post, liked, reported):
+        post.viewer_liked = post.pk in liked
+        post.viewer_reported = post.pk in reported
+        post.viewer_is_author = self.is_authenticated and post.author_id == self.user.pk
+        post.viewer_can_delete = post.viewer_is_author or self.is_moderator
+
+    def record(self, activity):
+        for kind, pk in activity:
+            getattr(self, kind).add(pk)
+
+    def annotate_all(self, threads=(), replies=()):
+        for thread in threads:
+            self.annotate(thread, self.liked_threads, self.reported_threads)
+        for reply in replies:
+            self.annotate(reply, self.liked_replies, self.reported_replies)
+
+#The user's likes and reports matching thread_filter / reply_filter, as
+#(ViewerState set name, id) rows from one UNION; a None filter skips that kind
+#Each part gets order_by() so a default ordering added to one of these models
+#later can't put an ORDER BY inside the UNION, which SQLite rejects
+def viewer_activity(user, thread_filter=None, reply_filter=None):
+    parts = []
+    if thread_filter is not None:
+        parts += [
+            ThreadLike.objects.filter(thread_filter, user=user)
+            .order_by().values_list(Value("liked_threads"), "thread_id"),
+            Report.objects.filter(thread_filter, reporter=user)
+            .order_by().values_list(Value("reported_threads"), "thread_id"),
+        ]
+    if reply_filter is not None:
+        parts += [
+            ReplyLike.objects.filter(reply_filter, user=user)
+            .order_by().values_list(Value("liked_replies"), "reply_id"),
+            Report.objects.filter(reply_filter, reporter=user)
+            .order_by().values_list(Value("reported_replies"), "reply_id"),
+        ]
+    if not parts:
+        return []
+    return list(parts[0].union(*parts[1:], all=True))
+
+#Load likes and reports for every post on the page in one query
+def load_viewer_state(request, threads=(), replies=()):
+    viewer = ViewerState(request)
+    thread_ids = [thread.pk for thread in threads]
+    reply_ids = [reply.pk for reply in replies]
+
+    if viewer.is_authenticated:
+        viewer.record(viewer_activity(
+            viewer.user,
+            Q(thread_id__in=thread_ids) if thread_ids else None,
+            Q(reply_id__in=reply_ids) if reply_ids else None,
+        ))
+    viewer.annotate_all(threads, replies)
+    return viewer
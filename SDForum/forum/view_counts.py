@@ -0,0 +1,292 @@
+import atexit
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from .cache import bump_on_commit, category_key, thread_key
+from .models import Category, Thread
+
+logger = logging.getLogger(__name__)
+
+#Page views never write to the database. Each worker counts them in memory and
+#a background thread spools the totals to VIEW_COUNT_DIR every
+#VIEW_COUNT_SPOOL_SECONDS; `manage.py flush_view_counts --loop` adds the spooled
+#files up and applies them with one UPDATE per batch of threads. However busy
+#a thread gets, its row is locked once per flush, by one process.
+
+#Crawlers, link previews and scripts; an empty User-Agent counts as one too
+BOT_RE = re.compile(
+    r"bot|crawl|spider|slurp|preview|facebookexternalhit|curl|wget|python-|"
+    r"httpclient|okhttp|headless|phantom|lighthouse|monitor",
+    re.IGNORECASE,
+)
+
+
+def spool_dir():
+    return getattr(settings, "VIEW_COUNT_DIR", None) or os.path.join(
+        tempfile.gettempdir(), "sdforum-views"
+    )
+
+
+#Set membership in a fixed number of bits: "no" is always right, "yes" is
+#wrong with a probability that grows with the number of keys added
+class BloomFilter:
+    def __init__(self, bits, hashes):
+        self.size = bits
+        self.hashes = hashes
+        self.bits = bytearray((bits + 7) // 8)
+
+    def positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        #Double hashing: the i-th position is h1 + i * h2
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    #Adds key; True if it was (probably) there already
+    def add(self, key):
+        seen = True
+        for position in self.positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                seen = False
+                self.bits[byte] |= 1 << bit
+        return seen
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position // 8] & (1 << position % 8)
+            for position in self.positions(key)
+        )
+
+
+#Keys seen in the last window to two windows; two filters take turns, so
+#old keys age out without ever clearing a filter that is in use
+class RecentlySeen:
+    def __init__(self, window_seconds, bits, hashes=4):
+        self.window = window_seconds
+        self.bits = bits
+        self.hashes = hashes
+        self.current = BloomFilter(bits, hashes)
+        self.previous = BloomFilter(bits, hashes)
+        self.rotated = time.monotonic()
+
+    def add(self, key):
+        if time.monotonic() - self.rotated >= self.window:
+            self.previous, self.current = self.current, BloomFilter(self.bits, self.hashes)
+            self.rotated = time.monotonic()
+        return self.current.add(key) or key in self.previous
+
+
+class ViewBuffer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = Counter()
+        self.seen = None
+        self.pid = None
+        self.sequence = 0
+
+    #Forked workers inherit the parent's buffer, so it restarts per pid
+    def start(self):
+        pid = os.getpid()
+        if self.pid == pid:
+            return
+        with self.lock:
+            if self.pid == pid:
+                return
+            self.pid = pid
+            self.pending.clear()
+            self.seen = RecentlySeen(settings.VIEW_DEDUPE_SECONDS, settings.VIEW_DEDUPE_BITS)
+        threading.Thread(target=self.spool_forever, daemon=True).start()
+        atexit.register(self.spool)
+
+    #Counts one view of thread_id by viewer unless the same viewer was seen on it
+    #recently. user_id is kept so flushing can drop authors' views of their own threads.
+    def record(self, thread_id, viewer, user_id=None):
+        self.start()
+        with self.lock:
+            if self.seen.add(f"{viewer}:{thread_id}"):
+                return False
+            self.pending[(thread_id, user_id)] += 1
+        return True
+
+    def take(self):
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+        return pending
+
+    #Write everything counted so far to a new file in the spool directory
+    def spool(self):
+        if self.pid != os.getpid():
+            return
+        pending = self.take()
+        if not pending:
+            return
+        directory = spool_dir()
+        os.makedirs(directory, exist_ok=True)
+        self.sequence += 1
+        path = os.path.join(directory, f"{self.pid}-{time.time_ns()}-{self.sequence}.json")
+        rows = [[thread_id, user_id, n] for (thread_id, user_id), n in pending.items()]
+        #Write then rename, so the flusher never reads half a file
+        with open(path + ".tmp", "w") as f:
+            json.dump(rows, f)
+        os.replace(path + ".tmp", path)
+
+    def spool_forever(self):
+        while True:
+            time.sleep(settings.VIEW_COUNT_SPOOL_SECONDS)
+            try:
+                self.spool()
+            except OSError as e:
+                logger.warning(f"Could not spool view counts: {e}")
+
+
+buffer = ViewBuffer()
+
+
+def is_countable(request):
+    agent = request.headers.get("User-Agent", "")
+    if not agent or BOT_RE.search(agent):
+        return False
+    #Browsers prefetching a link the user hasn't opened
+    purpose = request.headers.get("Sec-Purpose") or request.headers.get("Purpose") or ""
+    return "prefetch" not in purpose
+
+
+#Logged-in users by id; everyone else by address and browser. nginx appends
+#the address it saw to X-Forwarded-For, so only the last entry is trusted;
+#anything before it is whatever the client sent.
+def viewer_id(request):
+    if request.user.is_authenticated:
+        return f"u{request.user.pk}"
+    address = request.META.get("HTTP_X_FORWARDED_FOR", "").split(",")[-1].strip()
+    address = address or request.META.get("REMOTE_ADDR", "")
+    agent = request.headers.get("User-Agent", "")
+    return "a" + hashlib.md5(f"{address}|{agent}".encode()).hexdigest()[:16]
+
+
+def record_view(request, thread_id, response):
+    if request.method != "GET" or response.status_code not in (200, 304):
+        return
+    if not is_countable(request):
+        return
+    user_id = request.user.pk if request.user.is_authenticated else None
+    buffer.record(thread_id, viewer_id(request), user_id)
+
+
+#Count a view of the thread page, including ones answered from the page cache
+#or with a 304, so it must go outside cache_anonymous_page and conditional_page
+def count_view(view):
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, pk, *args, **kwargs):
+            response = await view(request, pk, *args, **kwargs)
+            record_view(request, pk, response)
+            return response
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, pk, *args, **kwargs):
+        response = view(request, pk, *args, **kwargs)
+        record_view(request, pk, response)
+        return response
+    return wrapper
+
+
+#Claim every spooled file by renaming it, so workers never touch it again,
+#and add them up as {thread_id: [(user_id, views)]}. Returns the claimed paths
+#with their original names too, so a failed flush can put them back.
+def claim_spool():
+    claimed, totals = [], {}
+    for path in sorted(glob.glob(os.path.join(spool_dir(), "*.json"))):
+        mine = f"{path}.{os.getpid()}.claimed"
+        try:
+            os.replace(path, mine)
+            with open(mine) as f:
+                rows = json.load(f)
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable view count file {path}: {e}")
+            rows = []
+        claimed.append((path, mine))
+        for thread_id, user_id, n in rows:
+            totals.setdefault(thread_id, []).append((user_id, n))
+    return claimed, totals
+
+
+def release(claimed):
+    for path, mine in claimed:
+        os.replace(mine, path)
+
+
+#Put back files claimed by a flusher that died before deleting them. Only
+#safe with a single flusher, which is how docker-compose.prod.yml runs it.
+def requeue_claimed():
+    claimed = glob.glob(os.path.join(spool_dir(), "*.json.*.claimed"))
+    for mine in claimed:
+        os.replace(mine, mine.rsplit(".", 2)[0])
+    return len(claimed)
+
+
+#Apply the spool to Thread.view_count; returns (threads updated, views added).
+#updated_at is left alone: a view isn't an edit and shouldn't retire cached pages.
+#All batches commit together, so a failure leaves the spool as it was and the
+#next pass retries it; only a crash between COMMIT and deleting the files
+#counts those views twice.
+def flush_spool(batch_size=500):
+    claimed, totals = claim_spool()
+    thread_ids = sorted(totals)
+    updated = added = 0
+
+    try:
+        with transaction.atomic():
+            #Threads in id order, so row locks are always taken in the same order
+            for start in range(0, len(thread_ids), batch_size):
+                batch = thread_ids[start:start + batch_size]
+                viewed_by_users = [pk for pk in batch if any(user_id for user_id, _ in totals[pk])]
+                authors = dict(
+                    Thread.objects.filter(pk__in=viewed_by_users).values_list("pk", "author_id")
+                ) if viewed_by_users else {}
+                deltas = {}
+                for pk in batch:
+                    n = sum(n for user_id, n in totals[pk] if user_id is None or user_id != authors.get(pk))
+                    if n:
+                        deltas[pk] = n
+                if deltas:
+                    updated += Thread.objects.filter(pk__in=deltas).update(
+                        view_count=F("view_count") + Case(
+                            *[When(pk=pk, then=Value(n)) for pk, n in deltas.items()],
+                            default=Value(0),
+                            output_field=IntegerField(),
+                        )
+                    )
+                    added += sum(deltas.values())
+                    #Counts don't touch updated_at, so retire the cached pages
+                    #that show them or sort by them
+                    slugs = (
+                        Category.objects.filter(threads__pk__in=deltas)
+                        .values_list("slug", flat=True).distinct()
+                    )
+                    bump_on_commit(
+                        *[thread_key(pk) for pk in deltas],
+                        *[category_key(slug) for slug in slugs]
+                    )
+    except Exception:
+        release(claimed)
+        raise
+
+    for _, mine in claimed:
+        os.remove(mine)
+    return updated, added
@@ -1,17 +1,51 @@
+import time
+from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
 from django.shortcuts import get_object_or_404, redirect, render
-from django.http import HttpResponseForbidden
+from django.http import HttpResponseBadRequest, HttpResponseForbidden
 from django.urls import reverse
-from django.contrib.postgres.search import TrigramSimilarity
-from django.db.models import Q, Count
-from django.db.utils import ProgrammingError
-from .models import Category, Thread, Reply, ThreadLike, ReplyLike, Report, Tag, Mention
-from .email_utils import send_notification_email
-from .utils import extract_mentions
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Category, Thread, Reply, ThreadLike, ReplyLike, Report, Tag
+from .email_utils import notify_users
+from .utils import attach_tags, create_mentions, extract_mentions, load_viewer_state, parse_tag_names
+from .rendering import ensure_rendered, mention_cache
+from .pagination import CursorPaginator, last_page_cursor
+from .ranking import hot_score_update
+from .search import get_search_backend
+from .view_counts import count_view
+from . import moderation
+from .moderation import (
+    QUEUE_ORDERING, QUEUE_PAGE_SIZE, parse_targets,
+    report_queue, resolve_targets, targets_of,
+)
+from .conditional import (
+    categories_validators, category_validators, conditional_page,
+    course_validators, hot_validators, tag_validators, thread_validators,
+)
+from .cache import (
+    CATEGORIES_KEY, HOT_KEY, attach_reply_fragments, cache_anonymous_page,
+    category_key, invalidate_thread, thread_key,
+)
 from courses.models import Course
+from core.metrics import labels, registry
+from users.decorators import moderator_required
+
+PAGE_SIZE = 10
+
+#Keyset orderings; each ends in "id" so cursors are unambiguous
+THREAD_ORDERINGS = {
+    "latest": ("-created_at", "-id"),
+    "popular": ("-like_count", "-created_at", "-id"),
+    "hot": ("-hot_score", "-id"),
+    "views": ("-view_count", "-created_at", "-id"),
+}
+REPLY_ORDERING = ("created_at", "id")
 
 #List all the categories
+@conditional_page(categories_validators)
+@cache_anonymous_page(lambda: [CATEGORIES_KEY])
 def category_list(request):
     categories = Category.objects.all()
     return render(request, "forum/category_list.html", {
@@ -19,20 +53,17 @@ def category_list(request):
     })
 
 #List threads in a category
+@conditional_page(category_validators)
+@cache_anonymous_page(lambda slug: [category_key(slug)])
 def thread_list(request, slug):
     category = get_object_or_404(Category, slug = slug)
     sort = request.GET.get("sort", "latest")
-    threads = category.threads.filter(is_deleted=False) # type: ignore
+    if sort not in THREAD_ORDERINGS:
+        sort = "latest"
+    threads = category.threads.filter(is_deleted=False).select_related("author") # type: ignore
 
-    #Sorting
-    if sort == "popular":
-        threads = threads.annotate(
-            like_count = Count("likes")
-        ).order_by("-like_count", "-created_at")
-
-    paginator = Paginator(threads, 10)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(threads, THREAD_ORDERINGS[sort], PAGE_SIZE)
+    page_obj = paginator.get_page(request.GET.get("cursor"))
 
     return render(request, "forum/thread_list.html", {
         "category":category,
@@ -40,10 +71,28 @@ def thread_list(request, slug):
         "sort":sort,
     })
 
+#Hottest threads across every category, the global front page
+@conditional_page(hot_validators)
+@cache_anonymous_page(lambda: [HOT_KEY])
+def hot_threads(request):
+    threads = Thread.objects.filter(is_deleted=False).select_related("author", "category")
+
+    paginator = CursorPaginator(threads, THREAD_ORDERINGS["hot"], PAGE_SIZE)
+    page_obj = paginator.get_page(request.GET.get("cursor"))
+    viewer = load_viewer_state(request, page_obj.object_list)
+
+    return render(request, "forum/hot_threads.html", {
+        "page_obj": page_obj,
+        "viewer": viewer,
+    })
+
 #View thread details
+@count_view
+@conditional_page(thread_validators)
+@cache_anonymous_page(lambda pk: [thread_key(pk)])
 def thread_detail(request, pk):
     thread = get_object_or_404(
-        Thread.objects.select_related("author", "category"),
+        Thread.objects.select_related("author", "category").prefetch_related("tags"),
         pk = pk
     )
     if thread.is_deleted:
@@ -55,19 +104,20 @@ def thread_detail(request, pk):
         .filter(is_deleted=False)
     )
 
-    paginator = Paginator(replies_qs, 10)  
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(replies_qs, REPLY_ORDERING, PAGE_SIZE)
+    page_obj = paginator.get_page(request.GET.get("cursor"))
 
-    #Check if user liked
-    user_thread_like = False 
-    if request.user.is_authenticated:
-        user_thread_like = thread.likes.filter(user=request.user).exists() # type: ignore
+    #Only posts from an older renderer version get rendered here
+    ensure_rendered([thread, *page_obj.object_list], mention_cache(request))
+
+    #Likes, reports and permissions for the thread and this page of replies
+    viewer = load_viewer_state(request, [thread], page_obj.object_list)
+    attach_reply_fragments(page_obj.object_list)
 
     return render(request, "forum/thread_detail.html", {
         "thread": thread,
         "page_obj": page_obj,
-        "user_thread_like": user_thread_like,
+        "viewer": viewer,
     })
 
 #List all tags
@@ -95,40 +145,28 @@ def thread_create(request, slug):
             course = Course.objects.filter(id=course_id).first()
             
         if title and content:
-            thread = Thread.objects.create(
-                category = category,
-                author = request.user,
-                title = title,
-                content = content,
-                course=course
-            )
-            #Tag creation
-            for name in tag_names.split(","):
-                name = name.strip().lower().lstrip()
-                if name:
-                    tag, _ = Tag.objects.get_or_create(
-                        name=name,
-                        defaults={"slug": name.replace(" ", "-")}
-                    )
-                    thread.tags.add(tag)
-            #Handling mention
-            mentioned_users = extract_mentions(content)
-            for user in mentioned_users:
-                if user != request.user:
-                    Mention.objects.create(
-                        mentioned_user=user,
-                        thread=thread
-                    )
-            emails = [
-                user.email
-                for user in mentioned_users
-                if user != request.user and user.email
-            ]
-            send_notification_email(
-                subject="You were mentioned on SDForum",
-                message=f"You were mentioned by {request.user.username}.",
-                recipients=emails,
-            )
+            #Post, tags, mentions and queued emails commit together
+            with transaction.atomic():
+                thread = Thread.objects.create(
+                    category = category,
+                    author = request.user,
+                    title = title,
+                    content = content,
+                    course=course
+                )
+                #Tag creation
+                attach_tags(thread, parse_tag_names(tag_names))
+                #Handling mention
+                mentioned_users = [
+                    user for user in extract_mentions(content)
+                    if user != request.user
+                ]
+                create_mentions(mentioned_users, thread=thread)
+                notify_users(
+                    mentioned_users,
+                    subject="You were mentioned on SDForum",
+                    message=f"You were mentioned by {request.user.username} in: {thread.title}",
+                )
             return redirect("forum:thread_list", slug=category.slug)
     return render (request, "forum/thread_create.html", {
         "category":category,
@@ -138,7 +176,10 @@ def thread_create(request, slug):
 #Create a reply 
 @login_required
 def reply_create(request, thread_id):
-    thread = get_object_or_404(Thread, pk=thread_id)
+    thread = get_object_or_404(
+        Thread.objects.select_related("author__profile"),
+        pk=thread_id
+    )
     if thread.is_locked:
         return HttpResponseForbidden("Thread is locked.")
     
@@ -146,45 +187,42 @@ def reply_create(request, thread_id):
         content = request.POST.get("content")
 
         if content:
-            reply = Reply.objects.create(
-                thread = thread,
-                author = request.user,
-                content = content
-            )
-            #Email notification to thread author
-            if thread.author != request.user and thread.author.email:
-                send_notification_email(
-                    subject="New reply to your thread",
-                    message=(
-                        f"{request.user.username} replied to your thread:\n\n"
-                        f"{thread.title}"
-                    ),
-                    recipients=[thread.author.email],
+            with transaction.atomic():
+                reply = Reply.objects.create(
+                    thread = thread,
+                    author = request.user,
+                    content = content
                 )
-            #Handling mention 
-            mentioned_users = extract_mentions(content)
-            for user in mentioned_users:
-                if user != request.user:
-                    Mention.objects.create(
-                        mentioned_user=user,
-                        reply=reply
+                Thread.objects.filter(pk=thread.pk).update(
+                    reply_count=F("reply_count") + 1,
+                    hot_score=hot_score_update(thread.created_at, reply_count=F("reply_count") + 1),
+                    updated_at=timezone.now()
+                )
+                #Email notification to thread author
+                if thread.author != request.user:
+                    notify_users(
+                        [thread.author],
+                        subject="New reply to your thread",
+                        message=(
+                            f"{request.user.username} replied to your thread:\n\n"
+                            f"{thread.title}"
+                        ),
                     )
-            emails = [
-                user.email
-                for user in mentioned_users
-                if user != request.user and user.email
-            ]
-            send_notification_email(
-                subject="You were mentioned on SDForum",
-                message=f"You were mentioned by {request.user.username}.",
-                recipients=emails,
-            )
-            #Redirect to the last page of replies
-            reply_count = thread.replies.filter(is_deleted=False).count() # type: ignore
-            last_page = (reply_count - 1) // 10 + 1
-
+                #Handling mention 
+                mentioned_users = [
+                    user for user in extract_mentions(content)
+                    if user != request.user
+                ]
+                create_mentions(mentioned_users, reply=reply)
+                notify_users(
+                    mentioned_users,
+                    subject="You were mentioned on SDForum",
+                    message=f"You were mentioned by {request.user.username} in: {thread.title}",
+                )
+            #Redirect to the last page of replies, where the new one is
             return redirect(
-                f"{reverse('forum:thread_detail', kwargs={'pk': thread.pk})}?page={last_page}"
+                f"{reverse('forum:thread_detail', kwargs={'pk': thread.pk})}"
+                f"?cursor={last_page_cursor()}#reply-{reply.pk}"
             )
     return redirect("forum:thread_detail", pk = thread.pk)
 
@@ -193,15 +231,16 @@ def reply_create(request, thread_id):
 def thread_delete(request, pk):
     thread = get_object_or_404(Thread, pk=pk)
 
-    #Check permissions
-    profile = getattr(request.user, "profile")
-    is_moderator = profile.is_moderator if profile else False
-
-    if thread.author != request.user and not is_moderator:
+    if thread.author != request.user and not request.is_moderator:
         return HttpResponseForbidden("Not allowed")
     
-    thread.is_deleted = True
-    thread.save()
+    #Only a moderator removing someone else's post is moderation: it gets
+    #logged and clears the reports on it. Authors just take their post down.
+    if thread.author != request.user:
+        moderation.soft_delete(thread_ids=[thread.pk], moderator=request.user)
+    else:
+        thread.is_deleted = True
+        thread.save(update_fields=["is_deleted", "updated_at"])
 
     return redirect("forum:thread_list", slug=thread.category.slug)
 
@@ -210,15 +249,14 @@ def thread_delete(request, pk):
 def reply_delete(request, reply_id):
     reply = get_object_or_404(Reply, pk=reply_id)
 
-    #Check permissions
-    profile = getattr(request.user, "profile")
-    is_moderator = profile.is_moderator if profile else False
-
-    if reply.author != request.user and not is_moderator:
+    if reply.author != request.user and not request.is_moderator:
         return HttpResponseForbidden("Not allowed")
     
-    reply.is_deleted = True
-    reply.save()
+    if reply.author != request.user:
+        moderation.soft_delete(reply_ids=[reply.pk], moderator=request.user)
+    else:
+        reply.soft_delete()
+        invalidate_thread(reply.thread_id) # type: ignore
 
     return redirect("forum:thread_detail", pk=reply.thread.pk)
 
@@ -227,14 +265,23 @@ def reply_delete(request, reply_id):
 def toggle_thread_like(request, thread_id):
     thread = get_object_or_404(Thread, pk=thread_id)
 
-    like, created = ThreadLike.objects.get_or_create(
-        thread=thread,
-        user=request.user
-    )
-
-    #Toggling like
-    if not created:
-        like.delete()
+    with transaction.atomic():
+        like, created = ThreadLike.objects.get_or_create(
+            thread=thread,
+            user=request.user
+        )
+
+        #Toggling like; only count a delete that actually removed the row
+        if created:
+            delta = 1
+        else:
+            delta = -ThreadLike.objects.filter(pk=like.pk).delete()[0]
+        if delta:
+            Thread.objects.filter(pk=thread.pk).update(
+                like_count=F("like_count") + delta,
+                hot_score=hot_score_update(thread.created_at, like_count=F("like_count") + delta),
+                updated_at=timezone.now()
+            )
 
     return redirect("forum:thread_detail", pk=thread.pk)
 
@@ -242,13 +289,21 @@ def toggle_thread_like(request, thread_id):
 def toggle_reply_like(request, reply_id):
     reply = get_object_or_404(Reply, pk=reply_id)
 
-    like, created = ReplyLike.objects.get_or_create(
-        reply=reply,
-        user=request.user
-    )
-
-    if not created:
-        like.delete()
+    with transaction.atomic():
+        like, created = ReplyLike.objects.get_or_create(
+            reply=reply,
+            user=request.user
+        )
+
+        if created:
+            delta = 1
+        else:
+            delta = -ReplyLike.objects.filter(pk=like.pk).delete()[0]
+        if delta:
+            Reply.objects.filter(pk=reply.pk).update(
+                like_count=F("like_count") + delta,
+                updated_at=timezone.now()
+            )
 
     return redirect("forum:thread_detail", pk=reply.thread.pk)
 
@@ -292,82 +347,97 @@ def report_reply(request, pk):
         "type": "reply",
     })
 
-#List all reports (for moderators)
-@login_required
+#Moderator queue: one row per reported thread/reply, newest report first
+@moderator_required
 def report_list(request):
-    #Check permission
-    profile = getattr(request.user, "profile")
-    if not profile or not profile.is_moderator:
-        return HttpResponseForbidden("Not Allowed")
-
-    reports = Report.objects.filter(status="PENDING")
+    paginator = CursorPaginator(report_queue(), QUEUE_ORDERING, QUEUE_PAGE_SIZE)
+    page_obj = paginator.get_page(request.GET.get("cursor"))
 
     return render(request, "forum/report_list.html", {
-        "reports": reports
+        "page_obj": page_obj,
     })
 
-@login_required
+#Delete the reported content and clear every report on it
+@moderator_required
 def resolve_report_delete(request, pk):
     report = get_object_or_404(Report, pk=pk)
 
-    profile=getattr(request.user, "profile")
-    if not profile or not profile.is_moderator:
-        return HttpResponseForbidden()
-    
-    if report.thread:
-        report.thread.is_deleted = True
-        report.thread.save()
-    if report.reply:
-        report.reply.is_deleted = True
-        report.reply.save()
-    
-    report.status="RESOLVED"
-    report.save()
+    thread_ids, reply_ids = targets_of(report)
+    moderation.soft_delete(thread_ids, reply_ids, moderator=request.user)
 
     return redirect("forum:report_list")
 
-@login_required
+#Keep the content and clear every report on it
+@moderator_required
 def resolve_report_safe(request, pk):
     report = get_object_or_404(Report, pk=pk)
 
-    profile=getattr(request.user, "profile")
-    if not profile or not profile.is_moderator:
-        return HttpResponseForbidden()
-    
-    report.status="RESOLVED"
-    report.save()
+    resolve_targets(*targets_of(report))
+
+    return redirect("forum:report_list")
+
+#Resolve every checked target in the queue at once
+@moderator_required
+def resolve_reports(request):
+    if request.method == "POST":
+        thread_ids, reply_ids = parse_targets(request.POST.getlist("targets"))
+        if request.POST.get("action") == "delete":
+            moderation.soft_delete(thread_ids, reply_ids, moderator=request.user)
+        else:
+            resolve_targets(thread_ids, reply_ids)
+
+    return redirect("forum:report_list")
+
+#Delete or restore everything one author has posted, e.g. after a spam wave
+@moderator_required
+def moderate_author(request, user_id):
+    author = get_object_or_404(get_user_model(), pk=user_id)
+    if request.method == "POST":
+        action = request.POST.get("action")
+        if action == "restore":
+            moderation.restore(author=author, moderator=request.user)
+        elif action == "delete":
+            moderation.soft_delete(author=author, moderator=request.user)
+        else:
+            return HttpResponseBadRequest("Unknown action")
 
     return redirect("forum:report_list")
+
 #Locking system
-@login_required
+@moderator_required
 def toggle_thread_lock(request, pk):
     thread = get_object_or_404(Thread, pk=pk)
 
-    profile = getattr(request.user, "profile")
-    if not profile or not profile.is_moderator:
-        return HttpResponseForbidden("Not allowed")
-
     thread.is_locked = not thread.is_locked
     thread.save()
 
     return redirect("forum:thread_detail", pk=thread.pk)
 
 #List threads by tag
+@conditional_page(tag_validators)
 def tag_threads(request, slug):
     tag = get_object_or_404(Tag, slug=slug)
-    threads = tag.threads.select_related("author", "category") # type: ignore
+    threads = list(tag.threads.select_related("author", "category")) # type: ignore
+    viewer = load_viewer_state(request, threads)
 
     return render(request, "forum/tag_threads.html", {
         "tag": tag,
         "threads": threads,
+        "viewer": viewer,
     })
 
 #List threads by course
+@conditional_page(course_validators)
 def course_threads(request, slug):
     course = get_object_or_404(Course, slug=slug)
-    threads = course.threads.filter(is_deleted=False)
+    threads = list(course.threads.filter(is_deleted=False).select_related("category"))
+    viewer = load_viewer_state(request, threads)
 
-    return render(request, "forum/course_threads.html", {"course": course, "threads": threads})
+    return render(request, "forum/course_threads.html", {
+        "course": course,
+        "threads": threads,
+        "viewer": viewer,
+    })
 
 def course_list(request):
     courses = Course.objects.all().order_by("code")
@@ -376,28 +446,39 @@ def course_list(request):
     })
 #Search system
 def search_threads(request):
+    return render(request, "forum/search_results.html", search_context(request))
+
+def search_context(request):
     query = request.GET.get("q", "").strip()
-    threads = Thread.objects.filter(is_deleted=False)
+    try:
+        page = max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        page = 1
+    offset = (page - 1) * PAGE_SIZE
 
+    #Fetch one extra row to know whether there is a next page
     if query:
-        try:
-            threads = (
-                threads.annotate(
-                    similarity=(
-                        TrigramSimilarity("title", query) +
-                        TrigramSimilarity("content", query)
-                    )
-                )
-                .filter(similarity__gt=0.2)
-                .order_by("-similarity")
-            )
-        except ProgrammingError:
-            threads = threads.filter(
-                Q(title__icontains=query) |
-                Q(content__icontains=query)
-            )
-
-    return render(request, "forum/search_results.html", {
+        backend = get_search_backend()
+        start = time.perf_counter()
+        threads = backend.search(query, offset, PAGE_SIZE + 1)
+        registry.observe(
+            "sdforum_search_duration_seconds", time.perf_counter() - start,
+            labels(backend=type(backend).__name__)
+        )
+    else:
+        threads = list(
+            Thread.objects.filter(is_deleted=False)
+            .select_related("author", "category")
+            .order_by("-created_at")[offset:offset + PAGE_SIZE + 1]
+        )
+
+    threads, has_next = threads[:PAGE_SIZE], len(threads) > PAGE_SIZE
+    viewer = load_viewer_state(request, threads)
+
+    return {
         "query": query,
         "threads": threads,
-    })
\ No newline at end of file
+        "viewer": viewer,
+        "page": page,
+        "has_next": has_next,
+    }
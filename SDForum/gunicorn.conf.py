@@ -0,0 +1,26 @@
+import multiprocessing
+import os
+
+# Read by gunicorn from the working directory (docker-compose.prod.yml runs
+# plain `gunicorn`). ASYNC_VIEWS=1 switches to the ASGI app on uvicorn workers,
+# where one process serves many requests while they wait on the database.
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+
+# The default LocMemCache is per process: with several workers, a cache bump
+# or a role change would only reach the worker that made it. So one worker
+# unless a shared CACHE_BACKEND is configured (or WEB_CONCURRENCY says otherwise).
+if os.environ.get("CACHE_BACKEND"):
+    default_workers = multiprocessing.cpu_count() * 2 + 1
+else:
+    default_workers = 1
+workers = int(os.environ.get("WEB_CONCURRENCY", default_workers))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+
+if bool(int(os.environ.get("ASYNC_VIEWS", 0))):
+    wsgi_app = "SDForum.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+else:
+    wsgi_app = "SDForum.wsgi:application"
+    worker_class = "gthread"
+    threads = int(os.environ.get("GUNICORN_THREADS", 4))
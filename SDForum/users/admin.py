@@ -3,6 +3,6 @@ from .models import Profile
 
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
-    list_display = ("user", "role")
-    list_filter = ("role",)
+    list_display = ("user", "role", "notification_mode")
+    list_filter = ("role", "notification_mode")
     search_fields = ("user__username", "user__email")
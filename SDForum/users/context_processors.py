@@ -0,0 +1,17 @@
+#The viewer's role for every template, without touching user.profile
+class Viewer:
+    def __init__(self, request):
+        self.user = request.user
+        self.request = request
+
+    @property
+    def is_authenticated(self):
+        return self.user.is_authenticated
+
+    @property
+    def is_moderator(self):
+        return bool(getattr(self.request, "is_moderator", False))
+
+
+def viewer(request):
+    return {"viewer": Viewer(request)}
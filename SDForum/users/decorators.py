@@ -0,0 +1,14 @@
+from functools import wraps
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponseForbidden
+
+
+#Replaces the per-view profile lookup and role check
+def moderator_required(view):
+    @login_required
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.is_moderator:
+            return HttpResponseForbidden("Not allowed")
+        return view(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,73 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+from core.metrics import cache_lookup
+from .models import Profile
+
+#Role changes invalidate the entry (see users.signals); this only bounds how
+#long another process's local cache can lag behind
+ROLE_CACHE_SECONDS = getattr(settings, "ROLE_CACHE_SECONDS", 60 * 60)
+
+
+def role_cache_key(user_id):
+    return f"role:{user_id}"
+
+
+def user_role(user):
+    if not user.is_authenticated:
+        return None
+
+    key = role_cache_key(user.pk)
+    role = cache.get(key)
+    cache_lookup("role", hits=int(role is not None), misses=int(role is None))
+    if role is None:
+        role = (
+            Profile.objects.filter(user_id=user.pk)
+            .values_list("role", flat=True).first()
+        ) or ""
+        cache.set(key, role, ROLE_CACHE_SECONDS)
+    return role
+
+
+async def auser_role(user):
+    if not user.is_authenticated:
+        return None
+
+    key = role_cache_key(user.pk)
+    role = await cache.aget(key)
+    cache_lookup("role", hits=int(role is not None), misses=int(role is None))
+    if role is None:
+        role = await (
+            Profile.objects.filter(user_id=user.pk)
+            .values_list("role", flat=True).afirst()
+        ) or ""
+        await cache.aset(key, role, ROLE_CACHE_SECONDS)
+    return role
+
+
+#Sets request.is_moderator, resolved at most once per request and only if used
+class RoleMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        request.is_moderator = SimpleLazyObject(
+            lambda: user_role(request.user) == "MODERATOR"
+        )
+        return self.get_response(request)
+
+    #A lazy lookup would reach the database from the event loop, so under ASGI
+    #the user and role are resolved up front
+    async def __acall__(self, request):
+        request.user = await request.auser()
+        request.is_moderator = await auser_role(request.user) == "MODERATOR"
+        return await self.get_response(request)
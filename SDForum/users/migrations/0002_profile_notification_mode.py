@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 02:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='notification_mode',
+            field=models.CharField(choices=[('IMMEDIATE', 'Email me right away'), ('DIGEST', 'Send me a periodic digest')], default='IMMEDIATE', max_length=10),
+        ),
+    ]
@@ -8,6 +8,10 @@ class Profile(models.Model):
         ("STUDENT","student"),
         ("MODERATOR", "moderator"),
     ]
+    NOTIFICATION_CHOICES = [
+        ("IMMEDIATE", "Email me right away"),
+        ("DIGEST", "Send me a periodic digest"),
+    ]
 
     user = models.OneToOneField(User, on_delete = models.CASCADE)
     role = models.CharField(
@@ -16,9 +20,18 @@ class Profile(models.Model):
         default='STUDENT'
     )
     avatar = models.URLField(blank=True, null=True)
+    notification_mode = models.CharField(
+        max_length=10,
+        choices=NOTIFICATION_CHOICES,
+        default="IMMEDIATE"
+    )
 
     def __str__(self):
         return f"{self.user.username} ({self.role})"
     @property
     def is_moderator(self):
-        return self.role=="MODERATOR"
\ No newline at end of file
+        return self.role=="MODERATOR"
+
+    @property
+    def wants_digest(self):
+        return self.notification_mode=="DIGEST"
\ No newline at end of file
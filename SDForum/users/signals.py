@@ -1,6 +1,9 @@
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from .middleware import role_cache_key
 from .models import Profile
 
 User = get_user_model()
@@ -10,3 +13,10 @@ User = get_user_model()
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
+
+
+#Drop the cached role so the next request sees the new one
+@receiver([post_save, post_delete], sender=Profile)
+def forget_cached_role(sender, instance, **kwargs):
+    key = role_cache_key(instance.user_id)
+    transaction.on_commit(lambda: cache.delete(key))
@@ -0,0 +1,8 @@
+from django.urls import path
+from . import views
+
+app_name = "users"
+
+urlpatterns = [
+    path("notifications/", views.notification_settings, name="notification_settings"),
+]
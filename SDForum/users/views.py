@@ -0,0 +1,20 @@
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import redirect, render
+from .models import Profile
+
+#Let a user pick immediate emails or a periodic digest
+@login_required
+def notification_settings(request):
+    profile, _ = Profile.objects.get_or_create(user=request.user)
+
+    if request.method == "POST":
+        mode = request.POST.get("notification_mode")
+        if mode in dict(Profile.NOTIFICATION_CHOICES):
+            profile.notification_mode = mode
+            profile.save(update_fields=["notification_mode"])
+            return redirect("users:notification_settings")
+
+    return render(request, "users/notification_settings.html", {
+        "profile": profile,
+        "choices": Profile.NOTIFICATION_CHOICES,
+    })